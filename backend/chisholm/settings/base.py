@@ -51,7 +51,7 @@ THIRD_PARTY_APPS = [
     'wagtail.snippets',
     'wagtail.documents',
     'wagtail.images',
-    'wagtail.search',
+    'realestate.agentbox.apps.SearchConfig',  # wagtail.search, with deferred indexing for the imports
     'wagtail.admin',
     'wagtail.core',
     'wagtail.contrib.modeladmin',
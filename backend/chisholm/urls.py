@@ -28,6 +28,7 @@ from realestate.listings.sitemap import PropertySitemap
 from realestate.testimonials import urls as testimonial_urls
 from realestate.enquiries import urls as enq_urls
 from realestate import urls as re_urls
+from realestate.agentbox import urls as agentbox_urls
 from blog import urls as blog_urls
 from django.conf.urls.static import static
 
@@ -46,6 +47,7 @@ urlpatterns = [
     url(r'^testimonials/', include(testimonial_urls)),
     url(r'^properties/', include(listing_urls)),
     url(r'^enquiries/', include(enq_urls)),
+    url(r'^agentbox/', include(agentbox_urls)),
     path('sitemap.xml', views.index, {'sitemaps': sitemaps}),
     path('sitemap-<section>.xml', views.sitemap, {'sitemaps': sitemaps},
          name="django.contrib.sitemaps.views.sitemap"),
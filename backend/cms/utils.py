@@ -2,6 +2,8 @@ import requests
 from io import BytesIO
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from wagtail.images.models import Image
@@ -57,3 +59,34 @@ def wagtail_image_from_url(url):
     except Exception as e:
         print(e)
         return None
+
+
+def bulk_update(objs, fields, batch_size=None):
+    """
+    Update the given fields of saved model instances with a query per batch, rather than a save() per instance.
+    A stand in for QuerySet.bulk_update (Django 2.2+): each field is set with a CASE on the primary key.
+    As with the queryset version, save() isn't called and no signals are sent.
+
+    params:
+        objs (list): Saved instances of a single model
+        fields (list): Names of the fields to update
+        batch_size (int): Maximum instances per query, default all
+
+    Returns the number of rows updated
+    """
+    objs = list(objs)
+    if not objs or not fields:
+        return 0
+    model = type(objs[0])
+    fields = [model._meta.get_field(name) for name in fields]
+    batch_size = batch_size or len(objs)
+    updated = 0
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = {}
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch]
+            # Cast as the parameters are untyped, which Postgres would otherwise take as text
+            updates[field.attname] = Cast(Case(*whens, output_field=field), output_field=field)
+        updated += model._base_manager.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    return updated
@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from wagtail.search.apps import WagtailSearchAppConfig
 
 
 class AgentboxConfig(AppConfig):
     name = 'agentbox'
+
+
+class SearchConfig(WagtailSearchAppConfig):
+    """
+    wagtail.search, with the imports' deferred indexing installed once Wagtail's signal handlers are (see
+    indexing.py). In INSTALLED_APPS in place of 'wagtail.search'.
+    """
+
+    def ready(self):
+        super().ready()
+        from . import indexing
+        indexing.install()
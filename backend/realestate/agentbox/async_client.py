@@ -0,0 +1,198 @@
+"""
+Asyncio versions of the AgentBox API clients.
+
+Each Async* class is the matching client from .client with call() swapped for a coroutine,
+so every endpoint method keeps its signature and parameter building, and returns an awaitable:
+
+    listings = AsyncAgentBoxListings()
+    details = await asyncio.gather(*[listings.get(i) for i in listing_ids])
+
+All async clients running on the same event loop share one aiohttp session, whose connector
+caps the open sockets (AGENTBOX_ASYNC_CONNECTIONS) and keeps them alive between requests.
+Hundreds of requests can be fanned out at once; the connector queues them onto the pool.
+"""
+
+import asyncio
+import time
+import weakref
+import aiohttp
+from yarl import URL
+
+from .client import (has_next_page, AgentBoxClient, AgentBoxException, AgentBoxListings, AgentBoxContacts,
+                     AgentBoxSearchRequirements, AgentBoxOffices, AgentBoxStaff, AgentBoxLookUps, KeysetPager)
+from . import throttle
+from .settings import ASYNC_CONNECTIONS, ASYNC_KEEPALIVE_TIMEOUT, ASYNC_TIMEOUT, PAGE_SIZE
+
+_sessions = weakref.WeakKeyDictionary()  # Event loop -> aiohttp.ClientSession
+
+
+def get_async_session():
+    """
+    The aiohttp session shared by all async clients on the running event loop
+    """
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_CONNECTIONS, keepalive_timeout=ASYNC_KEEPALIVE_TIMEOUT)
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=ASYNC_TIMEOUT),
+            auto_decompress=True
+        )
+        _sessions[loop] = session
+    return session
+
+
+async def close_async_session(loop=None):
+    """
+    Close the shared session (and its sockets) for the given or current event loop
+    """
+    session = _sessions.pop(loop or asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def run(coroutine):
+    """
+    Run a coroutine from synchronous code (management commands, imports) on a fresh event loop,
+    closing the shared session when it completes.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(close_async_session(loop))
+        loop.close()
+
+
+class AsyncAgentBoxClientMixin:
+    """
+    Swaps the requests.Session based call() for an aiohttp coroutine. Must be mixed in ahead
+    of an AgentBoxClient subclass.
+    """
+
+    def create_session(self):
+        # Sessions belong to an event loop so are resolved per call, see get_async_session
+        return None
+
+    async def paginate(self, list_method, list_key, page_size=PAGE_SIZE, prefetch=False, stream=False, **kwargs):
+        """
+        Async generator version of AgentBoxClient.paginate, so iter_all() is used as:
+            async for listing in AsyncAgentBoxListings().iter_all():
+        """
+        async for _, items in self.paginate_pages(list_method, list_key, page_size=page_size, prefetch=prefetch,
+                                                  stream=stream, **kwargs):
+            for item in items:
+                yield item
+
+    async def paginate_pages(self, list_method, list_key, page_size=PAGE_SIZE, prefetch=False, start_page=1,
+                             stream=False, **kwargs):
+        """
+        Async generator version of AgentBoxClient.paginate_pages. Streaming isn't supported.
+        """
+        if stream:
+            raise AgentBoxException('The async clients do not stream responses')
+        page = start_page
+        next_page = None
+        try:
+            data = await list_method(page=page, limit=page_size, **kwargs)
+            while True:
+                response = data.get('response', {})
+                items = response.get(list_key) or []
+                more = bool(items) and has_next_page(response, page_size, len(items))
+                if more and prefetch:
+                    next_page = asyncio.ensure_future(list_method(page=page + 1, limit=page_size, **kwargs))
+
+                if items:
+                    yield page, items
+                if not more:
+                    return
+
+                page += 1
+                data = await next_page if prefetch else await list_method(page=page, limit=page_size, **kwargs)
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    async def iter_modified_pages(self, modified_after=None, page_size=PAGE_SIZE, prefetch=False, stream=False,
+                                  **kwargs):
+        """
+        Async generator version of AgentBoxClient.iter_modified_pages. Streaming isn't supported.
+        """
+        if stream:
+            raise AgentBoxException('The async clients do not stream responses')
+        self._check_list_key()
+        pager = KeysetPager(modified_after, page_size)
+        count = 0
+        next_page = None
+        try:
+            data = await self.list(**dict(kwargs, **pager.params()))
+            while True:
+                response = data.get('response', {})
+                more, fresh = pager.add(response, response.get(self.list_key) or [])
+                if more and prefetch:
+                    next_page = asyncio.ensure_future(self.list(**dict(kwargs, **pager.params())))
+
+                if fresh:
+                    count += 1
+                    yield count, fresh
+                if not more:
+                    return
+
+                data = await next_page if prefetch else await self.list(**dict(kwargs, **pager.params()))
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    async def call(self, endpoint, method=AgentBoxClient.list_method, params={}):
+        """
+        Handles the connection and authorisation to the API, rate limited and retried as per throttle.py
+        """
+        method, url = self.prepare_request(endpoint, method, params)
+        session = get_async_session()
+        # The URL is already encoded by prepare_request, so stop yarl re-quoting it
+        url = URL(url, encoded=True)
+        attempt = 0
+        while True:
+            await asyncio.sleep(throttle.reserve(endpoint))
+            started = time.monotonic()
+            try:
+                async with session.request(method.upper(), url, headers=self.get_headers()) as response:
+                    self.record_call(endpoint, started, response.status)
+                    if not throttle.should_retry(method, attempt, response.status):
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                    retry_after = throttle.parse_retry_after(response.headers.get('Retry-After'))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.record_call(endpoint, started)
+                if not throttle.should_retry(method, attempt):
+                    raise
+                retry_after = None
+            if retry_after:
+                throttle.pause(endpoint, retry_after)
+            await asyncio.sleep(throttle.retry_delay(attempt, retry_after))
+            attempt += 1
+
+
+class AsyncAgentBoxListings(AsyncAgentBoxClientMixin, AgentBoxListings):
+    pass
+
+
+class AsyncAgentBoxContacts(AsyncAgentBoxClientMixin, AgentBoxContacts):
+    pass
+
+
+class AsyncAgentBoxSearchRequirements(AsyncAgentBoxClientMixin, AgentBoxSearchRequirements):
+    pass
+
+
+class AsyncAgentBoxOffices(AsyncAgentBoxClientMixin, AgentBoxOffices):
+    pass
+
+
+class AsyncAgentBoxStaff(AsyncAgentBoxClientMixin, AgentBoxStaff):
+    pass
+
+
+class AsyncAgentBoxLookUps(AsyncAgentBoxClientMixin, AgentBoxLookUps):
+    pass
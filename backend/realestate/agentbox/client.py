@@ -8,9 +8,19 @@ Website: www.techequipt.com.au
 Updated: 2018-04-25
 """
 
+import copy
+import datetime
 import os
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import throttle
+from .streaming import StreamedList
+from .settings import BASE_URL, REQUEST_TIMEOUT, PAGE_SIZE, CONNECTIONS, CREDENTIALS_CACHE_TIMEOUT
 
 
 class AgentBoxException(Exception):
@@ -20,12 +30,149 @@ class AgentBoxException(Exception):
     pass
 
 
+def has_next_page(response, page_size, count):
+    """
+    List responses carry "current" and "last" page numbers. If they're missing a full page (count items)
+    is taken to mean there may be another.
+    """
+    try:
+        return int(response['current']) < int(response['last'])
+    except (KeyError, TypeError, ValueError):
+        return count >= page_size
+
+
+# How long before the newest record of a page iter_modified_pages requests the next from
+KEYSET_OVERLAP = datetime.timedelta(seconds=1)
+
+
+def _as_aware(value):
+    """
+    A datetime or ISO string as an aware datetime, naive ones taken to be UTC (the TIME_ZONE). None if it's empty
+    or not a datetime.
+    """
+    if isinstance(value, str):
+        try:
+            value = parse_datetime(value)
+        except ValueError:
+            return None
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def _modified(record):
+    return _as_aware(record.get('lastModified'))
+
+
+class KeysetPager:
+    """
+    Where iter_modified_pages is up to: the modifiedAfter and page number of the next page, and the records listed
+    already. Shared by the sync and async clients, which only differ in how they request a page.
+    """
+
+    def __init__(self, modified_after, page_size):
+        self.modified_after = modified_after
+        self.after = _as_aware(modified_after)
+        self.page = 1
+        self.page_size = page_size
+        self.listed = {}  # (id, lastModified): lastModified of the records listed since after
+
+    def params(self):
+        return dict(page=self.page, limit=self.page_size, orderBy='lastModified', order='ASC',
+                    modifiedAfter=self.modified_after)
+
+    def add(self, response, items):
+        """
+        Take a page and move on to the next. Returns (whether there's another page, the records not listed already)
+        """
+        more = bool(items) and has_next_page(response, self.page_size, len(items))
+        keys = {(item.get('id'), item.get('lastModified')): _modified(item) for item in items}
+        fresh = [item for item in items if (item.get('id'), item.get('lastModified')) not in self.listed]
+        self.listed.update(keys)
+        if not more:
+            return False, fresh
+
+        newest = max(keys.values()) if all(keys.values()) else None
+        start = newest - KEYSET_OVERLAP if newest else None
+        if start and fresh and (self.after is None or start > self.after):
+            self.modified_after, self.after, self.page = start.isoformat(), start, 1
+            # Records without lastModified aren't placed by it, so they're kept in case they're listed again
+            self.listed = {key: modified for key, modified in self.listed.items()
+                           if modified is None or modified >= start}
+        else:
+            # A page of records modified within the overlap, or without lastModified: on by number
+            self.page += 1
+        return True, fresh
+
+
+_credentials = None  # (key, client id, when resolved), see get_credentials
+_session = None
+_lock = threading.Lock()
+
+
+def get_credentials():
+    """
+    The (API key, client id) from the AgentBoxSettings, falling back to the Django settings then the environment.
+    Cached for the process for AGENTBOX_CREDENTIALS_CACHE_TIMEOUT seconds, or until AgentBoxSettings are saved.
+    """
+    global _credentials
+    with _lock:
+        if _credentials is None or time.monotonic() - _credentials[2] > CREDENTIALS_CACHE_TIMEOUT:
+            _credentials = _resolve_credentials() + (time.monotonic(),)
+        return _credentials[:2]
+
+
+def clear_credentials():
+    """
+    Forget the cached credentials, so the next client created resolves them again
+    """
+    global _credentials
+    with _lock:
+        _credentials = None
+
+
+def _resolve_credentials():
+    key = client_id = None
+
+    # Wagtail setting Object
+    from .models import AgentBoxSettings
+    try:
+        wagtail_setting_obj = AgentBoxSettings.objects.latest('pk')
+        key, client_id = wagtail_setting_obj.api_key, wagtail_setting_obj.client_id
+    except AgentBoxSettings.DoesNotExist:
+        pass
+
+    # Django settings
+    key = key or getattr(settings, 'AGENTBOX_API_KEY', None)
+    client_id = client_id or getattr(settings, 'AGENTBOX_CLIENT_ID', None)
+
+    # Environment variable
+    key = key or os.environ.get('AGENTBOX_API_KEY')
+    client_id = client_id or os.environ.get('AGENTBOX_CLIENT_ID')
+    return key, client_id
+
+
+def get_session():
+    """
+    The requests session shared by every client in the process. Its pool keeps up to AGENTBOX_CONNECTIONS
+    connections alive per host, so requests skip the TCP and TLS handshakes.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=CONNECTIONS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
 class AgentBoxClient:
     """
     Base Agentbox connection client. All AgentBox API classes subclass this.
     Handles connection + authorisation
     """
-    base_url = "https://api.agentboxcrm.com.au/"
+    base_url = BASE_URL
     list_method = 'get'
     create_method = 'post'
     update_method = 'put'
@@ -33,6 +180,9 @@ class AgentBoxClient:
     _client_id = None
     _session = None
     _version = "2"  # Api Requires version=2 in the parameters
+    list_key = None  # Key of the items in a list() response, for iter_all
+    stream_key = None  # Set on streaming copies of the client, see streaming()
+    stats = None  # An instrumentation.ImportStats to record each request to
 
     def __init__(self, *args, **kwargs):
         """
@@ -42,43 +192,40 @@ class AgentBoxClient:
         2. An "AgentBoxSettings" object
         3. Django settings AGENTBOX_API_KEY and AGENTBOX_CLIENT_ID
         4. Environment Variables AGENTBOX_API_KEY and AGENTBOX_CLIENT_ID
+
+        2-4 are resolved once and cached for the process, see get_credentials, so clients are cheap to create.
         """
         if kwargs.get('key') and kwargs.get('client_id'):
-            self._key = kwargs['key']
-            self._client_id = kwargs['client_id']
+            self._key, self._client_id = kwargs['key'], kwargs['client_id']
         else:
-            # Wagtail setting Object
-            try:
-                from .models import AgentBoxSettings
-                wagtail_setting_obj = AgentBoxSettings.objects.latest('pk')
-                self._key = kwargs.get('key', wagtail_setting_obj.api_key)
-                self._client_id = kwargs.get('key', wagtail_setting_obj.client_id)
-            except (ImportError, AgentBoxSettings.DoesNotExist):
-                pass
-
-            # Django settings
-            try:
-                self._key = self._key or settings.AGENTBOX_API_KEY
-                self._client_id = self._client_id or settings.AGENTBOX_CLIENT_ID
-            except ValueError:
-                pass
-
-            # Environment variable
-            self._key = self._key or os.environ.get('AGENTBOX_API_KEY')
-            self._client_id = self._client_id or os.environ.get('AGENTBOX_CLIENT_ID')
+            key, client_id = get_credentials()
+            self._key = kwargs.get('key') or key
+            self._client_id = kwargs.get('client_id') or client_id
 
         if not self._key:
             raise AgentBoxException("API Key required")
 
-        self._session = requests.Session()
-        self._session.headers.update({'X-API-Key': self._key, 'X-Client-ID': self._client_id})
+        self._session = self.create_session()
+
+    def create_session(self):
+        # Shared by every client, so the credentials are sent per request by call()
+        return get_session()
+
+    def get_headers(self):
+        return {
+            'X-API-Key': self._key,
+            'X-Client-ID': self._client_id,
+            'Accept-Encoding': 'gzip, deflate',
+        }
 
     def build_url(self, endpoint):
         return self.base_url + endpoint + '?version=%s' % self._version
 
-    def call(self, endpoint, method=list_method, params={}):
+    def prepare_request(self, endpoint, method=list_method, params={}):
         """
-        Handles the connection and authorisation to the API
+        Validate the method and build the full request URL, query string included.
+        Shared by the sync and async clients so both always send identical requests.
+        Returns (method, url)
         """
         full_url = self.build_url(endpoint)
         safe_methods = [self.list_method, self.update_method, self.create_method]
@@ -89,11 +236,182 @@ class AgentBoxClient:
         # We will clean the params to remove empty items
         params = {k: v for k, v in params.items() if v}
 
-        request = getattr(self._session, method)
-        response = request(full_url, params=params)
+        return method, requests.Request(method.upper(), full_url, params=params).prepare().url
+
+    def iter_all(self, page_size=PAGE_SIZE, prefetch=False, stream=False, **kwargs):
+        """
+        Lazily yield every item from list(), requesting page after page as the previous is consumed.
+        kwargs are passed to list() (filters, include, order etc.)
+        See paginate.
+        """
+        self._check_list_key()
+        return self.paginate(self.list, self.list_key, page_size=page_size, prefetch=prefetch, stream=stream,
+                             **kwargs)
+
+    def iter_pages(self, page_size=PAGE_SIZE, prefetch=False, start_page=1, stream=False, **kwargs):
+        """
+        As iter_all, but yields (page number, items) per page, i.e for checkpointing progress.
+        """
+        self._check_list_key()
+        return self.paginate_pages(self.list, self.list_key, page_size=page_size, prefetch=prefetch,
+                                   start_page=start_page, stream=stream, **kwargs)
+
+    def iter_modified_pages(self, modified_after=None, page_size=PAGE_SIZE, prefetch=False, stream=False, **kwargs):
+        """
+        As iter_pages, oldest modified first, but paged by keyset rather than page number: each page is the first
+        of the records modified after the newest on the page before. A record modified while the pages are read
+        moves to the end of the order, which shifts the records of the pages after it back one, so paging by number
+        would skip one. Here it's listed again at the end instead.
+
+        modifiedAfter is exclusive, so it's requested KEYSET_OVERLAP before the newest record, not to miss any others
+        modified at the same time, and the records listed already are skipped. Yields (page count, items).
+        modified_after is a datetime or ISO string, naive ones being taken as UTC.
+        When streaming each page is read in full before it's yielded, its newest record being needed for the next.
+        """
+        self._check_list_key()
+        list_method = getattr(self.streaming(self.list_key), 'list') if stream else self.list
+
+        def fetch(params):
+            params = dict(kwargs, **params)
+            if not stream:
+                response = list_method(**params).get('response', {})
+                return response, response.get(self.list_key) or []
+            with list_method(**params) as listed:
+                items = list(listed.items)
+                listed.finish()
+            return listed.response, items
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        pager = KeysetPager(modified_after, page_size)
+        count = 0
+        try:
+            result = fetch(pager.params())
+            while True:
+                more, fresh = pager.add(*result)
+                if more and prefetch:
+                    next_result = executor.submit(fetch, pager.params())
+
+                if fresh:
+                    count += 1
+                    yield count, fresh
+                if not more:
+                    return
+                result = next_result.result() if prefetch else fetch(pager.params())
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
+    def _check_list_key(self):
+        if not self.list_key:
+            raise AgentBoxException("%s does not support pagination" % self.__class__.__name__)
+
+    def paginate(self, list_method, list_key, page_size=PAGE_SIZE, prefetch=False, stream=False, **kwargs):
+        """
+        Generator over every item of a paginated endpoint, i.e paginate(lookups.regions, 'regions').
+        Only the current page is held in memory, plus the next when prefetch is True, in which case the
+        next page is requested in the background while the current one is being processed.
+        With stream True each item is parsed from the response as it's read instead, so only the current
+        item is held in memory (see streaming.py). Pages aren't prefetched when streaming.
+        """
+        for _, items in self.paginate_pages(list_method, list_key, page_size=page_size, prefetch=prefetch,
+                                            stream=stream, **kwargs):
+            yield from items
+
+    def paginate_pages(self, list_method, list_key, page_size=PAGE_SIZE, prefetch=False, start_page=1,
+                       stream=False, **kwargs):
+        """
+        Generator of (page number, items) for each page of a paginated endpoint, from start_page on.
+        See paginate. When streaming, items is an iterator that must be used before the next page is requested.
+        """
+        if stream:
+            yield from self._paginate_stream(list_method, list_key, page_size, start_page, **kwargs)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        page = start_page
+        try:
+            data = list_method(page=page, limit=page_size, **kwargs)
+            while True:
+                response = data.get('response', {})
+                items = response.get(list_key) or []
+                more = bool(items) and has_next_page(response, page_size, len(items))
+                if more and prefetch:
+                    next_page = executor.submit(list_method, page=page + 1, limit=page_size, **kwargs)
+
+                if items:
+                    yield page, items
+                if not more:
+                    return
+
+                page += 1
+                data = next_page.result() if prefetch else list_method(page=page, limit=page_size, **kwargs)
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
+    def _paginate_stream(self, list_method, list_key, page_size, start_page, **kwargs):
+        # The same list method, on a copy of the client that streams its responses
+        list_method = getattr(self.streaming(list_key), list_method.__name__)
+        page = start_page
+        while True:
+            with list_method(page=page, limit=page_size, **kwargs) as listed:
+                yield page, listed.items
+                listed.finish()
+            if not listed.count or not has_next_page(listed.response, page_size, listed.count):
+                return
+            page += 1
+
+    def streaming(self, list_key):
+        """
+        A copy of the client whose calls return a streaming.StreamedList of the response's list_key,
+        rather than the decoded response. Shares the client's session and stats.
+        """
+        client = copy.copy(self)
+        client.stream_key = list_key
+        return client
+
+    def call(self, endpoint, method=list_method, params={}):
+        """
+        Handles the connection and authorisation to the API.
+        Requests are rate limited and retried with backoff as per throttle.py
+        """
+        method, url = self.prepare_request(endpoint, method, params)
+        stream = self.stream_key is not None
+        attempt = 0
+        while True:
+            throttle.acquire(endpoint)
+            started = time.monotonic()
+            try:
+                response = self._session.request(method.upper(), url, headers=self.get_headers(),
+                                                 timeout=REQUEST_TIMEOUT, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                self.record_call(endpoint, started)
+                if not throttle.should_retry(method, attempt):
+                    raise
+                time.sleep(throttle.retry_delay(attempt))
+            else:
+                self.record_call(endpoint, started, response.status_code)
+                if not throttle.should_retry(method, attempt, response.status_code):
+                    break
+                response.close()
+                retry_after = throttle.parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after:
+                    throttle.pause(endpoint, retry_after)
+                time.sleep(throttle.retry_delay(attempt, retry_after))
+            attempt += 1
+
+        if stream:
+            if not response.ok:
+                response.close()
+            response.raise_for_status()
+            return StreamedList(response, self.stream_key)
         response.raise_for_status()
         return response.json()
 
+    def record_call(self, endpoint, started, status=None):
+        if self.stats is not None:
+            self.stats.api_call(endpoint, time.monotonic() - started, status)
+
 
 class AgentBoxListings(AgentBoxClient):
     """
@@ -101,10 +419,16 @@ class AgentBoxListings(AgentBoxClient):
     on a specific listing. 
     """
     endpoint = 'listings'
+    list_key = 'listings'
 
     # 'Get' has a somewhat extensive list of includes that we will almost always want.
     default_get_include = "inspectionDates,relatedStaffMembers,externalLinks,documents,floorPlans,images"
 
+    # The subset of those the list endpoint can return too, plus mainImage to tell when photos have changed.
+    # The remainder (detail_only_fields) are only available from 'get'.
+    default_list_include = "inspectionDates,relatedStaffMembers,documents,mainDescription,mainImage"
+    detail_only_fields = ('externalLinks', 'floorPlans', 'images')
+
     def list(self, page=1, limit=20, include="", orderBy="", order="", **filters):
         """
         Expected Parameters:
@@ -179,6 +503,8 @@ class AgentBoxContacts(AgentBoxClient):
     have search requirements and include a log of their activities.
     This is a read-write API.
     """
+    endpoint = 'contacts'
+    list_key = 'contacts'
 
     def list(self, page=1, limit=20, include="", orderBy="", order="", **filters):
         """
@@ -232,7 +558,7 @@ class AgentBoxContacts(AgentBoxClient):
                 reqListingType (Sale|Lease - Search Requirements)
                 reqMatchListingId (Match search requirements to a specific listing across all contacts)
         """
-        payload_filters = {'filter[%s]' % key: value for key, value in filters}
+        payload_filters = {'filter[%s]' % key: value for key, value in filters.items()}
         payload_filters.update({
             'page': page,
             'limit': limit,
@@ -385,6 +711,7 @@ class AgentBoxSearchRequirements(AgentBoxClient):
     This is used for buyer matching and property alerts.
     """
     endpoint = "search-requirements"
+    list_key = 'searchRequirements'
 
     def list(self, page=1, limit=20, include="", orderBy="", order="", **filters):
         """
@@ -402,7 +729,7 @@ class AgentBoxSearchRequirements(AgentBoxClient):
             createdBefore,
             createdAfter
         """
-        payload_filters = {'filter[%s]' % key: value for key, value in filters}
+        payload_filters = {'filter[%s]' % key: value for key, value in filters.items()}
         payload_filters.update({
             'page': page,
             'limit': limit,
@@ -486,6 +813,7 @@ class AgentBoxOffices(AgentBoxClient):
     This is a read only API to retrieve office details, and specific office details
     """
     endpoint = 'offices'
+    list_key = 'offices'
 
     def list(self, page=1, limit=20, include="mainImage", orderBy="", order="", **filters):
         """
@@ -513,6 +841,7 @@ class AgentBoxStaff(AgentBoxClient):
     This is a read only API to retrieve staff details and specific staff details
     """
     endpoint = "staff"
+    list_key = 'staffMembers'
 
     def list(self, page=1, limit=20, include="mainImage", orderBy="", order="", **filters):
         """
@@ -710,6 +1039,6 @@ class AgentBoxLookUps(AgentBoxClient):
         Returns a list of filtered suburb datasets
         """
         endpoint = 'suburbs'
-        payload_filters = {'filter[%s]' % key: value for key, value in filters}
+        payload_filters = {'filter[%s]' % key: value for key, value in filters.items()}
         payload_filters.update({'page': page, 'limit': limit, 'orderBy': orderBy, 'order': order})
         return self.call(endpoint, params=payload_filters)
@@ -28,3 +28,63 @@ FEATURE_NAME_CLEANUP = {
     'carPorts': 'Car Ports',
     'carSpaces': 'Car Spaces',
 }
+
+
+# Webhook change notifications, see models.AgentBoxEvent
+EVENT_ENTITY_LISTING = 'listing'
+EVENT_ENTITY_STAFF = 'staff'
+EVENT_ENTITY_OFFICE = 'office'
+
+EVENT_ENTITY_CHOICES = [
+    (EVENT_ENTITY_LISTING, 'Listing'),
+    (EVENT_ENTITY_STAFF, 'Staff'),
+    (EVENT_ENTITY_OFFICE, 'Office'),
+]
+
+EVENT_CREATED = 'created'
+EVENT_UPDATED = 'updated'
+EVENT_DELETED = 'deleted'
+
+EVENT_CHOICES = [
+    (EVENT_CREATED, 'Created'),
+    (EVENT_UPDATED, 'Updated'),
+    (EVENT_DELETED, 'Deleted'),
+]
+
+
+# Import runs, see models.AgentBoxImportRun
+IMPORT_RUN_RUNNING = 'running'
+IMPORT_RUN_COMPLETED = 'completed'
+IMPORT_RUN_FAILED = 'failed'
+
+IMPORT_RUN_STATUS_CHOICES = [
+    (IMPORT_RUN_RUNNING, 'Running'),
+    (IMPORT_RUN_COMPLETED, 'Completed'),
+    (IMPORT_RUN_FAILED, 'Failed'),
+]
+
+
+# AgentBox lookups mirrored locally, see lookups.py
+LOOKUP_REGIONS = 'regions'
+LOOKUP_SUBSCRIPTIONS = 'subscriptions'
+LOOKUP_PROPERTY_TYPES = 'property_types'
+LOOKUP_CONTACT_CLASSES = 'contact_classes'
+LOOKUP_ENQUIRY_TYPES = 'enquiry_types'
+LOOKUP_ENQUIRY_SOURCES = 'enquiry_sources'
+LOOKUP_ENQUIRY_INTEREST_LEVELS = 'enquiry_interest_levels'
+LOOKUP_CONTACT_SOURCES = 'contact_sources'
+LOOKUP_STAFF_WEB_DISPLAY_TYPES = 'staff_web_display_types'
+LOOKUP_SUBURBS = 'suburbs'
+
+LOOKUP_CHOICES = [
+    (LOOKUP_REGIONS, 'Regions'),
+    (LOOKUP_SUBSCRIPTIONS, 'Subscriptions'),
+    (LOOKUP_PROPERTY_TYPES, 'Property types'),
+    (LOOKUP_CONTACT_CLASSES, 'Contact classes'),
+    (LOOKUP_ENQUIRY_TYPES, 'Enquiry types'),
+    (LOOKUP_ENQUIRY_SOURCES, 'Enquiry sources'),
+    (LOOKUP_ENQUIRY_INTEREST_LEVELS, 'Enquiry interest levels'),
+    (LOOKUP_CONTACT_SOURCES, 'Contact sources'),
+    (LOOKUP_STAFF_WEB_DISPLAY_TYPES, 'Staff web display types'),
+    (LOOKUP_SUBURBS, 'Suburbs'),
+]
@@ -0,0 +1,179 @@
+"""
+Imports the records queued by the webhook (views.WebhookView, models.AgentBoxEvent), so changes in AgentBox
+reach the site in seconds rather than at the next scheduled import. Run by the process_agentbox_events command.
+
+Workers claim batches of pending events with SELECT ... FOR UPDATE SKIP LOCKED, so any number can drain the
+queue together. Events for the same record are coalesced: a burst of updates to a listing imports it once.
+"""
+
+import datetime
+import logging
+from collections import OrderedDict
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from realestate.agents.models import AgentPage
+from realestate.listings.models import PropertyListing
+from realestate.listings import cards, enums as listing_enums
+from realestate.offices.models import OfficePage
+from .client import AgentBoxListings, AgentBoxOffices, AgentBoxStaff
+from .imports import (ImportSummary, fetch_details, _index_listings, _process_listing_batch, _process_office_batch,
+                      _process_staff_batch)
+from .instrumentation import record_run
+from .models import AgentBoxEvent
+from .settings import (IMPORT_WORKERS, EVENT_BATCH_SIZE, EVENT_MAX_ATTEMPTS, EVENT_CLAIM_TIMEOUT,
+                       EVENT_RETENTION_DAYS)
+from . import enums, indexing
+
+logger = logging.getLogger(__name__)
+
+
+def process_events(batch_size=EVENT_BATCH_SIZE, workers=IMPORT_WORKERS):
+    """
+    Claim a batch of pending events and import their records, fetching each from AgentBox with the
+    usual _process_*_data path. Deleted records are removed (staff), unpublished (offices) or marked deleted
+    (listings) without a fetch. Events whose record fails to import are retried once their claim expires
+    (AGENTBOX_EVENT_CLAIM_TIMEOUT), up to AGENTBOX_EVENT_MAX_ATTEMPTS times.
+
+    Returns an ImportSummary, or None if there were no pending events. Runs with events are logged as an
+    AgentBoxImportRun.
+    """
+    events = claim_events(batch_size)
+    if not events:
+        return None
+
+    # Events are in the order received, so the last event for a record is its current state
+    latest = OrderedDict()
+    for event in events:
+        latest[(event.entity, event.source_id)] = event.event
+
+    summary = ImportSummary('events')
+    summary.counts['events'] = len(events)
+    failed = {}
+    with record_run(summary), indexing.deferred(), cards.deferred():
+        try:
+            # Offices before staff before listings, as each refers to the one before
+            for entity in (enums.EVENT_ENTITY_OFFICE, enums.EVENT_ENTITY_STAFF, enums.EVENT_ENTITY_LISTING):
+                updated = [source_id for (e, source_id), event in latest.items()
+                           if e == entity and event != enums.EVENT_DELETED]
+                deleted = [source_id for (e, source_id), event in latest.items()
+                           if e == entity and event == enums.EVENT_DELETED]
+                entity_summary = ImportSummary('%s events' % entity, stats=summary.stats)
+                with summary.stats.phase('process'):
+                    if updated:
+                        IMPORTERS[entity](updated, entity_summary, workers)
+                    if deleted:
+                        DELETERS[entity](deleted, entity_summary)
+                summary.counts.update(entity_summary.counts)
+                summary.failures += entity_summary.failures
+                failed.update({(entity, source_id): error for source_id, error in entity_summary.failures})
+        except Exception as e:
+            # i.e AgentBox is down - the lot are retried later
+            _finish_events(events, {(event.entity, event.source_id): e for event in events})
+            raise
+
+        with summary.stats.phase('checkpoint'):
+            _finish_events(events, failed)
+    return summary
+
+
+def claim_events(batch_size=EVENT_BATCH_SIZE):
+    """
+    Claim up to batch_size pending events, skipping those claimed by other workers unless they have been
+    claimed longer than AGENTBOX_EVENT_CLAIM_TIMEOUT (the worker died).
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=EVENT_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        events = list(
+            AgentBoxEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed=None)
+            .filter(Q(claimed=None) | Q(claimed__lt=stale))
+            .order_by('pk')[:batch_size]
+        )
+        AgentBoxEvent.objects.filter(pk__in=[event.pk for event in events]).update(claimed=now)
+    return events
+
+
+def _finish_events(events, failed):
+    """
+    Mark events processed, apart from those whose record failed (failed is (entity, source id) -> error).
+    Those stay claimed, so are retried when the claim expires rather than straight away.
+    """
+    now = timezone.now()
+    AgentBoxEvent.objects.filter(
+        pk__in=[event.pk for event in events if (event.entity, event.source_id) not in failed]
+    ).update(processed=now, error="")
+
+    for event in events:
+        error = failed.get((event.entity, event.source_id))
+        if error is None:
+            continue
+        event.attempts += 1
+        event.error = repr(error)
+        event.claimed = now
+        if event.attempts >= EVENT_MAX_ATTEMPTS:
+            logger.error('AgentBox event %s failed %s times, giving up', event, event.attempts)
+            event.processed = now
+        event.save(update_fields=['attempts', 'error', 'claimed', 'processed'])
+
+
+def purge_events(days=EVENT_RETENTION_DAYS):
+    """
+    Delete events processed more than days ago
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = AgentBoxEvent.objects.filter(processed__lt=cutoff).delete()
+    return deleted
+
+
+def _fetch(client_class, source_ids, response_key, summary, workers):
+    client = client_class()
+    client.stats = summary.stats
+    records = fetch_details(client.get, source_ids, response_key, summary, workers=workers)
+    return summary.stats.timed(records, 'detail')
+
+
+def _import_listings(source_ids, summary, workers):
+    return _process_listing_batch(_fetch(AgentBoxListings, source_ids, 'listing', summary, workers), summary)
+
+
+def _import_staff(source_ids, summary, workers):
+    return _process_staff_batch(_fetch(AgentBoxStaff, source_ids, 'staffMember', summary, workers), summary)
+
+
+def _import_offices(source_ids, summary, workers):
+    return _process_office_batch(_fetch(AgentBoxOffices, source_ids, 'office', summary, workers), summary)
+
+
+def _delete_listings(source_ids, summary):
+    listings = PropertyListing.objects.filter(uniqueID__in=source_ids)
+    # Clearing the fingerprint makes sure the listing is written again if it comes back
+    summary.counts['deleted'] += listings.update(status=listing_enums.STATUS_DELETED, source_hash="")
+    _index_listings(list(listings))
+
+
+def _delete_staff(source_ids, summary):
+    # As the import does for staff who are no longer active
+    for agent_page in AgentPage.objects.filter(source_id__in=source_ids):
+        agent_page.delete()
+        summary.counts['deleted'] += 1
+
+
+def _delete_offices(source_ids, summary):
+    for office_page in OfficePage.objects.filter(source_id__in=source_ids).live():
+        office_page.unpublish()
+        summary.counts['deleted'] += 1
+
+
+IMPORTERS = {
+    enums.EVENT_ENTITY_LISTING: _import_listings,
+    enums.EVENT_ENTITY_STAFF: _import_staff,
+    enums.EVENT_ENTITY_OFFICE: _import_offices,
+}
+
+DELETERS = {
+    enums.EVENT_ENTITY_LISTING: _delete_listings,
+    enums.EVENT_ENTITY_STAFF: _delete_staff,
+    enums.EVENT_ENTITY_OFFICE: _delete_offices,
+}
@@ -0,0 +1,330 @@
+"""
+A stand in AgentBox API, for testing and benchmarking the imports without the live API.
+
+Serves synthetic offices, staff and listings (modelled on examples/listing.json) from a local HTTP server,
+with AgentBox's list pagination, includes, lastModified ordering and modifiedAfter filtering. Photos and
+floorplans are served by the same server, with ETags. Latency and a rate of 503 errors can be added to
+exercise the throttling and retries:
+
+    with FakeAgentBox(listings=5000, latency=0.05, error_rate=0.01) as server:
+        import_agentpoint_listings(refresh=True)
+        print(server.requests)
+
+While in the with block every AgentBox client talks to the fake server.
+"""
+
+import copy
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .client import AgentBoxClient
+
+EXAMPLE_LISTING = os.path.join(os.path.dirname(__file__), 'examples', 'listing.json')
+
+SUBURBS = [
+    ('Bentleigh', '3204'), ('Black Rock', '3193'), ('Brighton', '3186'), ('Cheltenham', '3192'),
+    ('Elwood', '3184'), ('Hampton', '3188'), ('Sandringham', '3191'), ('Beaumaris', '3193'),
+]
+STREETS = ['Anstee Grove', 'Mitford Street', 'Bay Road', 'Beach Road', 'Centre Road', 'Were Street']
+
+# Fields a listing only has when requested with include, and those the list endpoint never returns
+LISTING_INCLUDES = ('inspectionDates', 'relatedStaffMembers', 'documents', 'mainDescription', 'mainImage',
+                    'externalLinks', 'floorPlans', 'images')
+LISTING_DETAIL_ONLY = ('externalLinks', 'floorPlans', 'images')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeAgentBox:
+    """
+    params:
+        listings, offices, staff (int): How many of each to serve
+        photos (int): Photos per listing
+        latency (float): Seconds added to every API response
+        error_rate (float): Fraction of API requests answered with a 503
+        seed (int): For the random data, so runs are repeatable
+    """
+
+    def __init__(self, listings=1000, offices=10, staff=100, photos=10, latency=0, error_rate=0, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()  # Requests served per endpoint, i.e 'listings', 'media'
+        self._lock = threading.Lock()
+        self._media_cache = {}
+        self._server = None
+        self._base_url = None
+        self.url = None
+
+        # Everything was modified over the last 30 days, in order
+        self.modified = timezone.now() - datetime.timedelta(days=30)
+        self._modified_step = max(30 * 24 * 60 * 60 // max(listings + offices + staff, 1), 2)
+        self.offices = [self._office(i) for i in range(1, offices + 1)]
+        self.staff = [self._staff(i) for i in range(1, staff + 1)]
+        with open(EXAMPLE_LISTING) as example:
+            example = json.load(example)['response']['listing']
+        self.listings = [self._listing(example, i, photos) for i in range(1, listings + 1)]
+
+    # Serving
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = 'http://127.0.0.1:%s/' % self._server.server_port
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        self._base_url = AgentBoxClient.base_url
+        AgentBoxClient.base_url = self.url
+        return self
+
+    def __exit__(self, *exc_info):
+        AgentBoxClient.base_url = self._base_url
+        self.stop()
+
+    # Data
+
+    def _next_modified(self):
+        self.modified += datetime.timedelta(seconds=self.random.randint(1, self._modified_step))
+        return self.modified.isoformat()
+
+    def media_url(self, name):
+        # Resolved against the server when served, as the port isn't known until it starts
+        return '{base}media/%s.jpg' % name
+
+    def _office(self, number):
+        suburb, postcode = SUBURBS[number % len(SUBURBS)]
+        return {
+            'id': str(number),
+            'name': '%s Office %s' % (suburb, number),
+            'email': 'office%s@example.com' % number,
+            'phone': '03 9000 %04d' % number,
+            'fax': '',
+            'address': {'streetAddress': '%s Bay Road' % number, 'suburb': suburb, 'state': 'VIC',
+                        'postcode': postcode},
+            'externalLinks': [],
+            'location': {'lat': '-37.9%06d' % number, 'long': '145.0%06d' % number},
+            'lastModified': self._next_modified(),
+        }
+
+    def _staff(self, number):
+        return {
+            'id': 'stf%04d' % number,
+            'status': 'Active',
+            'officeId': self.offices[number % len(self.offices)]['id'] if self.offices else '1',
+            'firstName': 'Agent',
+            'lastName': 'Number %s' % number,
+            'jobTitle': 'Sales Consultant',
+            'role': 'Sales Representative',
+            'email': 'agent%s@example.com' % number,
+            'mobile': '0400 000 %03d' % (number % 1000),
+            'phone': '03 9000 0000',
+            'images': [{'url': self.media_url('staff-%s' % number), 'lastModified': self.modified.isoformat()}],
+            'lastModified': self._next_modified(),
+        }
+
+    def _listing(self, example, number, photos):
+        listing = copy.deepcopy(example)
+        office = self.offices[number % len(self.offices)] if self.offices else {'id': '1', 'name': ''}
+        suburb, postcode = SUBURBS[number % len(SUBURBS)]
+        address = listing['property']['address']
+        address.update({
+            'streetNum': str(number % 200 + 1),
+            'streetName': STREETS[number % len(STREETS)],
+            'suburb': suburb,
+            'postcode': postcode,
+        })
+        address['streetAddress'] = '%s %s' % (address['streetNum'], address['streetName'])
+        listing['property']['location'] = {
+            'lat': '%.8f' % (-37.92 + self.random.uniform(-0.05, 0.05)),
+            'long': '%.8f' % (145.03 + self.random.uniform(-0.05, 0.05)),
+        }
+        listing['property']['bedrooms'] = str(self.random.randint(1, 5))
+        listing['property']['bathrooms'] = str(self.random.randint(1, 3))
+        listing.update({
+            'id': '1P%05d' % number,
+            'officeId': office['id'],
+            'officeName': office['name'],
+            'type': 'Lease' if number % 5 == 0 else 'Sale',
+            'searchPrice': str(self.random.randrange(400000, 3000000, 5000)),
+            'lastModified': self._next_modified(),
+        })
+        listing['images'] = [
+            {'id': '%s%s' % (number, index), 'url': self.media_url('%s-%s' % (listing['id'], index)),
+             'order': str(index + 1), 'lastModified': listing['lastModified']}
+            for index in range(photos)
+        ]
+        listing['floorPlans'] = [
+            {'id': str(number), 'url': self.media_url('%s-floorplan' % listing['id']), 'title': 'Floorplan 1',
+             'order': '1'}
+        ]
+        listing['mainImage'] = listing['images'][0] if listing['images'] else {}
+        if self.staff:
+            staff = self.staff[number % len(self.staff)]
+            listing['relatedStaffMembers'] = [{
+                'webDisplay': True,
+                'displayOrder': '0',
+                'role': 'Listing Agent',
+                'staffMember': {'id': staff['id'], 'status': 'Active', 'officeId': staff['officeId']},
+            }]
+        return listing
+
+    def touch(self, fraction=0.05, photos=False):
+        """
+        Modify a fraction of the listings, as AgentBox would between imports: their price changes,
+        and with photos their first photo is replaced. Returns how many were changed.
+        """
+        changed = self.random.sample(self.listings, int(len(self.listings) * fraction))
+        for listing in changed:
+            listing['searchPrice'] = str(int(listing['searchPrice']) + 5000)
+            listing['lastModified'] = timezone.now().isoformat()
+            if photos and listing['images']:
+                listing['images'][0] = dict(
+                    listing['images'][0],
+                    url=self.media_url('%s-0-%s' % (listing['id'], int(time.time()))),
+                    lastModified=listing['lastModified']
+                )
+                listing['mainImage'] = listing['images'][0]
+        return len(changed)
+
+    def media(self, name):
+        """
+        A small JPEG, a different colour per name so each is distinct content
+        """
+        if name not in self._media_cache:
+            from PIL import Image
+
+            colour = tuple(hashlib.sha256(name.encode()).digest()[:3])
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 48), colour).save(buffer, 'JPEG')
+            self._media_cache[name] = buffer.getvalue()
+        return self._media_cache[name]
+
+    # Responses
+
+    def list_response(self, records, list_key, query, include=None):
+        modified_after = parse_datetime(query.get('filter[modifiedAfter]', ''))
+        if modified_after:
+            records = [record for record in records if parse_datetime(record['lastModified']) > modified_after]
+        if query.get('filter[officeId]'):
+            records = [record for record in records if record.get('officeId') == query['filter[officeId]']]
+        if query.get('orderBy') == 'lastModified':
+            records = sorted(records, key=lambda record: parse_datetime(record['lastModified']),
+                             reverse=query.get('order', '').upper() == 'DESC')
+
+        limit = max(int(query.get('limit') or 20), 1)
+        page = max(int(query.get('page') or 1), 1)
+        last = max((len(records) + limit - 1) // limit, 1)
+        items = records[(page - 1) * limit:page * limit]
+        if include is not None:
+            items = [self.included(record, include) for record in items]
+        return {'response': {'current': str(page), 'last': str(last), 'items': str(len(records)),
+                             list_key: items}}
+
+    def included(self, listing, include):
+        """
+        The listing with only the includes requested
+        """
+        return {key: value for key, value in listing.items() if key not in LISTING_INCLUDES or key in include}
+
+    def respond(self, path, query):
+        """
+        Returns (status, JSON data) for an API request
+        """
+        parts = path.strip('/').split('/')
+        include = [name for name in query.get('include', '').split(',') if name]
+        endpoints = {
+            'listings': (self.listings, 'listings', 'listing'),
+            'offices': (self.offices, 'offices', 'office'),
+            'staff': (self.staff, 'staffMembers', 'staffMember'),
+        }
+        if parts[0] not in endpoints:
+            return 404, {'response': {'errors': ['Not found']}}
+
+        records, list_key, record_key = endpoints[parts[0]]
+        if len(parts) == 1:
+            list_include = [name for name in include if name not in LISTING_DETAIL_ONLY]
+            return 200, self.list_response(records, list_key, query, list_include if parts[0] == 'listings' else None)
+        for record in records:
+            if record['id'] == parts[1]:
+                if parts[0] == 'listings':
+                    record = self.included(record, include)
+                return 200, {'response': {record_key: record}}
+        return 404, {'response': {'errors': ['Not found']}}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.strip('/').split('/')[0]
+                with fake._lock:
+                    fake.requests[endpoint] += 1
+                    error = fake.error_rate and fake.random.random() < fake.error_rate
+
+                if endpoint == 'media':
+                    return self.media(url.path.rsplit('/', 1)[-1].rsplit('.', 1)[0])
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if not self.headers.get('X-API-Key'):
+                    return self.send_json(401, {'response': {'errors': ['API key required']}})
+                if error:
+                    return self.send_json(503, {'response': {'errors': ['Service unavailable']}},
+                                          {'Retry-After': '0'})
+
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, data = fake.respond(url.path, query)
+                self.send_json(status, data)
+
+            def media(self, name):
+                etag = '"%s"' % hashlib.md5(name.encode()).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_body(200, fake.media(name), 'image/jpeg', {'ETag': etag})
+
+            def send_json(self, status, data, headers={}):
+                body = json.dumps(data).replace('{base}', fake.url).encode('utf-8')
+                self.send_body(status, body, 'application/json', headers)
+
+            def send_body(self, status, body, content_type, headers={}):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,5 +1,14 @@
+import datetime
+import hashlib
+import json
+import logging
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from itertools import zip_longest
+import requests
 from django.contrib.gis.geos import Point
+from django.db import transaction
 from django.utils.dateparse import parse_datetime
 from django.utils import timezone
 from wagtail.core.models import PageRevision
@@ -8,15 +17,320 @@ from realestate.agents.models import (AgentPage, AgentIndexPage, AgentCategory,
                                       AgentPageCategoryChoice, AgentPageOffice)
 from realestate.listings.models import (PropertyListing, PropertyCategory, PropertyFeature, ListingAgent,
                                         Inspection, ListingLink, ListingImage, ListingFloorplan)
-from realestate.listings import enums as listing_enums
-from cms.utils import wagtail_image_from_url
+from realestate.listings import cards, enums as listing_enums
+from realestate.listings.search_cache import invalidate_searches
+from cms.utils import bulk_update
 from .client import (AgentBoxListings, AgentBoxContacts, AgentBoxSearchRequirements,
-                     AgentBoxOffices, AgentBoxStaff, AgentBoxLookUps, AgentBoxException)
+                     AgentBoxOffices, AgentBoxStaff, AgentBoxLookUps, AgentBoxException, KEYSET_OVERLAP)
+from .instrumentation import ImportStats, record_run
+from .media import fetch_images
 from .models import AgentBoxUpdateMeta
-from . import enums
+from .settings import IMPORT_WORKERS, SYNC_OVERLAP, STREAM_RESPONSES, LISTING_PROCESSES
+from . import enums, indexing, instrumentation, publishing, shards
 
+logger = logging.getLogger(__name__)
 
-def import_agentpoint_offices(since=None, refresh=False):
+# Results of the _process_*_data functions, counted in the ImportSummary
+CREATED = 'created'
+UPDATED = 'updated'
+# The record hasn't changed since it was last imported
+SKIPPED = 'skipped'
+# New records that aren't for the website, which aren't created
+NOT_ACTIVE = 'not_active'
+# Existing records no longer for the website, which are removed
+DELETED = 'deleted'
+
+
+class ImportSummary:
+    """
+    Tally of a single import run. Failures are recorded against the AgentBox id
+    rather than raised, so one bad record doesn't abort the rest of the import.
+    stats are the run's timings, API calls and queries (see instrumentation.py), which may be shared
+    with other summaries of the same run.
+    """
+
+    def __init__(self, name, stats=None):
+        self.name = name
+        self.counts = Counter()
+        self.failures = []
+        self.stats = stats or ImportStats()
+
+    def failed(self, source_id, error):
+        self.counts['failed'] += 1
+        self.failures.append((source_id, error))
+        logger.warning('AgentBox %s import: %s failed (%r)', self.name, source_id, error)
+
+    def __str__(self):
+        counts = ", ".join("%s: %s" % (key, value) for key, value in sorted(self.counts.items()))
+        return "AgentBox %s import (%s)" % (self.name, counts or "nothing to do")
+
+
+def fetch_details(get, ids, response_key, summary, workers=IMPORT_WORKERS, ordered=True):
+    """
+    Call get(id) for each id on a bounded pool of threads and yield (id, record) pairs as
+    the responses arrive, so processing overlaps the network wait of the next requests.
+
+    params:
+        get (callable): Client detail method, i.e AgentBoxListings().get
+        ids (iterable): AgentBox ids, consumed lazily
+        response_key (str): Key of the record in response, i.e 'listing'
+        summary (ImportSummary): Receives failed fetches
+        workers (int): Maximum concurrent requests
+        ordered (bool): Yield in the same order as ids, otherwise as each request completes
+
+    Only this generator's thread touches the database - the pool just does HTTP.
+    """
+    workers = max(int(workers), 1)
+    window = workers * 2  # Enough queued to keep the pool busy without loading the whole feed
+    queued = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for source_id in ids:
+            queued.append((source_id, executor.submit(get, source_id)))
+            while len(queued) >= window:
+                yield from _completed_details(queued, response_key, summary, ordered)
+        while queued:
+            yield from _completed_details(queued, response_key, summary, ordered)
+
+
+def _completed_details(queued, response_key, summary, ordered):
+    """
+    Remove finished requests from the queue and yield their records. Ordered mode waits on
+    the oldest request, otherwise on whichever finishes first.
+    """
+    if ordered:
+        done = [queued.popleft()]
+    else:
+        finished, _ = wait([future for _, future in queued], return_when=FIRST_COMPLETED)
+        done = [item for item in queued if item[1] in finished]
+        for item in done:
+            queued.remove(item)
+
+    for source_id, future in done:
+        try:
+            data = future.result()
+        except (requests.RequestException, AgentBoxException, ValueError) as e:
+            summary.failed(source_id, e)
+            continue
+
+        record = data.get('response', {}).get(response_key)
+        if record:
+            yield source_id, record
+        else:
+            summary.counts['missing'] += 1
+
+
+def fingerprint(data):
+    """
+    Stable hash of an AgentBox payload, stored as source_hash on the imported record so unchanged
+    records can be skipped. Keys are sorted so the hash doesn't depend on the order AgentBox sends them.
+    """
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Listing data only one of the list (with includes) and 'get' returns, left out of listing_fingerprint
+LISTING_MEDIA_FIELDS = AgentBoxListings.detail_only_fields + ('mainImage',)
+
+
+def listing_fingerprint(listing_data):
+    """
+    The fingerprint of listing data normalised so it's the same whether the listing was listed with includes or fetched
+    with 'get': without the media, which only 'get' returns, or mainImage, which only the list does (a change to
+    either moves lastModified, which is hashed), and with just the staff member ids of relatedStaffMembers, whose
+    staff details differ by endpoint.
+    """
+    data = {key: value for key, value in listing_data.items() if key not in LISTING_MEDIA_FIELDS}
+    if data.get('relatedStaffMembers'):
+        data['relatedStaffMembers'] = [
+            {'id': (staff_data.get('staffMember') or {}).get('id'), 'webDisplay': staff_data.get('webDisplay')}
+            for staff_data in data['relatedStaffMembers']
+        ]
+    return fingerprint(data)
+
+
+def _process_records(records, process, summary):
+    """
+    Run process(record) over (id, record) pairs, recording rather than raising per-record errors.
+    process returns what it did (CREATED, UPDATED, SKIPPED...), which is counted.
+    """
+    for source_id, record in records:
+        try:
+            result = process(record)
+        except Exception as e:
+            summary.failed(source_id, e)
+        else:
+            summary.counts[result or 'processed'] += 1
+    return summary
+
+
+def _get_update_meta():
+    try:
+        meta, _ = AgentBoxUpdateMeta.objects.get_or_create()
+    except AgentBoxUpdateMeta.MultipleObjectsReturned:
+        raise AgentBoxException('AgentBox import: Too Many AgentBoxUpdateMeta')
+    return meta
+
+
+def _start_sync(meta, entity, since=None, refresh=False):
+    """
+    Work out where an import of entity (listings|offices|staff) starts, saving a checkpoint for it.
+    Incremental runs (no since or refresh) resume an interrupted run after its checkpoint, otherwise start
+    from the last_updated_<entity> watermark less AGENTBOX_SYNC_OVERLAP.
+
+    Returns the checkpoint: {
+        'since': ISO datetime to request records modified after, or None for all,
+        'started': ISO datetime the run started, which becomes the watermark once it completes,
+        'page': The last page fully processed, for pages in no particular order,
+        'modified': ISO datetime of the newest record fully processed, for pages ordered by lastModified,
+        'advance': Whether completing the run should move the watermark,
+    }
+    """
+    checkpoint = getattr(meta, 'checkpoint_%s' % entity)
+    if checkpoint and not since and not refresh:
+        if checkpoint.get('modified'):
+            logger.info('AgentBox %s import: resuming after %s', entity, checkpoint['modified'])
+        else:
+            logger.info('AgentBox %s import: resuming from page %s', entity, checkpoint['page'] + 1)
+        return checkpoint
+
+    watermark = getattr(meta, 'last_updated_%s' % entity)
+    if not since and not refresh and watermark:
+        since = watermark - datetime.timedelta(seconds=SYNC_OVERLAP)
+
+    checkpoint = {
+        'since': since.isoformat() if since else None,
+        'started': timezone.now().isoformat(),
+        'page': 0,
+        'modified': None,
+        # An explicit since later than the watermark doesn't cover everything modified after it
+        'advance': not since or not watermark or since <= watermark,
+    }
+    _save_checkpoint(meta, entity, checkpoint)
+    return checkpoint
+
+
+def _save_checkpoint(meta, entity, checkpoint, watermark=None):
+    """
+    Save the checkpoint, and the watermark if given and newer than the current one
+    """
+    fields = ['checkpoint_%s' % entity]
+    setattr(meta, fields[0], checkpoint)
+    current = getattr(meta, 'last_updated_%s' % entity)
+    if watermark and (not current or watermark > current):
+        fields.append('last_updated_%s' % entity)
+        setattr(meta, fields[1], watermark)
+    meta.save(update_fields=fields)
+
+
+def _finish_sync(meta, entity, checkpoint, summary):
+    """
+    Clear the checkpoint and, if every record was processed, move the watermark to when the run started.
+    With failures the watermark stays put so the next run retries them.
+    """
+    watermark = None
+    if checkpoint['advance'] and not summary.counts['failed']:
+        watermark = parse_datetime(checkpoint['started'])
+    _save_checkpoint(meta, entity, None, watermark=watermark)
+
+
+def _page_modified(page):
+    """
+    The newest lastModified of a page of records, or None if it can't be determined
+    """
+    try:
+        modified = [parse_datetime(record.get('lastModified') or '') for record in page]
+    except ValueError:
+        return None
+    if not modified or not all(modified):
+        return None
+    return max(modified)
+
+
+def _page_watermark(page, checkpoint, summary):
+    """
+    For pages ordered by lastModified, the newest lastModified on the page once it's processed:
+    everything modified up to then is done. None if the run has had failures or it can't be determined.
+    """
+    if not checkpoint['advance'] or summary.counts['failed']:
+        return None
+    modified = _page_modified(page)
+    return min(modified, parse_datetime(checkpoint['started'])) if modified else None
+
+
+def _resume_after(checkpoint):
+    """
+    The modifiedAfter to list records ordered by lastModified from, resuming after the checkpoint
+    (see AgentBoxClient.iter_modified_pages)
+    """
+    if checkpoint.get('modified'):
+        return (parse_datetime(checkpoint['modified']) - KEYSET_OVERLAP).isoformat()
+    return checkpoint['since']
+
+
+def _sync_pages(meta, entity, checkpoint, pages, fetch_page, process, summary, ordered=False, batch=False):
+    """
+    Process pages of list records, checkpointing after each so an interrupted run resumes at the next page.
+    The run is logged as an AgentBoxImportRun, see instrumentation.record_run.
+
+    params:
+        pages (iterable): (page number, list records) as per AgentBoxClient.iter_pages, streamed or not
+        fetch_page (callable): Takes a page of list records, returns (id, record) pairs to process
+        process (callable): Processes a single record
+        ordered (bool): Pages are ordered by lastModified ascending, as per AgentBoxClient.iter_modified_pages.
+            The checkpoint is the newest record processed rather than a page number, and the watermark advances
+            per page
+        batch (bool): process takes the page's (id, record) pairs and the summary, rather than a single record
+    """
+    def save_checkpoint(page_number, page):
+        if ordered:
+            modified = _page_modified(page)
+            checkpoint['modified'] = modified.isoformat() if modified else checkpoint.get('modified')
+        else:
+            checkpoint['page'] = page_number
+        if summary.counts['failed']:
+            # So a resumed run doesn't move the watermark past the records that failed
+            checkpoint['advance'] = False
+        watermark = _page_watermark(page, checkpoint, summary) if ordered else None
+        _save_checkpoint(meta, entity, checkpoint, watermark=watermark)
+
+    with record_run(summary):
+        _process_pages(pages, fetch_page, process, summary, batch=batch, on_page=save_checkpoint)
+        with summary.stats.phase('checkpoint'):
+            _finish_sync(meta, entity, checkpoint, summary)
+    return summary
+
+
+def _process_pages(pages, fetch_page, process, summary, batch=False, on_page=None):
+    """
+    Process pages of list records as per _sync_pages, calling on_page(page number, page) after each.
+    Search index updates and listing card refreshes are deferred, and made in bulk after each page (see indexing.py
+    and listings/cards.py).
+    """
+    stats = summary.stats
+    with indexing.deferred(), cards.deferred():
+        for page_number, page in stats.timed(pages, 'list'):
+            with stats.phase('list'):
+                # A streamed page is read as it's iterated, and can only be once. The records are kept, as
+                # they're processed and checkpointed as a batch, but not the response body.
+                page = list(page)
+            records = stats.timed(fetch_page(page), 'detail')
+            with stats.phase('process'):
+                if batch:
+                    process(records, summary)
+                else:
+                    _process_records(records, process, summary)
+            # The page's records are indexed, and their cards refreshed, in bulk rather than as each is saved
+            indexing.flush()
+            cards.flush()
+            if on_page:
+                with stats.phase('checkpoint'):
+                    on_page(page_number, page)
+            summary.counts['pages'] += 1
+    return summary
+
+
+def import_agentpoint_offices(since=None, refresh=False, workers=IMPORT_WORKERS, force=False):
     """
     Contact the AgentBox API and import office records, creating realestate.offices.OfficePage
     objects. Will update existing pages based on OfficePage.source_id.
@@ -24,44 +338,44 @@ def import_agentpoint_offices(since=None, refresh=False):
     params:
         since (datetime): Request Office records updated since this
         refresh (bool): Fully refresh all records.
-        Note: If both since and refresh are False(y) we will use the last updated from AgentBoxUpdateMeta.last_updated_offices
+        workers (int): Number of concurrent detail requests
+        force (bool): Rewrite records even when their data is unchanged since the last import
+        Note: If both since and refresh are False(y) we will use the last updated from AgentBoxUpdateMeta.last_updated_offices,
+        or resume an interrupted import. See _start_sync
 
     Workflow:
         1. Determine update since date
-        2. List offices
-        3. Get each office
+        2. List offices (all pages)
+        3. Get each office (concurrently)
         4. Create or update record
-    """
-    ALL_OFFICES_LIMIT = 150
+        5. Checkpoint each page, then move the watermark once all are done
 
-    try:
-        meta, _ = AgentBoxUpdateMeta.objects.get_or_create()
-    except AgentBoxUpdateMeta.MultipleObjectsReturned:
-        raise AgentBoxException('import_agentpoint_offices: Too Many AgentBoxUpdateMeta')
-
-    if not since and not refresh:
-        since = meta.last_updated_offices
+    Returns an ImportSummary
+    """
+    meta = _get_update_meta()
+    checkpoint = _start_sync(meta, 'offices', since, refresh)
 
+    summary = ImportSummary('offices')
     offices_client = AgentBoxOffices()
-    offices_list_data = offices_client.list(
-        limit=ALL_OFFICES_LIMIT,
-        modifiedAfter=since.isoformat() if since else None
-    )
-    offices_data = []
-    for office_list_data in offices_list_data['response'].get('offices', []):
-        office_data = offices_client.get(office_list_data['id'])
-        if office_data['response'].get('office'):
-            offices_data.append(office_data['response']['office'])
+    offices_client.stats = summary.stats
+    pages = offices_client.iter_pages(start_page=checkpoint['page'] + 1, stream=STREAM_RESPONSES,
+                                      modifiedAfter=checkpoint['since'])
+
+    def fetch_page(page):
+        return fetch_details(offices_client.get, [office['id'] for office in page], 'office', summary, workers=workers)
 
-    for office_data in offices_data:
-        _process_office_data(office_data)
+    process = partial(_process_office_batch, force=force)
+    return _sync_pages(meta, 'offices', checkpoint, pages, fetch_page, process, summary, batch=True)
 
 
-def _process_office_data(office_data={}):
+def _process_office_data(office_data={}, force=False):
     """
     Process the single offices data, updating or creating the page if needed.
-    Includes saving images
+    Includes saving images.
+    Returns SKIPPED, without touching the page, if the data is unchanged since the last import (unless force),
+    otherwise CREATED or UPDATED.
     """
+    source_hash = fingerprint(office_data)
     try:
         office_page = OfficePage.objects.get(source_id=office_data['id'])
     except OfficePage.DoesNotExist:
@@ -69,6 +383,55 @@ def _process_office_data(office_data={}):
     except OfficePage.MultipleObjectsReturned:
         raise AgentBoxException('import_agentpoint_offices: Multiple OfficePage of ID %s' % office_data['id'])
 
+    if office_page.source_hash == source_hash and not force:
+        return SKIPPED
+
+    _map_office_data(office_page, office_data)
+
+    # If this is a new page (OfficePage.pk is None) we need to
+    # Put it in the OfficeIndex
+    created = office_page.pk is None
+    if created:
+        index = OfficeIndexPage.objects.latest('pk')
+        index.add_child(instance=office_page)
+
+    office_page.save()
+    # The fingerprint is only stored by the published revision, so a failed publish is retried next import
+    office_page.source_hash = source_hash
+    with instrumentation.phase('publish'):
+        office_page.save_revision().publish()
+    return CREATED if created else UPDATED
+
+
+def _process_office_batch(records, summary, force=False):
+    """
+    Process a batch (page) of (id, office data) as per _process_office_data, with a few queries for the whole
+    batch (see _save_page_batch)
+    """
+    records = list(records)
+    existing = _existing_pages(OfficePage, records)
+    changed = []
+    for source_id, office_data in records:
+        try:
+            office_page = _page_for_data(OfficePage, office_data, existing, summary)
+            if office_page.source_hash == fingerprint(office_data) and not force:
+                summary.counts[SKIPPED] += 1
+                continue
+            content = publishing.page_content(office_page) if office_page.pk else None
+            _map_office_data(office_page, office_data)
+        except Exception as e:
+            summary.failed(source_id, e)
+        else:
+            changed.append((source_id, office_page, office_data, content))
+
+    single = partial(_process_office_data, force=force)
+    return _save_page_batch(changed, OfficeIndexPage, summary, single)
+
+
+def _map_office_data(office_page, office_data):
+    """
+    Set the OfficePage fields from the office data, without saving
+    """
     mapped_fields = {
         # Mapping of AgentBox field to OfficePage field
 
@@ -116,17 +479,8 @@ def _process_office_data(office_data={}):
 
     # TODO: Images into OfficePage.featured_image
 
-    # If this is a new page (OfficePage.pk is None) we need to
-    # Put it in the OfficeIndex
-    if office_page.pk is None:
-        index = OfficeIndexPage.objects.latest('pk')
-        index.add_child(instance=office_page)
-
-    office_page.save()
-    office_page.save_revision().publish()
-
 
-def import_agentpoint_staff(since=None, refresh=None):
+def import_agentpoint_staff(since=None, refresh=None, workers=IMPORT_WORKERS, force=False):
     """
     Contact the AgentBox API and import staff records, creating realestate.offices.AgentPage
     objects. Will update existing pages based on AgentPage.source_id.
@@ -134,60 +488,139 @@ def import_agentpoint_staff(since=None, refresh=None):
     params:
         since (datetime): Request Office records updated since this
         refresh (bool): Fully refresh all records.
-        Note: If both since and refresh are False(y) we will use the last updated from AgentBoxUpdateMeta.last_updated_staff
+        workers (int): Number of concurrent detail requests
+        force (bool): Rewrite records even when their data is unchanged since the last import
+        Note: If both since and refresh are False(y) we will use the last updated from AgentBoxUpdateMeta.last_updated_staff,
+        or resume an interrupted import. See _start_sync
 
     Workflow:
         1. Determine update since date
-        2. List staff
-        3. Get each staff
+        2. List staff (all pages)
+        3. Get each staff (concurrently)
         4. Create or update record
-    """
-    ALL_STAFF_LIMIT = 150
+        5. Checkpoint each page, then move the watermark once all are done
 
-    try:
-        meta, _ = AgentBoxUpdateMeta.objects.get_or_create()
-    except AgentBoxUpdateMeta.MultipleObjectsReturned:
-        raise AgentBoxException('import_agentpoint_offices: Too Many AgentBoxUpdateMeta')
-
-    if not since and not refresh:
-        since = meta.last_updated_staff
+    Returns an ImportSummary
+    """
+    meta = _get_update_meta()
+    checkpoint = _start_sync(meta, 'staff', since, refresh)
 
+    summary = ImportSummary('staff')
     staff_client = AgentBoxStaff()
-    staff_list_data = staff_client.list(
-        limit=ALL_STAFF_LIMIT,
-        modifiedAfter=since.isoformat() if since else None
-    )
+    staff_client.stats = summary.stats
+    pages = staff_client.iter_pages(start_page=checkpoint['page'] + 1, stream=STREAM_RESPONSES,
+                                    modifiedAfter=checkpoint['since'])
 
-    staffs_data = []
-    for staff_list_data in staff_list_data['response'].get('staffMembers', []):
-        staff_data = staff_client.get(staff_list_data['id'])
-        if staff_data['response'].get('staffMember'):
-            staffs_data.append(staff_data['response']['staffMember'])
+    def fetch_page(page):
+        return fetch_details(staff_client.get, [staff['id'] for staff in page], 'staffMember', summary, workers=workers)
 
-    for staff_data in staffs_data:
-        _process_staff_data(staff_data)
+    process = partial(_process_staff_batch, force=force)
+    return _sync_pages(meta, 'staff', checkpoint, pages, fetch_page, process, summary, batch=True)
 
 
-def _process_staff_data(staff_data={}):
+def _process_staff_data(staff_data={}, force=False):
     """
     Process the single staff data, updating or creating the page if needed.
     Includes saving images.
     AgentPage will only be saved/created if the staff is marked webDisplay as per AgentBoxSettings.staff_webdisplay and
     an active value of True
     TODO: webDisplay Handling
+    Returns SKIPPED, without touching the page, if the data is unchanged since the last import (unless force),
+    otherwise what was done (CREATED, UPDATED, DELETED or NOT_ACTIVE).
     """
+    source_hash = fingerprint(staff_data)
     try:
         agent_page = AgentPage.objects.get(source_id=staff_data['id'])
+        if agent_page.source_hash == source_hash and not force:
+            return SKIPPED
         if staff_data['status'] != 'Active':
             agent_page.delete()
-            return
+            return DELETED
     except AgentPage.DoesNotExist:
         agent_page = AgentPage(source_id=staff_data['id'])
         if staff_data['status'] != 'Active':
-            return
+            return NOT_ACTIVE
     except AgentPage.MultipleObjectsReturned:
-        raise AgentBoxException('import_agentpoint_offices: Multiple OfficePage of ID %s' % office_data['id'])
+        raise AgentBoxException('import_agentpoint_staff: Multiple AgentPage of ID %s' % staff_data['id'])
+
+    _map_staff_data(agent_page, staff_data)
+
+    # The rest of the data is FK Linked, so we want to save the object now
+    # If this is a new page (AgentPage.pk is None) we need to
+    # Put it in the AgentIndex
+    created = agent_page.pk is None
+    if created:
+        index = AgentIndexPage.objects.latest('pk')
+        index.add_child(instance=agent_page)
+    agent_page.save()
+
+    _sync_staff_relations([(agent_page, staff_data)])
+
+    # First image will be the profile image
+    if staff_data.get('images'):
+        url = staff_data['images'][0].get('url')
+        images, errors = fetch_images([(url, _media_modtime(staff_data['images'][0]))])
+        if url in errors:
+            raise errors[url]
+        agent_page.profile_image = images.get(url)
 
+    # Once all the extra data is there we can publish the revision
+    agent_page.source_hash = source_hash
+    with instrumentation.phase('publish'):
+        agent_page.save_revision().publish()
+    return CREATED if created else UPDATED
+
+
+def _process_staff_batch(records, summary, force=False):
+    """
+    Process a batch (page) of (id, staff data) as per _process_staff_data, with a few queries for the whole
+    batch (see _save_page_batch). The batch's profile images are downloaded together.
+    """
+    records = list(records)
+    existing = _existing_pages(AgentPage, records)
+    changed = []
+    for source_id, staff_data in records:
+        try:
+            agent_page = _page_for_data(AgentPage, staff_data, existing, summary)
+            if agent_page.source_hash == fingerprint(staff_data) and not force:
+                summary.counts[SKIPPED] += 1
+                continue
+            if staff_data['status'] != 'Active':
+                if agent_page.pk:
+                    agent_page.delete()
+                    summary.counts[DELETED] += 1
+                else:
+                    summary.counts[NOT_ACTIVE] += 1
+                continue
+            content = publishing.page_content(agent_page) if agent_page.pk else None
+            _map_staff_data(agent_page, staff_data)
+        except Exception as e:
+            summary.failed(source_id, e)
+        else:
+            changed.append((source_id, agent_page, staff_data, content))
+
+    # First image will be the profile image
+    profile_images = [staff_data['images'][0] for _, _, staff_data, _ in changed if staff_data.get('images')]
+    images, errors = fetch_images((image.get('url'), _media_modtime(image)) for image in profile_images)
+    ready = []
+    for change in changed:
+        source_id, agent_page, staff_data, _ = change
+        if staff_data.get('images'):
+            url = staff_data['images'][0].get('url')
+            if url in errors:
+                summary.failed(source_id, errors[url])
+                continue
+            agent_page.profile_image = images.get(url)
+        ready.append(change)
+
+    single = partial(_process_staff_data, force=force)
+    return _save_page_batch(ready, AgentIndexPage, summary, single, sync_related=_sync_staff_relations)
+
+
+def _map_staff_data(agent_page, staff_data):
+    """
+    Set the AgentPage fields from the staff data, without saving
+    """
     mapped_fields = {
         'firstName': 'name_short',
         'jobTitle': 'job_title',
@@ -203,41 +636,127 @@ def _process_staff_data(staff_data={}):
     # Page title is First + Last Name
     agent_page.title = " ".join([agent_page.name_short, staff_data['lastName']]).strip()
 
-    # The rest of the data is FK Linked, so we want to save the object now
-    # If this is a new page (AgentPage.pk is None) we need to
-    # Put it in the AgentIndex
-    if agent_page.pk is None:
-        index = AgentIndexPage.objects.latest('pk')
-        index.add_child(instance=agent_page)
-    agent_page.save()
 
-    # role's are agent categories
-    if staff_data.get('role'):
-        category, _ = AgentCategory.objects.get_or_create(category_name=staff_data['role'])
-        AgentPageCategoryChoice.objects.get_or_create(
-            sort_order=0,
-            page=agent_page,
-            category=category
-        )
+def _sync_staff_relations(pages_data):
+    """
+    Add the category (AgentBox role) and office of each saved (AgentPage, staff data) that the page doesn't
+    have yet, with a few queries for them all. Returns the ids of the pages given a category or office.
+    """
+    roles = {staff_data['role'] for _, staff_data in pages_data if staff_data.get('role')}
+    categories = {category.category_name: category
+                  for category in AgentCategory.objects.filter(category_name__in=roles)}
+    for role in roles.difference(categories):
+        categories[role] = AgentCategory.objects.create(category_name=role)
 
     # Office is based on Source ID
-    if staff_data.get('officeId') and OfficePage.objects.filter(source_id=staff_data['officeId']):
-        AgentPageOffice.objects.get_or_create(
-            sort_order=0,
-            office=OfficePage.objects.get(source_id=staff_data['officeId']),
-            offices=agent_page
-        )
+    office_ids = {staff_data['officeId'] for _, staff_data in pages_data if staff_data.get('officeId')}
+    offices = {office.source_id: office for office in OfficePage.objects.filter(source_id__in=office_ids)}
+
+    agent_pages = [agent_page for agent_page, _ in pages_data]
+    has_category = set(AgentPageCategoryChoice.objects.filter(page__in=agent_pages, sort_order=0)
+                       .values_list('page_id', 'category_id'))
+    has_office = set(AgentPageOffice.objects.filter(offices__in=agent_pages, sort_order=0)
+                     .values_list('offices_id', 'office_id'))
+
+    new_categories, new_offices = [], []
+    for agent_page, staff_data in pages_data:
+        # role's are agent categories
+        category = categories.get(staff_data.get('role'))
+        if category and (agent_page.pk, category.pk) not in has_category:
+            new_categories.append(AgentPageCategoryChoice(sort_order=0, page=agent_page, category=category))
+        office = offices.get(staff_data.get('officeId'))
+        if office and (agent_page.pk, office.pk) not in has_office:
+            new_offices.append(AgentPageOffice(sort_order=0, office=office, offices=agent_page))
+    AgentPageCategoryChoice.objects.bulk_create(new_categories)
+    AgentPageOffice.objects.bulk_create(new_offices)
+    return {choice.page_id for choice in new_categories} | {office.offices_id for office in new_offices}
+
+
+def _existing_pages(model, records):
+    """
+    The pages of model for the (id, data) records, as {source id: [pages]}
+    """
+    existing = defaultdict(list)
+    source_ids = [str(data['id']) for _, data in records if data.get('id')]
+    for page in model.objects.filter(source_id__in=source_ids):
+        existing[page.source_id].append(page)
+    return existing
 
-    # First image will be the profile image
-    if staff_data.get('images'):
-        wagtail_image = wagtail_image_from_url(staff_data['images'][0].get('url'))
-        agent_page.profile_image = wagtail_image
 
-    # Once all the extra data is there we can publish the revision
-    agent_page.save_revision().publish()
+def _page_for_data(model, data, existing, summary):
+    """
+    The existing or new page of model for the data, from _existing_pages
+    """
+    matches = existing.get(str(data['id']), [])
+    if len(matches) > 1:
+        raise AgentBoxException('import_agentpoint_%s: Multiple %s of ID %s' %
+                                (summary.name, model.__name__, data['id']))
+    return matches[0] if matches else model(source_id=data['id'])
 
 
-def import_agentpoint_listings(since=None, refresh=None):
+def _save_page_batch(changed, index_model, summary, single, sync_related=None):
+    """
+    Write and publish a batch of mapped (id, page, data, page content before mapping or None if new) in one
+    transaction, rather than a save, revision and publish per page:
+        1. Add the new pages under the latest index_model page together (publishing.add_children)
+        2. Write the changed fields of the existing pages with a bulk update
+        3. sync_related(saved (page, data)), which returns the ids of pages whose related rows it changed
+        4. Publish a revision of the new pages, and those changed by 2 or 3 (publishing.publish_pages)
+    Every page is fingerprinted, but those whose content the data didn't change aren't published again.
+    Results and failures are recorded in summary. If the batch write fails each record is processed on its own
+    by single(data), so one bad record doesn't fail the rest of the batch.
+    """
+    if not changed:
+        return summary
+    try:
+        with transaction.atomic():
+            published = _write_page_batch(changed, index_model, sync_related)
+    except Exception as e:
+        if len(changed) == 1:
+            summary.failed(changed[0][0], e)
+            return summary
+        logger.warning('AgentBox %s import: batch write failed, retrying each record', summary.name, exc_info=True)
+        return _process_records([(source_id, data) for source_id, _, data, _ in changed], single, summary)
+
+    for _, page, _, content in changed:
+        summary.counts[CREATED if content is None else UPDATED if page in published else SKIPPED] += 1
+    indexing.add(published)
+    return summary
+
+
+def _write_page_batch(changed, index_model, sync_related=None):
+    """
+    The writes of _save_page_batch, returning the pages published
+    """
+    new_pages, modified, fields = [], set(), {'source_hash'}
+    now = timezone.now()
+    for _, page, data, content in changed:
+        if content is None:
+            new_pages.append(page)
+        else:
+            page_fields = publishing.changed_fields(page, content)
+            if page_fields:
+                modified.add(page.pk)
+                fields.update(page_fields)
+                fields.add('modified')
+                page.modified = now  # auto_now isn't applied by bulk updates
+        page.source_hash = fingerprint(data)
+
+    if new_pages:
+        publishing.add_children(index_model.objects.latest('pk'), new_pages)
+    existing = [page for _, page, _, content in changed if content is not None]
+    bulk_update(existing, sorted(fields))
+
+    if sync_related:
+        modified.update(sync_related([(page, data) for _, page, data, _ in changed]))
+    published = new_pages + [page for page in existing if page.pk in modified]
+    with instrumentation.phase('publish'):
+        publishing.publish_pages(published)
+    return published
+
+
+def import_agentpoint_listings(since=None, refresh=None, workers=IMPORT_WORKERS, list_includes=True, force=False,
+                               processes=LISTING_PROCESSES):
     """
     Contact the AgentBox API and import Listings records, creating realestate.listings.PropertyListing
     objects. Will update existing listings based on PropertyListing.uniqueId.
@@ -245,70 +764,300 @@ def import_agentpoint_listings(since=None, refresh=None):
     params:
         since (datetime): Request Listings records updated since this
         refresh (bool): Fully refresh all records.
+        workers (int): Number of concurrent detail requests
+        force (bool): Rewrite records even when their data is unchanged since the last import
+        list_includes (bool): Take the listing details from the list pages, only getting a listing when
+            the fields the list can't return (images, floorplans, links) may have changed. See _listing_page_details
+        processes (int): Import the offices' listings on this many processes at once. See _sync_listing_shards
         Note: If both since and refresh are False(y) we will use the last updated from
-        AgentBoxUpdateMeta.last_updated_listings
+        AgentBoxUpdateMeta.last_updated_listings, or resume an interrupted import. See _start_sync
 
     Workflow:
         1. Determine update since date
-        2. List listings
-        3. Get each listing
+        2. List listings (all pages)
+        3. Get each listing (concurrently, only where needed in list_includes mode)
         4. Create or update record
+        5. Checkpoint each page, then move the watermark once all are done
+
+    Returns an ImportSummary
     """
 
-    try:
-        meta, _ = AgentBoxUpdateMeta.objects.get_or_create()
-    except AgentBoxUpdateMeta.MultipleObjectsReturned:
-        raise AgentBoxException('import_agentpoint_offices: Too Many AgentBoxUpdateMeta')
+    meta = _get_update_meta()
+    checkpoint = _start_sync(meta, 'listings', since, refresh)
 
-    if not since and not refresh:
-        since = meta.last_updated_listings
+    summary = ImportSummary('listings')
+    if processes > 1:
+        return _sync_listing_shards(meta, checkpoint, summary, processes, workers, list_includes, force)
 
     client = AgentBoxListings()
-    list_data = client.list(
-        modifiedAfter=since.isoformat() if since else None
+    client.stats = summary.stats
+    pages, fetch_page, process = _listing_pipeline(client, summary, _resume_after(checkpoint), workers,
+                                                   list_includes, force)
+    return _sync_pages(meta, 'listings', checkpoint, pages, fetch_page, process, summary, ordered=True, batch=True)
+
+
+def _listing_pipeline(client, summary, since, workers=IMPORT_WORKERS, list_includes=True, force=False, **filters):
+    """
+    The pages, fetch_page and process to import listings modified since with _process_pages.
+    filters are passed to AgentBoxListings.list
+    """
+    # Oldest modified first, paged by the newest of each page, so the watermark can advance with each page
+    # and listings modified during the run aren't skipped. The next page is prefetched in the background
+    # while the current one is processed.
+    pages = client.iter_modified_pages(
+        since,
+        prefetch=True,
+        stream=STREAM_RESPONSES,
+        include=client.default_list_include if list_includes else "",
+        **filters
     )
-    listings_data = []
-    # Listings will likely need pagination - so we will build up the list
-    listings_data += list_data['response'].get('listings', [])
-    page = 1
-    while list_data.get('last') and list_data['current'] != list_data['last']:
-        # Current Page and Total Pages in response
-        page += 1
-        list_data = client.list(
-            page=page,
-            modifiedAfter=since.isoformat() if since else None
-        )
-        listings_data += list_data.get('listings', [])
 
-    detailed_listing_data = []
-    for listings_list_data in listings_data:
-        listing_data = client.get(listings_list_data['id'])
-        if listing_data['response'].get('listing'):
-            detailed_listing_data.append(listing_data['response']['listing'])
+    if list_includes:
+        def fetch_page(page):
+            return _listing_page_details(client, page, summary, workers=workers)
+    else:
+        def fetch_page(page):
+            return fetch_details(client.get, [listing['id'] for listing in page], 'listing', summary, workers=workers)
 
-    for listing_data in detailed_listing_data:
-        _process_listing_data(listing_data)
+    return pages, fetch_page, partial(_process_listing_batch, force=force)
 
 
-def _process_listing_data(listing_data={}):
-    if not listing_data.get('id') and listing_data.get('officeId'):
-        raise AgentBoxException('import_agentpoint_listings: Missing required id or officeId')
+def _sync_listing_shards(meta, checkpoint, summary, processes, workers=IMPORT_WORKERS, list_includes=True,
+                         force=False):
+    """
+    Import the listings office by office on a pool of processes, each with its own database connection, HTTP
+    session and share of the API rate limits (see shards.py). The list is filtered by officeId, which is
+    PropertyListing.agentID, so no two shards write the same listing. Only the offices AgentBox lists are imported.
+
+    The shards' counts and stats are merged into summary. Offices are checkpointed as they complete, so an
+    interrupted run resumes with the rest. As offices finish out of order the watermark can't advance page by
+    page, it moves once every office has imported without failures.
+    """
+    offices_client = AgentBoxOffices()
+    offices_client.stats = summary.stats
+    done = set(checkpoint.get('offices') or [])
+
+    with record_run(summary):
+        with summary.stats.phase('list'):
+            office_ids = [office['id'] for office in offices_client.iter_all() if office['id'] not in done]
+
+        tasks = [(office_id, checkpoint['since'], workers, list_includes, force) for office_id in office_ids]
+        for office_id, shard_summary in shards.imap_unordered(tasks, processes):
+            summary.counts.update(shard_summary.counts)
+            summary.failures += shard_summary.failures
+            summary.stats.merge(shard_summary.stats)
+            if not shard_summary.counts['failed']:
+                with summary.stats.phase('checkpoint'):
+                    done.add(office_id)
+                    checkpoint['offices'] = sorted(done)
+                    _save_checkpoint(meta, 'listings', checkpoint)
+
+        with summary.stats.phase('checkpoint'):
+            _finish_sync(meta, 'listings', checkpoint, summary)
+    return summary
+
+
+def _import_office_listings(office_id, since, workers=IMPORT_WORKERS, list_includes=True, force=False):
+    """
+    Import an office's listings modified since, for _sync_listing_shards. Runs in a shard's process.
+    Returns an ImportSummary, its failures made safe to pickle back
+    """
+    summary = ImportSummary('listings office %s' % office_id)
+    client = AgentBoxListings()
+    client.stats = summary.stats
+    pages, fetch_page, process = _listing_pipeline(client, summary, since, workers, list_includes, force,
+                                                   officeId=office_id)
+    with instrumentation.track(summary.stats):
+        try:
+            _process_pages(pages, fetch_page, process, summary, batch=True)
+        except Exception as e:
+            # i.e the list failed. The office is retried by the next run, the other shards carry on
+            summary.failed('office %s' % office_id, e)
+    summary.failures = [(source_id, AgentBoxException('%r' % error)) for source_id, error in summary.failures]
+    return summary
+
+
+def _listing_page_details(client, page, summary, workers=IMPORT_WORKERS):
+    """
+    Yield (id, listing data) for a page of listings listed with AgentBoxListings.default_list_include,
+    rather than a 'get' per listing.
+
+    The list can't return images, floorplans or external links, so a listing is only fetched (for just those
+    fields) when it's new to us or has been modified since we imported it, see _needs_detail. Otherwise the fields
+    are left out of the data, which _process_listing_batch takes as "leave the existing media alone".
+    Avoided detail calls are counted in summary.counts['detail_calls_avoided'].
+    """
+    get_detail_fields = partial(client.get, include=",".join(client.detail_only_fields))
+    imported = _imported_listings([listing['id'] for listing in page])
+    detail_ids = [listing['id'] for listing in page if _needs_detail(listing, imported)]
+    details = dict(fetch_details(get_detail_fields, detail_ids, 'listing', summary, workers=workers))
+
+    for listing_data in page:
+        if listing_data['id'] not in detail_ids:
+            summary.counts['detail_calls_avoided'] += 1
+        elif listing_data['id'] in details:
+            detail = details[listing_data['id']]
+            listing_data.update({field: detail[field] for field in client.detail_only_fields if field in detail})
+        else:
+            continue  # The get failed and is already recorded in the summary
+        yield listing_data['id'], listing_data
+
+
+def _imported_listings(listing_ids):
+    """
+    AgentBox listing id -> (modTime, source_hash) of the listings we've imported
+    """
+    return {
+        unique_id: (mod_time, source_hash)
+        for unique_id, mod_time, source_hash in PropertyListing.objects.filter(uniqueID__in=listing_ids)
+        .values_list('uniqueID', 'modTime', 'source_hash')
+    }
+
+
+def _needs_detail(listing_data, imported):
+    """
+    Whether a listed listing's media may have changed since we last imported it, see _listing_page_details: it's new
+    to us, its lastModified is newer than our modTime, or its listing_fingerprint has changed. Any of its photos or
+    floorplans changing moves lastModified, not just its mainImage.
+    """
+    if listing_data['id'] not in imported:
+        return True
+
+    mod_time, source_hash = imported[listing_data['id']]
     try:
-        listing = PropertyListing.objects.get(
-            uniqueID=listing_data['id'],
-            agentID=listing_data['officeId']
-        )
-    except PropertyListing.DoesNotExist:
-        listing = PropertyListing(
-            uniqueID=listing_data['id'],
-            agentID=listing_data['officeId']
-        )
+        modified = parse_datetime(listing_data.get('lastModified') or '')
+    except ValueError:
+        return True
+    if not modified or not mod_time or modified > mod_time:
+        return True
+    return listing_fingerprint(listing_data) != source_hash
+
+
+# PropertyListing fields written by _map_listing_data, updated in bulk for existing listings
+LISTING_IMPORT_FIELDS = [
+    'auction_date', 'priceView', 'price', 'soldDetails_date', 'soldPrice', 'bedrooms', 'bathrooms', 'parking',
+    'buildingDetails_energyRating', 'headline', 'description', 'modTime', 'authority', 'status', 'underOffer',
+    'property_class', 'listing_type', 'address_street', 'address_subNumber', 'address_suburb', 'address_state',
+    'address_postcode', 'address_country', 'location', 'buildingDetails_area', 'buildingDetails_area_unit',
+    'buildingDetails_newlyBuilt', 'newConstruction', 'updated',
+]
+
+# Standalone fields in the property data that are stored as PropertyFeature rows
+PROPERTY_DATA_FEATURES = [
+    'loungeRooms',
+    'toilets',
+    'studies',
+    'pools',
+    'garages',
+    'carPorts',
+    'carSpaces',
+]
+
+
+def _process_listing_batch(records, summary, force=False):
+    """
+    Process a batch (page) of (id, listing data), updating or creating the PropertyListings and their category,
+    features and agents with a few queries for the whole batch rather than a get and save per row:
+        1. Preload the existing listings, skipping those whose data is unchanged (unless force)
+        2. Map the data onto the listings in memory
+        3. Diff the child rows and write everything with bulk creates, updates and deletes in one transaction
+        4. Update each listing's media, then fingerprint the listings that fully succeeded
+
+    Results and failures are recorded in summary. If the batch write fails each listing is written on its own,
+    so one bad listing doesn't fail the rest of the batch.
+    """
+    records = list(records)
+    existing = {
+        (listing.agentID, listing.uniqueID): listing
+        for listing in PropertyListing.objects.filter(uniqueID__in=[data.get('id') for _, data in records])
+    }
+
+    changed = []
+    for source_id, listing_data in records:
+        try:
+            listing = _listing_for_data(listing_data, existing, force)
+            if listing in (SKIPPED, NOT_ACTIVE):
+                summary.counts[listing] += 1
+                continue
+            _map_listing_data(listing, listing_data)
+            _listing_media(listing_data)  # Check the media URLs before anything is written
+        except Exception as e:
+            summary.failed(source_id, e)
+        else:
+            changed.append((source_id, listing, listing_data))
+
+    if not changed:
+        return summary
+
+    created = {source_id for source_id, listing, _ in changed if listing.pk is None}
+    try:
+        _save_listing_batch(changed)
+        saved = changed
+    except Exception as e:
+        if len(changed) == 1:
+            summary.failed(changed[0][0], e)
+            return summary
+        logger.warning('AgentBox listings import: batch write failed, retrying each listing', exc_info=True)
+        saved = []
+        for change in changed:
+            try:
+                _save_listing_batch([change])
+            except Exception as e:
+                summary.failed(change[0], e)
+            else:
+                saved.append(change)
+
+    # All the batch's new or changed media is downloaded together
+    images, media_errors = fetch_images(
+        (media['url'], _media_modtime(media)) for _, _, listing_data in saved for media in _listing_media(listing_data)
+    )
+
+    fingerprinted = []
+    for source_id, listing, listing_data in saved:
+        try:
+            for media in _listing_media(listing_data):
+                if media['url'] in media_errors:
+                    raise media_errors[media['url']]
+            _process_listing_media_data(listing, listing_data, images)
+        except Exception as e:
+            summary.failed(source_id, e)
+        else:
+            # Only fingerprint once everything has been saved, so a listing that failed part way is retried next import
+            listing.source_hash = listing_fingerprint(listing_data)
+            fingerprinted.append(listing)
+            summary.counts[CREATED if source_id in created else UPDATED] += 1
+
+    bulk_update(fingerprinted, ['source_hash'])
+    _index_listings([listing for _, listing, _ in saved])
+    return summary
+
 
-    # We don't want not-active new listings
-    if not listing.pk and listing_data.get('marketingStatus', '') not in enums.WEBSITE_MARKETING_STATUS_CREATE:
-        print("Not active new listing (%s), skipping (ID: %s)" % (listing_data['marketingStatus'], listing_data['id']))
-        return
+def _listing_for_data(listing_data, existing, force=False):
+    """
+    The existing or new PropertyListing for the data, or SKIPPED if it's unchanged, NOT_ACTIVE if it's new and
+    not for the website
+    """
+    if not listing_data.get('id') or not listing_data.get('officeId'):
+        raise AgentBoxException('import_agentpoint_listings: Missing required id or officeId')
+
+    listing = existing.get((str(listing_data['officeId']), listing_data['id']))
+    if listing is None:
+        # We don't want not-active new listings
+        if listing_data.get('marketingStatus', '') not in enums.WEBSITE_MARKETING_STATUS_CREATE:
+            logger.info('Not active new listing (%s), skipping (ID: %s)',
+                        listing_data.get('marketingStatus'), listing_data['id'])
+            return NOT_ACTIVE
+        return PropertyListing(uniqueID=listing_data['id'], agentID=listing_data['officeId'])
+
+    if listing.source_hash == listing_fingerprint(listing_data) and not force:
+        return SKIPPED
+    return listing
 
+
+def _map_listing_data(listing, listing_data):
+    """
+    Set the PropertyListing fields (LISTING_IMPORT_FIELDS) from the listing data, without saving
+    """
     # 1-1 match fields
     mapped_fields = {
         'auctionDate': 'auction_date',
@@ -351,7 +1100,7 @@ def _process_listing_data(listing_data={}):
             listing.listing_type == listing_enums.LISTING_TYPE_LEASE:
         listing.property_class = listing_enums.PROPERTY_CLASS_RENTAL
 
-    if listing_data['property'].get('address'):
+    if not listing_data['property'].get('address'):
         # No address - can't move forward
         raise AgentBoxException('import_agentpoint_listings: Badly formed listing (no address)')
 
@@ -361,7 +1110,8 @@ def _process_listing_data(listing_data={}):
     address_data = property_data['address']
     listing.address_street = address_data.get('streetName', '')
     listing.address_subNumber = address_data.get('unitNum', address_data.get('logNum', ''))
-    listing.address_suburb = address_data.get('suburb', '')
+    # Uppercase for searching, as PropertyListing.save would - bulk writes don't call it
+    listing.address_suburb = address_data.get('suburb', '').upper()
     listing.address_state = address_data.get('state', '')
     listing.address_postcode = address_data.get('postcode', '')
     listing.address_country = address_data.get('country', '')
@@ -392,95 +1142,206 @@ def _process_listing_data(listing_data={}):
         listing.buildingDetails_newlyBuilt = True
         listing.newConstruction = True
 
-    # The rest of the fields need the listing to exist - so we'll save now
-    listing.save()
 
-    # Category
-    if property_data.get('category'):
-        #  AgentBox only sends 1 category - we will assume the first
-        try:
-            category = PropertyCategory.objects.get(sort_order=0, listing=listing)
-        except PropertyCategory.DoesNotExist:
-            category = PropertyCategory(sort_order=0, listing=listing)
-        if category != property_data['category']:
-            category.name = property_data['category']
-            category.save()
-
-    # Features
-    property_data_features = [
-        # These are standalone fields in the response, but will be ListingFeature objects
-        'loungeRooms',
-        'toilets',
-        'studies',
-        'pools',
-        'garages',
-        'carPorts',
-        'carSpaces',
-    ]
-    if property_data.get('features'):
-        # Comes in as a csv string
-        property_data_features += property_data['features'].split(',')
+def _save_listing_batch(changed):
+    """
+    Write the mapped listings of (id, listing, listing data) and sync their category, features and agents,
+    in one transaction
+    """
+    new_listings = [listing for _, listing, _ in changed if not listing.pk]
+    updated_listings = [listing for _, listing, _ in changed if listing.pk]
+    now = timezone.now()
+    for listing in updated_listings:
+        listing.updated = now  # auto_now isn't applied by bulk updates
+
+    try:
+        with transaction.atomic():
+            PropertyListing.objects.bulk_create(new_listings)
+            bulk_update(updated_listings, LISTING_IMPORT_FIELDS)
+            listings_data = [(listing, listing_data) for _, listing, listing_data in changed]
+            _sync_listing_categories(listings_data)
+            _sync_listing_features(listings_data)
+            _sync_listing_agents(listings_data)
+    except Exception:
+        # Rolled back, so the new listings are still new for a retry
+        for listing in new_listings:
+            listing.pk = None
+            listing._state.adding = True
+        raise
+
+
+def _sync_listing_categories(listings_data):
+    """
+    AgentBox only sends 1 category - we store it as the first PropertyCategory
+    """
+    categories = {
+        category.listing_id: category
+        for category in PropertyCategory.objects.filter(
+            listing__in=[listing.pk for listing, _ in listings_data], sort_order=0
+        )
+    }
+    create, update = [], []
+    for listing, listing_data in listings_data:
+        name = listing_data['property'].get('category')
+        if not name:
+            continue
+        category = categories.get(listing.pk)
+        if category is None:
+            create.append(PropertyCategory(sort_order=0, listing=listing, name=name))
+        elif category.name != name:
+            category.name = name
+            update.append(category)
+
+    PropertyCategory.objects.bulk_create(create)
+    bulk_update(update, ['name'])
+
 
-    for feature in property_data_features:
+def _listing_features(property_data):
+    """
+    Feature name -> value for the property data, as stored on PropertyFeature
+    """
+    features = {}
+    for feature in PROPERTY_DATA_FEATURES:
         if property_data.get(feature):
-            # We have nice name versions in enums - clean or use as is
-            clean_feature = enums.FEATURE_NAME_CLEANUP.get(feature, feature)
-            try:
-                db_feature = PropertyFeature.objects.get(
-                    listing=listing,
-                    name=clean_feature
-                )
-            except PropertyFeature.DoesNotExist:
-                db_feature = PropertyFeature(
-                    sort_order=0,
-                    listing=listing,
-                    name=clean_feature
-                )
-
-            if db_feature.value != property_data[feature]:
-                db_feature.value = property_data[feature]
-                db_feature.save()
-
-    # Agents - we will call based on source_id on AgentPage
-    if listing_data.get('relatedStaffMembers'):
-        # We want to remove any extra agents and make sure these are assigned
-        for index, staff_data in enumerate(listing_data['relatedStaffMembers']):
-            if staff_data['webDisplay'] is False:
-                # Agent atteched internally but not on advertising
+            features[feature] = property_data[feature]
+    if property_data.get('features'):
+        # Comes in as a csv string of the features the property has
+        for feature in property_data['features'].split(','):
+            if feature.strip():
+                features[feature.strip()] = 1
+
+    cleaned = {}
+    for feature, value in features.items():
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            value = 1  # As some features are boolean and some values, value is int and truthy
+        if not value:
+            continue
+        # We have nice name versions in enums - clean or use as is
+        cleaned[enums.FEATURE_NAME_CLEANUP.get(feature, feature)] = value
+    return cleaned
+
+
+def _sync_listing_features(listings_data):
+    """
+    Create, update and delete PropertyFeatures so each listing has just the features in its data
+    """
+    existing = defaultdict(dict)
+    for feature in PropertyFeature.objects.filter(listing__in=[listing.pk for listing, _ in listings_data]):
+        existing[feature.listing_id][feature.name] = feature
+
+    create, update, delete = [], [], []
+    for listing, listing_data in listings_data:
+        features = _listing_features(listing_data['property'])
+        for name, value in features.items():
+            feature = existing[listing.pk].get(name)
+            if feature is None:
+                create.append(PropertyFeature(sort_order=0, listing=listing, name=name, value=value))
+            elif feature.value != value:
+                feature.value = value
+                update.append(feature)
+        delete += [feature.pk for name, feature in existing[listing.pk].items() if name not in features]
+
+    if delete:
+        PropertyFeature.objects.filter(pk__in=delete).delete()
+    PropertyFeature.objects.bulk_create(create)
+    bulk_update(update, ['value'])
+
+
+def _sync_listing_agents(listings_data):
+    """
+    Create, reorder and delete ListingAgents so each listing has just its advertised staff, in order.
+    Staff are matched on AgentPage.source_id, those we don't have are left off. Listings without
+    relatedStaffMembers in their data keep their agents.
+    """
+    listings_data = [(listing, data) for listing, data in listings_data if 'relatedStaffMembers' in data]
+    staff_ids = set()
+    for _, listing_data in listings_data:
+        for staff_data in listing_data['relatedStaffMembers'] or []:
+            staff_ids.add((staff_data.get('staffMember') or {}).get('id'))
+    agent_pages = dict(AgentPage.objects.filter(source_id__in=staff_ids - {None}).values_list('source_id', 'pk'))
+
+    # Each agent's rows, in case a listing has the same agent more than once
+    existing = defaultdict(lambda: defaultdict(list))
+    rows = ListingAgent.objects.filter(listing__in=[listing.pk for listing, _ in listings_data])
+    for agent in rows.order_by('sort_order', 'pk'):
+        existing[agent.listing_id][agent.agent_id].append(agent)
+
+    create, update, delete = [], [], []
+    for listing, listing_data in listings_data:
+        agent_ids = []
+        for staff_data in listing_data['relatedStaffMembers'] or []:
+            if staff_data.get('webDisplay') is False:
+                # Agent attached internally but not on advertising
                 continue
-            try:
-                agent = ListingAgent.objects.get(listing=listing, sort_order=index)
-            except ListingAgent.DoesNotExist:
-                agent = ListingAgent(listing=listing, sort_order=index)
-
-            page = None
-            if 'staffMember' in staff_data and staff_data['staffMember'].get('id'):
-                try:
-                    page = AgentPage.objects.get(source_id=staff_data['staffMember']['id'])
-                except AgentPage.DoesNotExist:
-                    # Agent not in DB, skip
-                    continue
-
-            if page and page.pk != agent.agent_id:
-                agent.agent = page
-                agent.save()
+            agent_id = agent_pages.get((staff_data.get('staffMember') or {}).get('id'))
+            if agent_id and agent_id not in agent_ids:
+                agent_ids.append(agent_id)
+
+        for sort_order, agent_id in enumerate(agent_ids):
+            agents = existing[listing.pk].get(agent_id)
+            if not agents:
+                create.append(ListingAgent(listing=listing, agent_id=agent_id, sort_order=sort_order))
+            elif agents[0].sort_order != sort_order:
+                agents[0].sort_order = sort_order
+                update.append(agents[0])
+        # The rows of agents no longer advertised, and any duplicates of those that are
+        for agent_id, agents in existing[listing.pk].items():
+            delete += [agent.pk for agent in (agents if agent_id not in agent_ids else agents[1:])]
+
+    if delete:
+        ListingAgent.objects.filter(pk__in=delete).delete()
+    bulk_update(update, ['sort_order'])
+    ListingAgent.objects.bulk_create(create)
+
+
+def _index_listings(listings):
+    """
+    Bulk writes skip the post_save signals that keep the search index, cached searches and listing cards up to date,
+    so index the listings, invalidate the searches and refresh the cards here
+    """
+    indexing.add(listings)
+    cards.add([listing.pk for listing in listings])
+    if listings:
+        invalidate_searches()
 
-    # TODO: Documents
+
+def _listing_media(listing_data):
+    """
+    The image and floorplan data of the listing, raising AgentBoxException for any without a URL
+    """
+    media_datas = (listing_data.get('images') or []) + (listing_data.get('floorPlans') or [])
+    for media in media_datas:
+        if not media.get('url'):
+            raise AgentBoxException('Processing Media: URL not found\n %s' % media)
+    return media_datas
+
+
+def _media_modtime(media):
+    try:
+        return parse_datetime(media.get('lastModified') or '')
+    except ValueError:
+        return None
+
+
+def _process_listing_media_data(listing, listing_data, images):
     """
     3 scenarios to account for, 2 with actions:
         1. images tag is missing - Don't edit the photos
         2. images tag exists but is empty - delete all photos
         3. Images tag has content - check and update the existing data
 
-    This is also the same for Floorplans
+    This is also the same for Floorplans. images is url -> Image, as per media.fetch_images
     """
+    # TODO: Documents
     existing_images = ListingImage.objects.filter(listing=listing)
     if 'images' in listing_data:
         if listing_data['images'] is None or listing_data['images'] == []:
             # Remove all
             existing_images.delete()
         else:
-            _process_listing_media(listing, listing_data['images'], existing_images, 'images')
+            _process_listing_media(listing, listing_data['images'], existing_images, images, 'images')
 
     existing_floorplans = ListingFloorplan.objects.filter(listing=listing)
     if 'floorPlans' in listing_data:
@@ -488,41 +1349,38 @@ def _process_listing_data(listing_data={}):
             # Remove all
             existing_floorplans.delete()
         else:
-            _process_listing_media(listing, listing_data['floorPlans'], existing_floorplans, 'floorPlans')
+            _process_listing_media(listing, listing_data['floorPlans'], existing_floorplans, images, 'floorPlans')
 
 
-def _process_listing_media(listing, media_datas, existing_records_qs, media_type='images'):
+def _process_listing_media(listing, media_datas, existing_records_qs, images, media_type='images'):
     """
-    Check our existing records and update accordingly. For images and floorplans
-    NOTE: Floorplans don't have a modified time - so will always update. To discuss with Agentbox.
+    Check our existing records and update accordingly, so they match media_datas in order. For images and floorplans.
+    images is url -> Image for each of media_datas, already fetched. Only records whose image or modified time
+    has changed are saved.
+    NOTE: Floorplans don't have a modified time - their URLs are checked with the server by fetch_images.
     """
-    for index, record, media in enumerate(zip_longest(existing_records_qs, media_datas)):
+    model = ListingImage if media_type == 'images' else ListingFloorplan
+    existing_records = list(existing_records_qs.order_by('sort_order'))
+    for index, (record, media) in enumerate(zip_longest(existing_records, media_datas)):
         if not media:
             # The new images have less than the old, remove the extras
             record.delete()
+            continue
 
-        if 'url' not in media:
-            raise AgentBoxException('Processing Media: URL not found\n %s' % media)
-
-        # See if the mod time on the imported data is newer than the existing
-        try:
-            media_mod_time = parse_datetime(media['lastModified'])
-        except ValueError:
-            media_mod_time == timezone.now()
-        if record and record.external_modtime < media_mod_time:
-            # Our record is older, update
-            setattr(record, record.media_field, wagtail_image_from_url(media['url']))
-            record.external_modtime = media_mod_time
-            record.save()
-        elif not record:
+        image = images[media['url']]
+        media_mod_time = _media_modtime(media)
+        if record is None:
             # Create the new image
-            media_obj = ListingImage(listing=listing, sort_order=index)
-            setattr(media_obj, media_obj.media_field, wagtail_image_from_url(media['url']))
-            media_obj.save()
-        else:
-            # Our record is newer or same, so skip
+            record = model(listing=listing, sort_order=index)
+        elif getattr(record, '%s_id' % record.media_field) == image.pk and record.external_modtime == media_mod_time:
+            # Our record is the same, so skip
             continue
 
+        setattr(record, record.media_field, image)
+        record.external_modtime = media_mod_time
+        record.sort_order = index
+        record.save()
+
 
 def _process_listing_docs(listing, doc_datas, existing_records_qs):
     """
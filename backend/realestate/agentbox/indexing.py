@@ -0,0 +1,129 @@
+"""
+Deferred, bulk search index updates for the imports.
+
+Wagtail keeps the search index up to date with a post_save handler on each indexed model (listings, pages and
+images), which makes a request to the search backend (Elasticsearch) for every object saved - thousands a run.
+Within deferred(), the saves made on that thread, and the bulk writes that skip the signal (add()), only
+collect the objects' ids. flush() then indexes them, fresh from the database, with a bulk request per model
+for every AGENTBOX_INDEX_BATCH_SIZE objects. The imports flush after each page of records, and deferred()
+flushes when its block ends. A bulk request that fails is retried an object at a time, so one bad document
+doesn't leave the rest of the batch stale.
+
+install() puts a post_save handler that checks for deferred() in place of Wagtail's, once at startup: it's
+called by SearchConfig.ready, the AppConfig installed in place of wagtail.search's. Deletes aren't deferred:
+Wagtail's post_delete handler removes the objects from the index as usual, and objects deleted before a flush
+are left out of it.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.db.models.signals import post_save
+from wagtail.search import index
+from wagtail.search.backends import get_search_backends_with_name
+from wagtail.search.signal_handlers import post_save_signal_handler
+from .settings import INDEX_BATCH_SIZE
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def is_deferred():
+    return getattr(_local, 'depth', 0) > 0
+
+
+@contextmanager
+def deferred():
+    """
+    Defer this thread's search index updates until the block ends, or flush() is called. Blocks nest, the
+    outermost flushing. It flushes even if the block raises: whatever was saved is indexed as the database has it.
+    """
+    if not is_deferred():
+        _local.pending = OrderedDict()  # Model -> OrderedDict of pk -> None, an ordered set
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if not _local.depth:
+            try:
+                flush()
+            except Exception:
+                # i.e the database went away. As with the signal, indexing shouldn't fail the import
+                logger.exception('Failed to update the search index')
+
+
+def add(objs):
+    """
+    Index the objects (of any indexed models) in bulk: now, or at the next flush if this thread is deferred
+    """
+    with deferred():
+        for obj in objs:
+            _defer(obj)
+
+
+def flush():
+    """
+    Index the objects this thread has deferred. Returns how many were indexed.
+    """
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return 0
+    _local.pending = OrderedDict()
+    indexed = 0
+    with instrumentation.phase('index'):
+        for model, pks in pending.items():
+            pks = list(pks)
+            for start in range(0, len(pks), INDEX_BATCH_SIZE):
+                indexed += _index(model, pks[start:start + INDEX_BATCH_SIZE])
+    return indexed
+
+
+def _defer(instance):
+    instance = instance.get_indexed_instance()
+    if instance is not None and instance.pk is not None:
+        _local.pending.setdefault(type(instance), OrderedDict())[instance.pk] = None
+
+
+def _index(model, pks):
+    objs = [obj.get_indexed_instance() for obj in model.get_indexed_objects().filter(pk__in=pks)]
+    objs = [obj for obj in objs if obj is not None]
+    if not objs:
+        return 0
+    for backend_name, backend in get_search_backends_with_name(with_auto_update=True):
+        try:
+            backend.add_bulk(model, objs)
+        except Exception:
+            logger.warning("Failed to add %s %s to the '%s' search backend in bulk, adding them one at a time",
+                           len(objs), model._meta.verbose_name_plural, backend_name, exc_info=True)
+            for obj in objs:
+                try:
+                    backend.add(obj)
+                except Exception:
+                    # As with the signal, a search backend being down shouldn't fail the import
+                    logger.exception("Exception raised while adding %r into the '%s' search backend",
+                                     obj, backend_name)
+    return len(objs)
+
+
+def _post_save(sender, instance, update_fields=None, **kwargs):
+    """
+    Stands in for Wagtail's post_save_signal_handler, deferring the update on threads in deferred()
+    """
+    if is_deferred():
+        _defer(instance)
+    else:
+        post_save_signal_handler(instance, update_fields=update_fields, **kwargs)
+
+
+def install():
+    """
+    Route the indexed models' post_save through _post_save rather than Wagtail's handler. Must be called after
+    Wagtail has connected its handlers, see SearchConfig.ready.
+    """
+    for model in index.get_indexed_models():
+        post_save.connect(_post_save, sender=model)
+        post_save.disconnect(post_save_signal_handler, sender=model)
@@ -0,0 +1,263 @@
+"""
+Instrumentation of the AgentBox imports, to see where an import spends its time and what it did.
+
+Each ImportSummary carries an ImportStats, filled in as the import runs:
+    - Wall time per phase: list (list pages), detail (waiting on get requests), process (mapping and
+      writing records), media (downloads and saving images), publish (Wagtail revisions), index (search)
+      and checkpoint. Phases nest and their time is exclusive, so media fetched while processing counts
+      to media alone. Time outside any phase is 'other'.
+    - Database queries per phase
+    - API requests and their latencies per endpoint, recorded by the clients (AgentBoxClient.stats)
+    - Bytes of media downloaded
+
+record_run() saves the stats and the summary's counts to an AgentBoxImportRun, listed in the Wagtail admin.
+
+Phases and queries are only tracked on the thread running the import, which does all the database work.
+API requests are made from the fetch threads too, so are recorded under a lock.
+"""
+
+import datetime
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from django.db import connection
+from django.utils import timezone
+from .models import AgentBoxImportRun
+from .settings import IMPORT_RUN_RETENTION_DAYS
+from . import enums
+
+logger = logging.getLogger(__name__)
+
+# Failures kept on the run log, the rest are only counted
+MAX_LOGGED_FAILURES = 100
+
+_local = threading.local()
+
+
+class ImportStats:
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.timings = Counter()  # Phase -> seconds
+        self.queries = Counter()  # Phase -> queries
+        self.api_latencies = defaultdict(list)  # Endpoint -> seconds for each request
+        self.api_errors = Counter()  # Endpoint -> failed requests (retried or not)
+        self.bytes_downloaded = 0
+        self._phases = []  # Stack of [phase, when it (or the phase above it) last started being timed]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the block as phase name, pausing the enclosing phase's clock until it ends
+        """
+        now = self.clock()
+        if self._phases:
+            parent = self._phases[-1]
+            self.timings[parent[0]] += now - parent[1]
+        self._phases.append([name, now])
+        try:
+            yield
+        finally:
+            now = self.clock()
+            current = self._phases.pop()
+            self.timings[current[0]] += now - current[1]
+            if self._phases:
+                self._phases[-1][1] = now
+
+    def timed(self, iterable, name):
+        """
+        Iterate over iterable, timing each step as phase name. For generators doing their work lazily,
+        i.e fetch_details waiting on the next response.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @property
+    def current_phase(self):
+        return self._phases[-1][0] if self._phases else 'other'
+
+    def count_query(self, execute, sql, params, many, context):
+        """
+        connection.execute_wrapper counting queries against the current phase
+        """
+        self.queries[self.current_phase] += 1
+        return execute(sql, params, many, context)
+
+    def api_call(self, endpoint, seconds, status=None):
+        """
+        Record an API request to endpoint ('listings' or 'listings/1P1364') taking seconds. Status None is a
+        request that failed to connect or timed out
+        """
+        parts = endpoint.strip('/').split('/')
+        key = parts[0] + ('/:id' if len(parts) > 1 else '')
+        with self._lock:
+            self.api_latencies[key].append(seconds)
+            if status is None or status >= 400:
+                self.api_errors[key] += 1
+
+    def downloaded(self, size):
+        with self._lock:
+            self.bytes_downloaded += size
+
+    def merge(self, other):
+        """
+        Add the stats of other, i.e from a shard of the import run in another process
+        """
+        with self._lock:
+            self.timings.update(other.timings)
+            self.queries.update(other.queries)
+            for endpoint, latencies in other.api_latencies.items():
+                self.api_latencies[endpoint] += latencies
+            self.api_errors.update(other.api_errors)
+            self.bytes_downloaded += other.bytes_downloaded
+
+    def __getstate__(self):
+        # Pickled to return a shard's stats from its process, less what can't (or shouldn't) cross over
+        state = self.__dict__.copy()
+        del state['_lock'], state['_phases']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._phases = []
+        self._lock = threading.Lock()
+
+    @property
+    def api_calls(self):
+        return sum(len(latencies) for latencies in self.api_latencies.values())
+
+    def as_dict(self):
+        """
+        {
+            'timings': {phase: seconds},
+            'queries': {phase: count},
+            'api': {endpoint: {'calls', 'errors', 'total', 'mean', 'p50', 'p95', 'max'} (seconds)},
+        }
+        """
+        with self._lock:
+            api = {
+                endpoint: dict(_latency_stats(latencies), errors=self.api_errors[endpoint])
+                for endpoint, latencies in self.api_latencies.items()
+            }
+        return {
+            'timings': {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+            'queries': dict(self.queries),
+            'api': api,
+        }
+
+
+def _latency_stats(latencies):
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        'calls': len(ordered),
+        'total': round(total, 3),
+        'mean': round(total / len(ordered), 3) if ordered else 0,
+        'p50': round(_percentile(ordered, 50), 3),
+        'p95': round(_percentile(ordered, 95), 3),
+        'max': round(ordered[-1], 3) if ordered else 0,
+    }
+
+
+def _percentile(ordered, percent):
+    """
+    Nearest rank percentile of a sorted list
+    """
+    if not ordered:
+        return 0
+    return ordered[max(int(math.ceil(percent / 100.0 * len(ordered))) - 1, 0)]
+
+
+def current_stats():
+    """
+    The stats of the run being recorded on this thread, if any
+    """
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+def phase(name):
+    """
+    Time a block as phase name of the run being recorded, if any. For code that isn't passed the summary.
+    """
+    stats = current_stats()
+    return stats.phase(name) if stats else _noop()
+
+
+@contextmanager
+def track(stats):
+    """
+    Count the block's queries and time phase() against stats, without logging a run
+    """
+    previous, _local.stats = current_stats(), stats
+    try:
+        with connection.execute_wrapper(stats.count_query):
+            yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def record_run(summary):
+    """
+    Record the run of the block as an AgentBoxImportRun, with summary's counts and stats. The block's queries
+    are counted and phase() times against summary.stats. An exception marks the run failed and is re-raised.
+    Yields the run.
+    """
+    stats = summary.stats
+    run = AgentBoxImportRun.objects.create(name=summary.name)
+    started = stats.clock()
+    try:
+        with track(stats):
+            yield run
+    except BaseException as e:
+        run.status = enums.IMPORT_RUN_FAILED
+        run.error = repr(e)
+        raise
+    else:
+        run.status = enums.IMPORT_RUN_COMPLETED
+    finally:
+        run.duration = stats.clock() - started
+        stats.timings['other'] += max(run.duration - sum(stats.timings.values()), 0)
+        _finish_run(run, summary)
+
+
+def _finish_run(run, summary):
+    stats = summary.stats
+    run.finished = timezone.now()
+    run.counts = dict(summary.counts)
+    run.stats = stats.as_dict()
+    if summary.failures:
+        run.stats['failures'] = [[source_id, repr(error)] for source_id, error in
+                                 summary.failures[:MAX_LOGGED_FAILURES]]
+    run.api_calls = stats.api_calls
+    run.queries = sum(stats.queries.values())
+    run.bytes_downloaded = stats.bytes_downloaded
+    try:
+        run.save()
+    except Exception:
+        # i.e the database went away, which has already failed the import. Don't hide why.
+        logger.exception('AgentBox %s import: Failed to save the run log', summary.name)
+
+
+def purge_runs(days=IMPORT_RUN_RETENTION_DAYS):
+    """
+    Delete the logs of runs started more than days ago
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = AgentBoxImportRun.objects.filter(started__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,175 @@
+"""
+Local copies of the AgentBox lookups (regions, property types, enquiry sources, suburbs...).
+
+import_agentpoint_lookups mirrors them into AgentBoxLookup, run on a schedule by sync_agentbox
+(AGENTBOX_SYNC_INTERVALS['lookups']). Forms, validation and imports read them with get_lookup, lookup_choices
+and lookup_name, which cache each lookup in the process for AGENTBOX_LOOKUP_CACHE_TIMEOUT seconds - so
+reading a lookup doesn't make an API request, and usually not a query either, and works while AgentBox is down.
+A lookup that has never been imported is imported the first time it's read.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.db import transaction
+from django.utils import timezone
+from cms.utils import bulk_update
+from .client import AgentBoxLookUps, AgentBoxException
+from .imports import ImportSummary, _get_update_meta
+from .instrumentation import record_run
+from .models import AgentBoxLookup
+from .settings import IMPORT_WORKERS, LOOKUP_CACHE_TIMEOUT, STREAM_RESPONSES
+from . import enums
+
+logger = logging.getLogger(__name__)
+
+# Lookup -> (AgentBoxLookUps method, key of the items in its response)
+LOOKUPS = OrderedDict([
+    (enums.LOOKUP_REGIONS, ('regions', 'regions')),
+    (enums.LOOKUP_SUBSCRIPTIONS, ('subscriptions', 'subscriptions')),
+    (enums.LOOKUP_PROPERTY_TYPES, ('property_types', 'propertyTypes')),
+    (enums.LOOKUP_CONTACT_CLASSES, ('contact_classes', 'contactClasses')),
+    (enums.LOOKUP_ENQUIRY_TYPES, ('enquiry_types', 'enquiryTypes')),
+    (enums.LOOKUP_ENQUIRY_SOURCES, ('enquiry_sources', 'enquirySources')),
+    (enums.LOOKUP_ENQUIRY_INTEREST_LEVELS, ('enquiry_interest_levels', 'enquiryInterestLevels')),
+    (enums.LOOKUP_CONTACT_SOURCES, ('contact_sources', 'contactSources')),
+    (enums.LOOKUP_STAFF_WEB_DISPLAY_TYPES, ('staff_web_display_types', 'staffWebDisplayTypes')),
+    (enums.LOOKUP_SUBURBS, ('suburbs', 'suburbs')),
+])
+
+_cache = {}  # Lookup -> (when loaded, [AgentBoxLookup])
+_cache_lock = threading.Lock()
+
+
+def get_lookup(lookup):
+    """
+    The items of the lookup (i.e enums.LOOKUP_ENQUIRY_SOURCES) as AgentBoxLookups, in AgentBox's order.
+    Empty if it has never been imported and can't be now.
+    """
+    with _cache_lock:
+        cached = _cache.get(lookup)
+    if cached and time.monotonic() - cached[0] < LOOKUP_CACHE_TIMEOUT:
+        return cached[1]
+
+    items = list(AgentBoxLookup.objects.filter(lookup=lookup))
+    if not items and cached is None:
+        # Never imported (or AgentBox has none), so read through to the API
+        try:
+            import_agentpoint_lookups(lookups=[lookup])
+        except (requests.RequestException, AgentBoxException):
+            logger.exception('AgentBox lookups: Failed to import %s', lookup)
+            return []
+        items = list(AgentBoxLookup.objects.filter(lookup=lookup))
+
+    with _cache_lock:
+        _cache[lookup] = (time.monotonic(), items)
+    return items
+
+
+def lookup_choices(lookup):
+    """
+    (AgentBox id, name) for each item of the lookup, for form field choices
+    """
+    return [(item.source_id, item.name) for item in get_lookup(lookup)]
+
+
+def lookup_name(lookup, source_id, default=None):
+    for item in get_lookup(lookup):
+        if item.source_id == str(source_id):
+            return item.name
+    return default
+
+
+def clear_lookup_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def import_agentpoint_lookups(since=None, refresh=False, workers=IMPORT_WORKERS, force=False, lookups=None):
+    """
+    Contact the AgentBox API and mirror the lookups into AgentBoxLookup, creating, updating and deleting
+    rows so each lookup matches AgentBox.
+
+    params:
+        workers (int): Number of lookups requested concurrently
+        lookups (list): Which of LOOKUPS to import, default all
+        Note: Lookups can't be filtered by modified date and are small, so they are always imported in full.
+        since, refresh and force are accepted to match the other imports (see sync.run_sync), and ignored.
+
+    Moves AgentBoxUpdateMeta.last_updated_lookups once every lookup has imported.
+    Returns an ImportSummary
+    """
+    lookups = list(lookups or LOOKUPS)
+    summary = ImportSummary('lookups')
+    client = AgentBoxLookUps()
+    client.stats = summary.stats
+
+    def fetch(lookup):
+        method, list_key = LOOKUPS[lookup]
+        return list(client.paginate(getattr(client, method), list_key, stream=STREAM_RESPONSES))
+
+    with record_run(summary):
+        started = timezone.now()
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(lookups)), 1)) as executor:
+            fetched = [(lookup, executor.submit(fetch, lookup)) for lookup in lookups]
+            for lookup, future in fetched:
+                try:
+                    with summary.stats.phase('detail'):
+                        items = future.result()
+                    with summary.stats.phase('process'):
+                        _save_lookup(lookup, items, summary)
+                except Exception as e:
+                    summary.failed(lookup, e)
+
+        if not summary.counts['failed'] and set(lookups) == set(LOOKUPS):
+            meta = _get_update_meta()
+            meta.last_updated_lookups = started
+            meta.save(update_fields=['last_updated_lookups'])
+
+    clear_lookup_cache()
+    return summary
+
+
+def _source_id(item):
+    """
+    Items are keyed on their id. Those without (i.e suburbs) on their name, state and postcode
+    """
+    if item.get('id'):
+        return str(item['id'])
+    return ' '.join(str(item[field]) for field in ('name', 'state', 'postcode') if item.get(field))
+
+
+def _save_lookup(lookup, items, summary):
+    """
+    Make the lookup's rows match items, in one transaction
+    """
+    existing = {row.source_id: row for row in AgentBoxLookup.objects.filter(lookup=lookup)}
+    create, update, seen = [], [], set()
+    for sort_order, item in enumerate(items):
+        source_id = _source_id(item)
+        if not source_id or source_id in seen:
+            continue
+        seen.add(source_id)
+
+        name = str(item.get('name') or '')
+        row = existing.get(source_id)
+        if row is None:
+            create.append(AgentBoxLookup(lookup=lookup, source_id=source_id, name=name, data=item,
+                                         sort_order=sort_order))
+        elif (row.name, row.data, row.sort_order) != (name, item, sort_order):
+            row.name, row.data, row.sort_order = name, item, sort_order
+            update.append(row)
+        else:
+            summary.counts['skipped'] += 1
+    delete = [row.pk for source_id, row in existing.items() if source_id not in seen]
+
+    with transaction.atomic():
+        AgentBoxLookup.objects.filter(pk__in=delete).delete()
+        AgentBoxLookup.objects.bulk_create(create)
+        bulk_update(update, ['name', 'data', 'sort_order'])
+    summary.counts['created'] += len(create)
+    summary.counts['updated'] += len(update)
+    summary.counts['deleted'] += len(delete)
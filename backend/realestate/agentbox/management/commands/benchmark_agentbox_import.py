@@ -0,0 +1,104 @@
+import os
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from ...fake_server import FakeAgentBox
+from ...imports import import_agentpoint_offices, import_agentpoint_staff, import_agentpoint_listings
+from ...settings import IMPORT_WORKERS, LISTING_PROCESSES
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper that counts queries without keeping them, unlike DEBUG's connection.queries
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Times a full, then an incremental, AgentBox import end to end against a local stand in for the ' \
+           'AgentBox API (see agentbox/fake_server.py). Imports into the configured database, so use a development one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000)
+        parser.add_argument('--offices', type=int, default=10)
+        parser.add_argument('--staff', type=int, default=100)
+        parser.add_argument('--photos', type=int, default=10, help='Photos per listing')
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to each API request')
+        parser.add_argument('--error-rate', type=float, default=0, dest='error_rate',
+                            help='Fraction of API requests that fail with a 503')
+        parser.add_argument('--changed', type=float, default=0.05,
+                            help='Fraction of listings changed before the incremental import')
+        parser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+        parser.add_argument('--processes', type=int, default=LISTING_PROCESSES,
+                            help='Processes importing listings, an office at a time each')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask before importing into the database')
+
+    def handle(self, *args, **options):
+        if options['interactive']:
+            answer = input('This imports test data into the database "%s". Continue? [y/N] ' %
+                           connection.settings_dict['NAME'])
+            if answer.lower() != 'y':
+                raise CommandError('Cancelled')
+
+        # The stand in accepts any credentials
+        os.environ.setdefault('AGENTBOX_API_KEY', 'benchmark')
+        os.environ.setdefault('AGENTBOX_CLIENT_ID', 'benchmark')
+
+        server = FakeAgentBox(
+            listings=options['listings'],
+            offices=options['offices'],
+            staff=options['staff'],
+            photos=options['photos'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+        )
+        workers, processes = options['workers'], options['processes']
+        results = []
+        with server:
+            results.append(self.measure('full', server, lambda: [
+                import_agentpoint_offices(refresh=True, workers=workers),
+                import_agentpoint_staff(refresh=True, workers=workers),
+                import_agentpoint_listings(refresh=True, workers=workers, processes=processes),
+            ]))
+            server.touch(options['changed'])
+            results.append(self.measure('incremental', server, lambda: [
+                import_agentpoint_offices(workers=workers),
+                import_agentpoint_staff(workers=workers),
+                import_agentpoint_listings(workers=workers, processes=processes),
+            ]))
+
+        self.stdout.write('\n%-12s %10s %10s %10s %12s %12s' % (
+            'import', 'wall (s)', 'api calls', 'media', 'db queries', 'peak (MB)'
+        ))
+        for name, wall, api_calls, media, queries, peak in results:
+            self.stdout.write('%-12s %10.2f %10s %10s %12s %12.1f' % (name, wall, api_calls, media, queries, peak))
+
+    def measure(self, name, server, run):
+        """
+        Run the imports, returning (name, wall seconds, API calls, media requests, DB queries, peak MB)
+        """
+        requests_before = server.requests.copy()
+        counter = QueryCounter()
+        tracemalloc.start()
+        started = time.monotonic()
+        with connection.execute_wrapper(counter):
+            summaries = run()
+        wall = time.monotonic() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        served = server.requests - requests_before
+        media = served.pop('media', 0)
+        for summary in summaries:
+            self.stdout.write('%s: %s' % (name, summary))
+            timings = sorted(summary.stats.timings.items(), key=lambda timing: -timing[1])
+            self.stdout.write('    %s' % ", ".join('%s %.2fs' % timing for timing in timings))
+        return name, wall, sum(served.values()), media, counter.count, peak / 1024 / 1024
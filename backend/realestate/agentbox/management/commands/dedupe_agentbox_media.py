@@ -0,0 +1,49 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from wagtail.images.models import Image
+from realestate.listings.models import ListingImage, ListingFloorplan
+from ...media import file_sha256
+from ...models import AgentBoxMedia
+
+
+class Command(BaseCommand):
+    help = 'Points listing photos and floorplans with identical content at a single image, ' \
+           'for media imported before images were content addressed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', dest='delete',
+                            help='Also delete the duplicate images. Only use this if imported listing images '
+                                 'have not been chosen elsewhere, i.e on pages')
+
+    def handle(self, *args, **options):
+        image_ids = set()
+        for model in (ListingImage, ListingFloorplan):
+            image_ids.update(
+                model.objects.exclude(**{'%s__isnull' % model.media_field: True})
+                .values_list('%s_id' % model.media_field, flat=True)
+            )
+
+        by_hash = defaultdict(list)
+        for image in Image.objects.filter(pk__in=image_ids).order_by('pk').iterator():
+            try:
+                by_hash[file_sha256(image.file)].append(image.pk)
+            except (IOError, OSError) as e:
+                self.stderr.write('Skipping image %s: %s' % (image.pk, e))
+
+        duplicates = 0
+        for sha256, ids in by_hash.items():
+            keep, others = ids[0], ids[1:]
+            with transaction.atomic():
+                for model in (ListingImage, ListingFloorplan):
+                    field = '%s_id' % model.media_field
+                    model.objects.filter(**{'%s__in' % field: others}).update(**{field: keep})
+                AgentBoxMedia.objects.filter(image_id__in=ids).update(image_id=keep, sha256=sha256)
+                if others and options['delete']:
+                    for image in Image.objects.filter(pk__in=others):
+                        image.delete()
+            duplicates += len(others)
+
+        self.stdout.write('%s images, %s duplicates %s' % (
+            len(image_ids), duplicates, 'deleted' if options['delete'] else 'no longer used by listings'
+        ))
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from ...events import process_events, purge_events
+from ...instrumentation import purge_runs
+from ...settings import IMPORT_WORKERS, EVENT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Imports the AgentBox records queued by the webhook. With --loop keeps draining the queue as events arrive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', dest='loop',
+                            help='Keep running, checking for new events every --interval seconds')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between checks when idle')
+        parser.add_argument('--batch-size', type=int, default=EVENT_BATCH_SIZE, dest='batch_size')
+        parser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+
+    def handle(self, *args, **options):
+        purged = None
+        while True:
+            summary = process_events(batch_size=options['batch_size'], workers=options['workers'])
+            if summary:
+                self.stdout.write(str(summary))
+                continue  # Straight on to the next batch while there's a backlog
+            if not options['loop']:
+                break
+            # Idle, so tidy up at most hourly
+            if purged is None or time.monotonic() - purged > 3600:
+                purge_events()
+                purge_runs()
+                purged = time.monotonic()
+            time.sleep(options['interval'])
@@ -0,0 +1,47 @@
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from ...settings import IMPORT_WORKERS, SYNC_INTERVALS
+from ...sync import SYNCS, SyncScheduler, run_sync
+
+
+class Command(BaseCommand):
+    help = 'Imports offices, staff and listings from AgentBox. Only one import of each runs at a time, across hosts. ' \
+           'With --daemon keeps importing each on its own interval (AGENTBOX_SYNC_INTERVALS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entities', nargs='*', help='What to import, default all of %s' % ", ".join(SYNCS))
+        parser.add_argument('--daemon', action='store_true', dest='daemon',
+                            help='Keep running, importing each entity on its interval')
+        parser.add_argument('--workers', type=int, default=IMPORT_WORKERS,
+                            help='Concurrent AgentBox requests per import')
+        parser.add_argument('--refresh', action='store_true', dest='refresh',
+                            help='Import everything rather than changes since the last import')
+        parser.add_argument('--force', action='store_true', dest='force',
+                            help='Rewrite records even if unchanged since they were last imported')
+
+    def handle(self, *args, **options):
+        unknown = set(options['entities']) - set(SYNCS)
+        if unknown:
+            raise CommandError('Unknown entities: %s. Choose from %s' % (", ".join(unknown), ", ".join(SYNCS)))
+        entities = [entity for entity in SYNCS if entity in options['entities']] or list(SYNCS)
+
+        if not options['daemon']:
+            for entity in entities:
+                summary = run_sync(entity, workers=options['workers'], refresh=options['refresh'],
+                                   force=options['force'])
+                self.report(entity, summary)
+            return
+
+        scheduler = SyncScheduler(entities, SYNC_INTERVALS, workers=options['workers'], report=self.report)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: scheduler.stop())
+        self.stdout.write('Syncing %s from AgentBox every %s seconds' % (
+            ", ".join(entities), ", ".join(str(SYNC_INTERVALS.get(entity)) for entity in entities)
+        ))
+        scheduler.run_forever()
+
+    def report(self, entity, summary):
+        if summary is None:
+            self.stdout.write('AgentBox %s import is already running, skipped' % entity)
+        else:
+            self.stdout.write(str(summary))
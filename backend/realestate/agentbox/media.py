@@ -0,0 +1,190 @@
+"""
+Downloading AgentBox media (listing photos and floorplans, staff photos) into Wagtail images.
+
+Downloads run on a pool of threads sharing one keep-alive session, streaming to temporary files with a
+timeout and size cap. Only the calling thread touches the database: it looks up and records each URL in
+the AgentBoxMedia index and creates the Images, so media already downloaded is reused rather than
+downloaded again, and changed media is only downloaded when the server says so (ETag/Last-Modified).
+
+Images are content addressed: each download is hashed (SHA-256) and named by it, and media with the same
+bytes as an existing image shares it, whatever its URL. The same photo on a relisted property, or on both
+the sale and lease listings, is stored (and has its renditions generated) once.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+import requests
+from django.core.files import File
+from wagtail.images.models import Image
+
+from .client import AgentBoxException
+from .models import AgentBoxMedia
+from . import instrumentation
+from .settings import MEDIA_WORKERS, MEDIA_TIMEOUT, MEDIA_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# A completed download. file is an open temporary file, deleted once closed, sha256 the hex digest of its content
+# and size its length in bytes
+Download = namedtuple('Download', ['url', 'file', 'etag', 'last_modified', 'sha256', 'size'])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The requests session shared by the download threads, pooling a keep-alive connection per thread per host
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=MEDIA_WORKERS, pool_maxsize=MEDIA_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def download(url, headers=None, max_size=MEDIA_MAX_SIZE, timeout=MEDIA_TIMEOUT):
+    """
+    Stream url to a temporary file. Returns a Download, or None if the server says the media
+    is unchanged (304) since the conditional headers. Raises AgentBoxException if it's over max_size bytes.
+    """
+    with get_session().get(url, headers=headers or {}, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        length = response.headers.get('Content-Length', '')
+        if length.isdigit() and int(length) > max_size:
+            raise AgentBoxException('Media too large (%s bytes): %s' % (length, url))
+
+        media_file = tempfile.TemporaryFile()
+        content_hash = hashlib.sha256()
+        try:
+            size = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise AgentBoxException('Media too large (over %s bytes): %s' % (max_size, url))
+                media_file.write(chunk)
+                content_hash.update(chunk)
+            media_file.seek(0)
+        except Exception:
+            media_file.close()
+            raise
+
+        return Download(url, media_file, response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''),
+                        content_hash.hexdigest(), size)
+
+
+def fetch_images(media, workers=MEDIA_WORKERS):
+    """
+    Get a Wagtail image for each media URL, downloading only what's new or changed.
+
+    params:
+        media (iterable): (url, modified) pairs, modified being AgentBox's lastModified datetime for the media,
+            or None where it has none (i.e floorplans), in which case the server is asked if it's changed
+        workers (int): Maximum concurrent downloads
+
+    Returns (images, errors): dicts of url -> Image, and url -> the exception for failed URLs
+    """
+    with instrumentation.phase('media'):
+        return _fetch_images(media, workers)
+
+
+def _fetch_images(media, workers):
+    wanted = {}
+    for url, modified in media:
+        if url:
+            wanted[url] = max(filter(None, [modified, wanted.get(url)]), default=None)
+
+    records = {record.url: record for record in AgentBoxMedia.objects.filter(url__in=wanted).select_related('image')}
+    images, errors = {}, {}
+    urls = []
+    for url, modified in wanted.items():
+        if url in records and records[url].is_current(modified):
+            images[url] = records[url].image
+        else:
+            urls.append(url)
+
+    if not urls:
+        return images, errors
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(urls)), 1)) as executor:
+        futures = {
+            executor.submit(download, url, records[url].conditional_headers() if url in records else {}): url
+            for url in urls
+        }
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                images[url] = _save_download(url, future.result(), records.get(url), wanted[url])
+            except Exception as e:
+                logger.warning('AgentBox media: failed to fetch %s (%r)', url, e)
+                errors[url] = e
+    return images, errors
+
+
+def _save_download(url, download, record, modified):
+    """
+    Index the downloaded media, creating its Image unless one with the same content exists.
+    download is None when the record's image is unchanged.
+    """
+    if download is None:
+        image = record.image
+        etag, last_modified, sha256 = record.etag, record.last_modified, record.sha256
+    else:
+        stats = instrumentation.current_stats()
+        if stats:
+            stats.downloaded(download.size)
+        with download.file:
+            image = _image_for_content(url, download)
+        etag, last_modified, sha256 = download.etag, download.last_modified, download.sha256
+
+    AgentBoxMedia.objects.update_or_create(url=url, defaults={
+        'image': image,
+        'etag': etag,
+        'last_modified': last_modified,
+        'sha256': sha256,
+        'external_modtime': modified or (record.external_modtime if record else None),
+    })
+    return image
+
+
+def file_sha256(field_file):
+    """
+    Hex SHA-256 of a stored file (i.e Image.file), as media is hashed on download
+    """
+    content_hash = hashlib.sha256()
+    with field_file.open('rb') as opened:
+        for chunk in opened.chunks(CHUNK_SIZE):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def _image_for_content(url, download):
+    """
+    The existing Image with the download's content, otherwise a new Image with its file named by the content hash
+    """
+    existing = (
+        AgentBoxMedia.objects.filter(sha256=download.sha256, image__isnull=False)
+        .select_related('image').first()
+    )
+    if existing:
+        return existing.image
+
+    title = os.path.basename(urlparse(url).path) or 'image'
+    file_name = download.sha256 + (os.path.splitext(title)[1].lower() or '.jpg')
+    image = Image(title=title)
+    image.file.save(file_name, File(download.file))
+    return image
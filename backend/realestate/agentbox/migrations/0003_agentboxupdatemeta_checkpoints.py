@@ -0,0 +1,29 @@
+# Generated by Django 2.1 on 2018-09-10 01:12
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agentbox', '0002_agentboxsettings_staff_webdisplay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agentboxupdatemeta',
+            name='checkpoint_listings',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='agentboxupdatemeta',
+            name='checkpoint_offices',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='agentboxupdatemeta',
+            name='checkpoint_staff',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
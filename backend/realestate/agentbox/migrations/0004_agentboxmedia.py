@@ -0,0 +1,27 @@
+# Generated by Django 2.1 on 2018-09-12 03:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0021_image_file_hash'),
+        ('agentbox', '0003_agentboxupdatemeta_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentBoxMedia',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=1000, unique=True)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=64)),
+                ('external_modtime', models.DateTimeField(blank=True, default=None, help_text='Modified Date from External System', null=True)),
+                ('modtime', models.DateTimeField(auto_now=True)),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wagtailimages.Image')),
+            ],
+        ),
+    ]
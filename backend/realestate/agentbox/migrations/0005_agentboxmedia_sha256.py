@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2018-09-13 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agentbox', '0004_agentboxmedia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agentboxmedia',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Hash of the media content, shared by every URL with the same content', max_length=64),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.1 on 2018-09-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agentbox', '0005_agentboxmedia_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentBoxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('listing', 'Listing'), ('staff', 'Staff'), ('office', 'Office')], max_length=20)),
+                ('source_id', models.CharField(help_text='AgentBox ID of the listing, staff member or office', max_length=50)),
+                ('event', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], default='updated', max_length=20)),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('claimed', models.DateTimeField(blank=True, default=None, null=True)),
+                ('processed', models.DateTimeField(blank=True, db_index=True, default=None, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='agentboxevent',
+            index_together={('entity', 'source_id')},
+        ),
+    ]
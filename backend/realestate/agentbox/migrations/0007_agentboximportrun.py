@@ -0,0 +1,35 @@
+# Generated by Django 2.1 on 2018-09-20 04:12
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agentbox', '0006_agentboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentBoxImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='What was imported, i.e listings', max_length=50)),
+                ('started', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(blank=True, default=None, null=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('duration', models.FloatField(blank=True, default=None, help_text='Seconds', null=True)),
+                ('counts', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('stats', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, help_text='Per phase timings and queries, API call latencies')),
+                ('api_calls', models.PositiveIntegerField(default=0)),
+                ('queries', models.PositiveIntegerField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.1 on 2018-09-24 01:38
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agentbox', '0007_agentboximportrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentBoxLookup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lookup', models.CharField(choices=[('regions', 'Regions'), ('subscriptions', 'Subscriptions'), ('property_types', 'Property types'), ('contact_classes', 'Contact classes'), ('enquiry_types', 'Enquiry types'), ('enquiry_sources', 'Enquiry sources'), ('enquiry_interest_levels', 'Enquiry interest levels'), ('contact_sources', 'Contact sources'), ('staff_web_display_types', 'Staff web display types'), ('suburbs', 'Suburbs')], max_length=50)),
+                ('source_id', models.CharField(help_text='AgentBox ID of the item', max_length=255)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('sort_order', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['lookup', 'sort_order'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='agentboxlookup',
+            unique_together={('lookup', 'source_id')},
+        ),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.contrib.postgres.fields import JSONField
 from wagtail.contrib.settings.models import BaseSetting, register_setting
+from .client import clear_credentials
+from . import enums
 
 
 # Settings
@@ -14,19 +18,143 @@ class AgentBoxSettings(BaseSetting):
         help_text="webDisplay type from AgentBox to expect for public profiles. If not supplied will use all"
     )
 
+    def save(self, **kwargs):
+        super().save(**kwargs)
+        transaction.on_commit(clear_credentials)
+
+    def delete(self, **kwargs):
+        result = super().delete(**kwargs)
+        transaction.on_commit(clear_credentials)
+        return result
+
 
 class AgentBoxUpdateMeta(models.Model):
     """
-    For storing last updated time for import scripts
+    For storing last updated time for import scripts.
+    The checkpoint_* fields hold the progress of an import that is running or was interrupted
+    (see imports._start_sync), so it can resume from the last processed page.
     """
     last_updated_listings = models.DateTimeField(null=True, default=None)
     last_updated_offices = models.DateTimeField(null=True, default=None)
     last_updated_staff = models.DateTimeField(null=True, default=None)
     last_updated_lookups = models.DateTimeField(null=True, default=None)
 
+    checkpoint_listings = JSONField(null=True, blank=True, default=None)
+    checkpoint_offices = JSONField(null=True, blank=True, default=None)
+    checkpoint_staff = JSONField(null=True, blank=True, default=None)
+
     def save(self, **kwargs):
         # We are only allowing a single record - so we check and drop
         if not self.pk and AgentBoxUpdateMeta.objects.all().exists():
             # Already exists
             raise Exception('Only one AgentBoxUpdateMeta can exist')
-        super().save()
+        super().save(**kwargs)
+
+
+class AgentBoxLookup(models.Model):
+    """
+    Local copy of an item of an AgentBox lookup (a region, property type, enquiry source...), refreshed by
+    lookups.import_agentpoint_lookups. data is the item as AgentBox sent it. Read with lookups.get_lookup.
+    """
+    lookup = models.CharField(max_length=50, choices=enums.LOOKUP_CHOICES)
+    source_id = models.CharField(max_length=255, help_text="AgentBox ID of the item")
+    name = models.CharField(max_length=255, blank=True, default="")
+    data = JSONField(default=dict, blank=True)
+    sort_order = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('lookup', 'source_id')]
+        ordering = ['lookup', 'sort_order']
+
+    def __str__(self):
+        return self.name or self.source_id
+
+
+class AgentBoxMedia(models.Model):
+    """
+    Index of media downloaded from AgentBox by URL, so each photo or floorplan is downloaded once and shared
+    by every record using it. etag and last_modified are the response headers, sent back to check the media
+    is unchanged, external_modtime the lastModified AgentBox gave the media (see media.fetch_images).
+    URLs whose content has the same sha256 share an image.
+    """
+    url = models.URLField(max_length=1000, unique=True)
+    image = models.ForeignKey(
+        'wagtailimages.Image',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    etag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+    sha256 = models.CharField(max_length=64, blank=True, default="", db_index=True,
+                              help_text="Hash of the media content, shared by every URL with the same content")
+    external_modtime = models.DateTimeField(blank=True, null=True, default=None,
+                                            help_text='Modified Date from External System')
+    modtime = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
+
+    def is_current(self, external_modtime=None):
+        """
+        Whether the image can be used without asking the server, as AgentBox says it's unchanged
+        """
+        return bool(self.image_id and external_modtime and self.external_modtime and
+                    external_modtime <= self.external_modtime)
+
+    def conditional_headers(self):
+        if not self.image_id:
+            return {}
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class AgentBoxEvent(models.Model):
+    """
+    A change notification received by the webhook (views.WebhookView), queued until events.process_events
+    imports the record. Events are pending until processed is set, and claimed by a worker while it imports them.
+    """
+    entity = models.CharField(max_length=20, choices=enums.EVENT_ENTITY_CHOICES)
+    source_id = models.CharField(max_length=50, help_text="AgentBox ID of the listing, staff member or office")
+    event = models.CharField(max_length=20, choices=enums.EVENT_CHOICES, default=enums.EVENT_UPDATED)
+    received = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(null=True, blank=True, default=None)
+    processed = models.DateTimeField(null=True, blank=True, default=None, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        index_together = [('entity', 'source_id')]
+
+    def __str__(self):
+        return '%s %s %s' % (self.entity, self.source_id, self.event)
+
+
+class AgentBoxImportRun(models.Model):
+    """
+    The log of an import run: its counts (created, updated, skipped, failed...) and where its time went,
+    as recorded by instrumentation.record_run. See instrumentation.ImportStats.as_dict for stats.
+    """
+    name = models.CharField(max_length=50, help_text="What was imported, i.e listings")
+    started = models.DateTimeField(default=timezone.now, db_index=True)
+    finished = models.DateTimeField(null=True, blank=True, default=None)
+    status = models.CharField(max_length=20, choices=enums.IMPORT_RUN_STATUS_CHOICES,
+                              default=enums.IMPORT_RUN_RUNNING)
+    duration = models.FloatField(null=True, blank=True, default=None, help_text="Seconds")
+    counts = JSONField(default=dict, blank=True)
+    stats = JSONField(default=dict, blank=True, help_text="Per phase timings and queries, API call latencies")
+    api_calls = models.PositiveIntegerField(default=0)
+    queries = models.PositiveIntegerField(default=0)
+    bytes_downloaded = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ['-started']
+
+    def __str__(self):
+        return 'AgentBox %s import %s' % (self.name, self.started)
@@ -0,0 +1,117 @@
+"""
+Batched writes of the Wagtail pages made by the imports (OfficePage and AgentPage).
+
+Adding a page with index.add_child(instance=page), then page.save_revision().publish(), takes a couple of
+dozen queries a page: add_child looks up the index's last child and bumps its numchild, and the page is saved
+three times, each validating its slug against its siblings, alongside a revision insert and updates of its
+older revisions. add_children and publish_pages do the same for a batch of pages with a handful of queries
+for the whole batch, and page_content/changed_fields tell which pages actually need a new revision.
+"""
+
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+from modelcluster.models import get_all_child_relations
+from treebeard.exceptions import PathOverflow
+from wagtail.core.models import Page, PageRevision
+from wagtail.core.signals import page_published
+from cms.utils import bulk_update
+
+# Page fields written by publishing a revision
+PUBLISH_FIELDS = [
+    'live',
+    'has_unpublished_changes',
+    'expired',
+    'draft_title',
+    'latest_revision_created_at',
+    'first_published_at',
+    'last_published_at',
+    'live_revision',
+]
+
+
+def page_content(page):
+    """
+    The values of the page's fields, to compare with changed_fields once the import has set them
+    """
+    return {field.attname: field.to_python(getattr(page, field.attname)) for field in page._meta.concrete_fields}
+
+
+def changed_fields(page, content):
+    """
+    The names (attnames) of the page's fields whose values differ from content, as per page_content
+    """
+    return [name for name, value in page_content(page).items() if content.get(name) != value]
+
+
+def add_children(parent, pages):
+    """
+    Add the new (unsaved) pages as the last children of parent, as parent.add_child(instance=page) would
+    for each of them, but locking the parent and updating its numchild once for the batch. The pages are still
+    saved one by one, as Wagtail's multi-table pages can't be bulk created.
+    """
+    if not pages:
+        return pages
+    with transaction.atomic():
+        # Locked so concurrent adds (i.e an editor's) can't take the same paths
+        locked = Page.objects.select_for_update().get(pk=parent.pk)
+        last_child = locked.get_last_child()
+        position = last_child._get_lastpos_in_path() if last_child else 0
+        depth = locked.depth + 1
+        for page in pages:
+            position += 1
+            if len(Page._int2str(position)) > Page.steplen:
+                raise PathOverflow('Path Overflow adding children to %r' % locked.path)
+            page.depth = depth
+            page.path = Page._get_path(locked.path, depth, position)
+            page.numchild = 0
+            page._cached_parent_obj = parent  # For the url_path and slug, without a query per page
+            page.save()
+        Page.objects.filter(pk=locked.pk).update(numchild=F('numchild') + len(pages))
+    parent.numchild = locked.numchild + len(pages)
+    return pages
+
+
+def publish_pages(pages):
+    """
+    Save a revision of each (saved) page and publish it, as page.save_revision().publish() would, with a few
+    queries for the batch: the revisions are bulk created and the pages' PUBLISH_FIELDS bulk updated.
+    page_published is sent for each. Pages of a single model.
+
+    The page's other fields are expected to be saved already, publishing doesn't write them. Pages scheduled
+    to go live later are saved and published one at a time, which schedules them.
+    """
+    now = timezone.now()
+    scheduled = [page for page in pages if page.go_live_at and page.go_live_at > now]
+    for page in scheduled:
+        page.save_revision().publish()
+    pages = [page for page in pages if page not in scheduled]
+    if not pages:
+        return pages
+
+    for page in pages:
+        page.live = True
+        page.has_unpublished_changes = False
+        page.expired = False
+        page.draft_title = page.title
+        page.latest_revision_created_at = now
+        page.last_published_at = now
+        if page.first_published_at is None:
+            page.first_published_at = now
+
+    # The revisions hold the pages' child relations too, read with a query per relation rather than per page
+    prefetch_related_objects(pages, *[rel.get_accessor_name() for rel in get_all_child_relations(type(pages[0]))])
+    revisions = [PageRevision(page=page, content_json=page.to_json(), created_at=now) for page in pages]
+
+    with transaction.atomic():
+        PageRevision.objects.bulk_create(revisions)
+        # As publish() does, nothing older is left awaiting moderation or its go live date
+        PageRevision.objects.filter(page__in=pages).exclude(pk__in=[revision.pk for revision in revisions]).update(
+            submitted_for_moderation=False, approved_go_live_at=None)
+        for page, revision in zip(pages, revisions):
+            page.live_revision = revision
+        bulk_update(pages, PUBLISH_FIELDS)
+
+    for page, revision in zip(pages, revisions):
+        page_published.send(sender=page.specific_class, instance=page, revision=revision)
+    return pages
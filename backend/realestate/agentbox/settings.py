@@ -0,0 +1,83 @@
+from django.conf import settings
+
+# AgentBox API root. Point at a stand in (see fake_server.py) for testing and benchmarking
+BASE_URL = getattr(settings, 'AGENTBOX_BASE_URL', 'https://api.agentboxcrm.com.au/')
+
+# Number of threads used to fetch AgentBox detail records concurrently during imports
+DEFAULT_IMPORT_WORKERS = 8
+IMPORT_WORKERS = getattr(settings, 'AGENTBOX_IMPORT_WORKERS', DEFAULT_IMPORT_WORKERS)
+
+# Processes the listing import runs on, each importing the listings of one office at a time (see shards.py).
+# Full imports scale with the cores, up to the API rate limit, which the processes share
+LISTING_PROCESSES = getattr(settings, 'AGENTBOX_LISTING_PROCESSES', 1)
+
+# Items requested per page by the iter_all() pagination
+PAGE_SIZE = getattr(settings, 'AGENTBOX_PAGE_SIZE', 100)
+
+# Parse list pages as they're read rather than decoding the whole response at once (see streaming.py),
+# which keeps memory flat with large AGENTBOX_PAGE_SIZEs. Pages aren't prefetched when streaming
+STREAM_RESPONSES = getattr(settings, 'AGENTBOX_STREAM_RESPONSES', False)
+
+# Seconds before an API request is abandoned (and retried)
+REQUEST_TIMEOUT = getattr(settings, 'AGENTBOX_REQUEST_TIMEOUT', 60)
+
+# Connections to the API kept alive by the session shared by all clients (client.get_session). Enough for
+# the import workers, plus the page prefetches, of a couple of imports running at once
+CONNECTIONS = getattr(settings, 'AGENTBOX_CONNECTIONS', IMPORT_WORKERS * 2 + 2)
+
+# Seconds the API credentials are cached for in each process. Saving the AgentBoxSettings clears them straight
+# away in that process, others pick them up when their cache expires
+CREDENTIALS_CACHE_TIMEOUT = getattr(settings, 'AGENTBOX_CREDENTIALS_CACHE_TIMEOUT', 5 * 60)
+
+# Client side rate limits (throttle.py), in requests per second and shared by every client in the process.
+# AGENTBOX_ENDPOINT_RATE_LIMITS adds tighter limits to specific endpoints, i.e {'listings': 5}
+RATE_LIMIT = getattr(settings, 'AGENTBOX_RATE_LIMIT', 10)
+RATE_BURST = getattr(settings, 'AGENTBOX_RATE_BURST', 20)
+ENDPOINT_RATE_LIMITS = getattr(settings, 'AGENTBOX_ENDPOINT_RATE_LIMITS', {})
+
+# Retries for throttled (429), server error and connection failed requests
+MAX_RETRIES = getattr(settings, 'AGENTBOX_MAX_RETRIES', 5)
+RETRY_BACKOFF = getattr(settings, 'AGENTBOX_RETRY_BACKOFF', 0.5)  # Seconds, doubled each attempt
+RETRY_MAX_BACKOFF = getattr(settings, 'AGENTBOX_RETRY_MAX_BACKOFF', 30)
+RETRY_STATUSES = getattr(settings, 'AGENTBOX_RETRY_STATUSES', (429, 500, 502, 503, 504))
+
+# Async client (async_client.py) connection pool, shared by all async clients on an event loop
+ASYNC_CONNECTIONS = getattr(settings, 'AGENTBOX_ASYNC_CONNECTIONS', 10)
+ASYNC_KEEPALIVE_TIMEOUT = getattr(settings, 'AGENTBOX_ASYNC_KEEPALIVE_TIMEOUT', 30)  # Seconds
+ASYNC_TIMEOUT = getattr(settings, 'AGENTBOX_ASYNC_TIMEOUT', REQUEST_TIMEOUT)  # Seconds, per request
+
+# Incremental imports re-request this many seconds before the last watermark, to cover clock skew
+# between us and AgentBox and records modified while the previous import was running
+SYNC_OVERLAP = getattr(settings, 'AGENTBOX_SYNC_OVERLAP', 300)
+
+# Objects indexed per bulk request to the search backend, see indexing.py
+INDEX_BATCH_SIZE = getattr(settings, 'AGENTBOX_INDEX_BATCH_SIZE', 500)
+
+# Media (photo and floorplan) downloads, see media.py
+MEDIA_WORKERS = getattr(settings, 'AGENTBOX_MEDIA_WORKERS', 8)
+MEDIA_TIMEOUT = getattr(settings, 'AGENTBOX_MEDIA_TIMEOUT', (5, 30))  # Seconds, (connect, between reads)
+MEDIA_MAX_SIZE = getattr(settings, 'AGENTBOX_MEDIA_MAX_SIZE', 20 * 1024 * 1024)  # Bytes
+
+# Webhook change notifications (views.WebhookView). Senders must pass the secret in an X-Webhook-Token header,
+# the webhook is disabled without one
+WEBHOOK_SECRET = getattr(settings, 'AGENTBOX_WEBHOOK_SECRET', None)
+EVENT_BATCH_SIZE = getattr(settings, 'AGENTBOX_EVENT_BATCH_SIZE', 100)  # Events claimed by a worker at a time
+EVENT_MAX_ATTEMPTS = getattr(settings, 'AGENTBOX_EVENT_MAX_ATTEMPTS', 5)
+# Seconds before events claimed by a worker that died are claimed again
+EVENT_CLAIM_TIMEOUT = getattr(settings, 'AGENTBOX_EVENT_CLAIM_TIMEOUT', 600)
+# Days processed events are kept
+EVENT_RETENTION_DAYS = getattr(settings, 'AGENTBOX_EVENT_RETENTION_DAYS', 7)
+
+# Seconds between runs of each import by sync_agentbox --daemon
+SYNC_INTERVALS = getattr(settings, 'AGENTBOX_SYNC_INTERVALS', {
+    'lookups': 24 * 60 * 60,
+    'offices': 24 * 60 * 60,
+    'staff': 60 * 60,
+    'listings': 5 * 60,
+})
+
+# Days the logs of import runs (models.AgentBoxImportRun) are kept
+IMPORT_RUN_RETENTION_DAYS = getattr(settings, 'AGENTBOX_IMPORT_RUN_RETENTION_DAYS', 90)
+
+# Seconds each process caches the AgentBox lookups (lookups.get_lookup) before reading them from the database again
+LOOKUP_CACHE_TIMEOUT = getattr(settings, 'AGENTBOX_LOOKUP_CACHE_TIMEOUT', 5 * 60)
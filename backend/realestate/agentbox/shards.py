@@ -0,0 +1,37 @@
+"""
+Running the listing import office by office on a pool of processes, see imports._sync_listing_shards.
+
+Workers are spawned rather than forked, so each sets Django up with its own database connection and HTTP session
+instead of inheriting the parent's sockets, and the locks held by its other threads (sync_agentbox --daemon runs
+the imports in threads). Each worker takes an equal share of the API rate limits, so together they stay within them.
+
+The workers import this module before Django is set up, so app code is only imported inside the functions.
+"""
+
+import multiprocessing
+import django
+
+
+def _init_worker(processes, base_url):
+    django.setup()
+    from .client import AgentBoxClient
+    from . import throttle
+    # The parent's API root, which may not be the configured one (i.e FakeAgentBox)
+    AgentBoxClient.base_url = base_url
+    throttle.set_share(1.0 / processes)
+
+
+def _import_office_listings(task):
+    from .imports import _import_office_listings
+    return task[0], _import_office_listings(*task)
+
+
+def imap_unordered(tasks, processes):
+    """
+    Import the listings of each (office id, since, workers, list_includes, force) task on a pool of processes,
+    yielding (office id, ImportSummary) as each completes
+    """
+    from .client import AgentBoxClient
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initializer=_init_worker, initargs=(processes, AgentBoxClient.base_url)) as pool:
+        yield from pool.imap_unordered(_import_office_listings, tasks)
@@ -0,0 +1,81 @@
+"""
+Incremental decoding of AgentBox list responses, for AgentBoxClient.iter_all/iter_pages(stream=True).
+
+response.json() holds the raw body, its decoded text and the parsed records in memory together. A StreamedList
+instead parses the body as it's read off the connection, yielding each record of the list as soon as it's
+complete, so memory stays flat however many records a page holds.
+"""
+
+import ijson
+from ijson.common import ObjectBuilder
+
+SCALAR_EVENTS = ('null', 'boolean', 'number', 'string')
+
+
+class StreamedList:
+    """
+    A list response, i.e {"response": {"current": "1", "last": "4", "listings": [...]}}, being read.
+    Iterate over items for the records of response[list_key]. response holds the response's other (scalar)
+    fields: those ahead of the list as soon as the first record is read, all of them once items is exhausted,
+    or finish() is called.
+    """
+
+    def __init__(self, http_response, list_key):
+        self.list_key = list_key
+        self.response = {}
+        self.count = 0
+        self._http_response = http_response
+        # The raw stream is read as sent, so decompress (gzip) as requests would
+        http_response.raw.decode_content = True
+        self._events = ijson.parse(http_response.raw, use_float=True)
+        self._items = self._parse()
+
+    @property
+    def items(self):
+        return self._items
+
+    def finish(self):
+        """
+        Read (and discard) the rest of the response, i.e the records the caller didn't want, and release the
+        connection
+        """
+        for _ in self._items:
+            pass
+
+    def close(self):
+        self._items.close()
+        self._http_response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _parse(self):
+        item_prefix = 'response.%s.item' % self.list_key
+        try:
+            for prefix, event, value in self._events:
+                if prefix == item_prefix:
+                    self.count += 1
+                    yield self._build(event, value) if event in ('start_map', 'start_array') else value
+                elif event in SCALAR_EVENTS and prefix.startswith('response.') and prefix.count('.') == 1:
+                    self.response[prefix.split('.', 1)[1]] = value
+        finally:
+            self._http_response.close()
+
+    def _build(self, event, value):
+        """
+        Build the record starting with event from the following events
+        """
+        builder = ObjectBuilder()
+        depth = 0
+        while True:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+                if not depth:
+                    return builder.value
+            _, event, value = next(self._events)
@@ -0,0 +1,121 @@
+"""
+Running the AgentBox imports on a schedule, for the sync_agentbox command.
+
+Each import runs under a Postgres advisory lock, so however many hosts run sync_agentbox only one import
+of each entity runs at a time; the others skip that run. In daemon mode each entity is imported on its own
+interval (AGENTBOX_SYNC_INTERVALS) in its own thread, so a long listings import doesn't hold up staff.
+"""
+
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.db import connection
+from .instrumentation import purge_runs
+from .imports import import_agentpoint_offices, import_agentpoint_staff, import_agentpoint_listings
+from .lookups import import_agentpoint_lookups
+from .settings import IMPORT_WORKERS, SYNC_INTERVALS
+
+logger = logging.getLogger(__name__)
+
+# In dependency order - staff belong to offices, listings to staff
+SYNCS = OrderedDict([
+    ('lookups', import_agentpoint_lookups),
+    ('offices', import_agentpoint_offices),
+    ('staff', import_agentpoint_staff),
+    ('listings', import_agentpoint_listings),
+])
+
+
+@contextmanager
+def advisory_lock(name):
+    """
+    Try to take the Postgres session advisory lock for name, yielding whether it was acquired.
+    The lock belongs to the database connection, so is released if the process dies. Other databases
+    have no advisory locks, so it's always acquired.
+    """
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+
+    key = zlib.crc32(name.encode('utf-8'))
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+
+
+def run_sync(entity, **kwargs):
+    """
+    Run the import for entity (lookups|offices|staff|listings) unless one is already running, on any host.
+    kwargs are passed to the import function. Returns its ImportSummary, or None if it was already running.
+    Run logs older than AGENTBOX_IMPORT_RUN_RETENTION_DAYS are cleared out after the import.
+    """
+    with advisory_lock('agentbox-sync-%s' % entity) as acquired:
+        if not acquired:
+            logger.info('AgentBox %s import already running, skipping', entity)
+            return None
+        summary = SYNCS[entity](**kwargs)
+        purge_runs()
+        return summary
+
+
+class SyncScheduler:
+    """
+    Runs each entity's import every intervals[entity] seconds (from the end of the last run), each in a thread
+    of its own, until stop() is called. report is called with (entity, ImportSummary or None if the import
+    was already running) after each run that doesn't raise. Those that do are logged.
+    """
+
+    def __init__(self, entities=None, intervals=SYNC_INTERVALS, workers=IMPORT_WORKERS, report=None,
+                 clock=time.monotonic):
+        self.entities = list(entities or SYNCS)
+        self.intervals = intervals
+        self.workers = workers
+        self.report = report
+        self.clock = clock
+        self.next_run = {entity: clock() for entity in self.entities}
+        self.running = {}
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """
+        Stop scheduling imports. Running imports carry on to the end (they checkpoint every page, so the process
+        may also be killed).
+        """
+        self._stopping.set()
+
+    def due(self):
+        now = self.clock()
+        return [entity for entity in self.entities if entity not in self.running and self.next_run[entity] <= now]
+
+    def run_forever(self, poll=1):
+        with ThreadPoolExecutor(max_workers=len(self.entities)) as executor:
+            while not self._stopping.is_set():
+                for entity, future in list(self.running.items()):
+                    if future.done():
+                        del self.running[entity]
+                        self.next_run[entity] = self.clock() + self.intervals.get(entity, 60 * 60)
+                for entity in self.due():
+                    self.running[entity] = executor.submit(self._run, entity)
+                self._stopping.wait(poll)
+
+    def _run(self, entity):
+        try:
+            summary = run_sync(entity, workers=self.workers)
+        except Exception:
+            logger.exception('AgentBox %s import failed', entity)
+            return
+        finally:
+            # Each thread has its own connection, which would otherwise be left open
+            connection.close()
+        if self.report:
+            self.report(entity, summary)
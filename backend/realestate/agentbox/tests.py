@@ -1,3 +1,662 @@
-from django.test import TestCase
+import copy
+import datetime
+import decimal
+import hashlib
+import io
+import json
+import pickle
+import tempfile
+from unittest import mock
+import requests
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from wagtail.core.models import Page
+from wagtail.images.models import Image
+from realestate.agents.models import AgentIndexPage, AgentPage
+from realestate.listings.models import ListingAgent, ListingFloorplan, ListingImage, PropertyListing
+from realestate.offices.models import OfficePage
 
-# Create your tests here.
+from .client import AgentBoxListings, clear_credentials
+from .fake_server import EXAMPLE_LISTING, FakeAgentBox
+from .models import AgentBoxLookup, AgentBoxMedia
+from .instrumentation import ImportStats
+from .lookups import clear_lookup_cache, lookup_name, _source_id
+from .media import Download, fetch_images
+from .publishing import changed_fields, page_content
+from .imports import (CREATED, SKIPPED, UPDATED, ImportSummary, fetch_details, fingerprint, listing_fingerprint,
+                      _listing_features, _needs_detail, _page_watermark, _process_listing_batch, _resume_after)
+from .streaming import StreamedList
+from .sync import SyncScheduler
+from .settings import RATE_LIMIT
+from .throttle import TokenBucket, get_buckets, parse_retry_after, set_share, should_retry
+from .views import WebhookView
+from . import indexing
+
+
+class FetchDetailsTests(SimpleTestCase):
+
+    def get(self, listing_id):
+        if listing_id == 'broken':
+            raise requests.ConnectionError('Connection reset')
+        if listing_id == 'gone':
+            return {'response': {}}
+        return {'response': {'listing': {'id': listing_id}}}
+
+    def test_keeps_order(self):
+        summary = ImportSummary('listings')
+        ids = [str(i) for i in range(30)]
+        fetched = [source_id for source_id, _ in fetch_details(self.get, ids, 'listing', summary, workers=4)]
+        self.assertEqual(fetched, ids)
+
+    def test_failures_do_not_abort(self):
+        summary = ImportSummary('listings')
+        ids = ['1', 'broken', '2', 'gone', '3']
+        fetched = [record['id'] for _, record in fetch_details(self.get, ids, 'listing', summary, workers=2)]
+        self.assertEqual(fetched, ['1', '2', '3'])
+        self.assertEqual(summary.counts['failed'], 1)
+        self.assertEqual(summary.counts['missing'], 1)
+        self.assertEqual(summary.failures[0][0], 'broken')
+
+    def test_unordered(self):
+        summary = ImportSummary('listings')
+        ids = [str(i) for i in range(30)]
+        fetched = [source_id for source_id, _ in fetch_details(self.get, ids, 'listing', summary, ordered=False)]
+        self.assertEqual(sorted(fetched), sorted(ids))
+
+
+class ThrottleTests(SimpleTestCase):
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(10, capacity=2, clock=lambda: now[0])
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.1)
+        self.assertAlmostEqual(waits[3], 0.2)
+
+        now[0] = 10.0  # Refilled, but a Retry-After holds everyone back
+        bucket.pause(5)
+        self.assertAlmostEqual(bucket.reserve(), 5)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('3'), 3)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertIsNone(parse_retry_after(''))
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_set_share(self):
+        self.addCleanup(set_share, 1)
+        set_share(0.25)
+        self.assertEqual(get_buckets('listings')[0].rate, RATE_LIMIT * 0.25)
+
+    def test_should_retry(self):
+        self.assertTrue(should_retry('get', 0, 429))
+        self.assertTrue(should_retry('get', 0, 503))
+        self.assertTrue(should_retry('get', 0))
+        self.assertFalse(should_retry('get', 0, 404))
+        self.assertFalse(should_retry('post', 0, 503))
+        self.assertTrue(should_retry('post', 0, 429))
+        self.assertFalse(should_retry('get', 100, 429))
+
+
+class StubListings(AgentBoxListings):
+    """ Three pages of listings, the last one partial """
+    last_page = 3
+
+    def list(self, page=1, limit=20, **filters):
+        self.pages_requested.append(page)
+        count = limit if page < self.last_page else 1
+        return {'response': {
+            'current': str(page),
+            'last': str(self.last_page),
+            'listings': [{'id': '%s-%s' % (page, i)} for i in range(count)]
+        }}
+
+
+@mock.patch('realestate.agentbox.client._resolve_credentials', return_value=('key', 'client'))
+class CredentialsTests(SimpleTestCase):
+
+    def setUp(self):
+        clear_credentials()
+
+    def tearDown(self):
+        clear_credentials()
+
+    def test_cached(self, resolve):
+        first, second = AgentBoxListings(), AgentBoxListings()
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual((second._key, second._client_id), ('key', 'client'))
+        self.assertIs(first._session, second._session)
+
+        clear_credentials()
+        AgentBoxListings()
+        self.assertEqual(resolve.call_count, 2)
+
+    def test_kwargs(self, resolve):
+        client = AgentBoxListings(client_id='other')
+        self.assertEqual((client._key, client._client_id), ('key', 'other'))
+
+
+class IterAllTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = StubListings(key='key', client_id='client')
+        self.client.pages_requested = []
+
+    def test_iterates_all_pages(self):
+        listings = list(self.client.iter_all(page_size=5))
+        self.assertEqual(len(listings), 11)
+        self.assertEqual(self.client.pages_requested, [1, 2, 3])
+
+    def test_prefetch(self):
+        listings = list(self.client.iter_all(page_size=5, prefetch=True))
+        self.assertEqual(len(listings), 11)
+        self.assertEqual(self.client.pages_requested, [1, 2, 3])
+
+    def test_lazy(self):
+        listings = self.client.iter_all(page_size=5)
+        next(listings)
+        self.assertEqual(self.client.pages_requested, [1])
+
+
+class FakeListings(AgentBoxListings):
+    """ Lists the listings of a FakeAgentBox, without a server """
+
+    def list(self, page=1, limit=20, include="", orderBy="", order="", **filters):
+        query = {'page': str(page), 'limit': str(limit), 'include': include, 'orderBy': orderBy, 'order': order}
+        query.update(('filter[%s]' % key, value) for key, value in filters.items() if value)
+        return self.fake.respond('/listings', query)[1]
+
+
+class ModifiedPagesTests(SimpleTestCase):
+
+    def setUp(self):
+        self.fake = FakeAgentBox(listings=25, offices=2, staff=4, photos=1)
+        self.client = FakeListings(key='key', client_id='client')
+        self.client.fake = self.fake
+        self.ids = [listing['id'] for listing in self.fake.listings]
+
+    def listed(self, **kwargs):
+        return [listing['id'] for _, page in self.client.iter_modified_pages(page_size=10, **kwargs)
+                for listing in page]
+
+    def test_all_pages(self):
+        self.assertEqual(self.listed(), self.ids)
+        self.assertEqual(self.listed(prefetch=True), self.ids)
+
+    def test_modified_after(self):
+        self.assertEqual(self.listed(modified_after=self.fake.listings[19]['lastModified']), self.ids[20:])
+
+    def test_modified_while_listing(self):
+        # Paging by number, the listings after the one modified would move back a place and one would be skipped
+        listed = []
+        for _, page in self.client.iter_modified_pages(page_size=10):
+            listed += [listing['id'] for listing in page]
+            if len(listed) == 10:
+                self.fake.listings[0]['lastModified'] = timezone.now().isoformat()
+        self.assertEqual(listed, self.ids + self.ids[:1])
+
+    def test_modified_at_once_across_pages(self):
+        for listing in self.fake.listings[8:13]:
+            listing['lastModified'] = self.fake.listings[8]['lastModified']
+        self.assertEqual(self.listed(), self.ids)
+
+    def test_more_than_a_page_modified_at_once(self):
+        for listing in self.fake.listings:
+            listing['lastModified'] = self.fake.listings[0]['lastModified']
+        self.assertEqual(self.listed(), self.ids)
+
+    def scripted(self, *pages):
+        # Each page is (listings, whether there's another), whatever is asked for
+        return mock.patch.object(self.client, 'list', side_effect=[
+            {'response': {'current': '1', 'last': '2' if more else '1', 'listings': listings}}
+            for listings, more in pages
+        ])
+
+    def test_undated_listed(self):
+        with self.scripted(
+            ([{'id': '1', 'lastModified': None}, {'id': '2', 'lastModified': '2018-06-01T10:00:00+10:00'}], True),
+            ([{'id': '3', 'lastModified': '2018-06-02T10:00:00+10:00'},
+              {'id': '4', 'lastModified': '2018-06-03T10:00:00+10:00'}], True),
+            ([{'id': '4', 'lastModified': '2018-06-03T10:00:00+10:00'},
+              {'id': '5', 'lastModified': '2018-06-04T10:00:00+10:00'}], False),
+        ) as listed:
+            self.assertEqual([listing['id'] for _, page in self.client.iter_modified_pages(page_size=2)
+                              for listing in page], ['1', '2', '3', '4', '5'])
+        # On by number past the undated, then by keyset
+        self.assertEqual([(call[1]['page'], call[1]['modifiedAfter']) for call in listed.call_args_list],
+                         [(1, None), (2, None), (1, '2018-06-03T09:59:59+10:00')])
+
+    def test_naive_modified_after(self):
+        with self.scripted(
+            ([{'id': '1', 'lastModified': '2018-06-02T10:00:00+10:00'},
+              {'id': '2', 'lastModified': '2018-06-03T10:00:00+10:00'}], True),
+            ([{'id': '3', 'lastModified': '2018-06-04T10:00:00+10:00'}], False),
+        ) as listed:
+            pages = list(self.client.iter_modified_pages(modified_after='2018-06-01T00:00:00', page_size=2))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual([(call[1]['page'], call[1]['modifiedAfter']) for call in listed.call_args_list],
+                         [(1, '2018-06-01T00:00:00'), (1, '2018-06-03T09:59:59+10:00')])
+
+
+class ListIncludesTests(SimpleTestCase):
+
+    def setUp(self):
+        self.listing = {'id': '1P1', 'lastModified': '2018-06-01T10:00:00+10:00',
+                        'mainImage': {'lastModified': '2018-05-01T10:00:00+10:00'}}
+        self.imported = {'1P1': (datetime.datetime(2018, 6, 1, tzinfo=timezone.utc),
+                                 listing_fingerprint(self.listing))}
+
+    def test_needs_detail(self):
+        # New listing
+        self.assertTrue(_needs_detail({'id': '1P2'}, self.imported))
+        # Unchanged
+        self.assertFalse(_needs_detail(self.listing, self.imported))
+        # Changed without lastModified moving
+        self.assertTrue(_needs_detail(dict(self.listing, displayPrice='$1,385,000'), self.imported))
+        # Can't tell
+        self.assertTrue(_needs_detail(dict(self.listing, lastModified=None), self.imported))
+
+    def test_needs_detail_other_media_changed(self):
+        # A floorplan or a photo other than the main one replaced: only lastModified moves in the list
+        modified = dict(self.listing, lastModified='2018-06-02T10:00:00+10:00')
+        self.assertTrue(_needs_detail(modified, self.imported))
+
+
+class SyncCheckpointTests(SimpleTestCase):
+
+    def setUp(self):
+        self.checkpoint = {'since': None, 'started': '2018-09-01T00:00:00+00:00', 'page': 0, 'modified': None,
+                           'advance': True}
+        self.page = [
+            {'id': '1', 'lastModified': '2018-08-01T10:00:00+10:00'},
+            {'id': '2', 'lastModified': '2018-08-02T10:00:00+10:00'},
+        ]
+
+    def test_page_watermark(self):
+        watermark = _page_watermark(self.page, self.checkpoint, ImportSummary('listings'))
+        self.assertEqual(watermark, datetime.datetime(2018, 8, 2, 0, 0, tzinfo=timezone.utc))
+
+    def test_page_watermark_after_failure(self):
+        summary = ImportSummary('listings')
+        summary.failed('3', Exception())
+        self.assertIsNone(_page_watermark(self.page, self.checkpoint, summary))
+
+    def test_page_watermark_capped_at_start(self):
+        self.page.append({'id': '4', 'lastModified': '2018-10-01T10:00:00+10:00'})
+        watermark = _page_watermark(self.page, self.checkpoint, ImportSummary('listings'))
+        self.assertEqual(watermark, datetime.datetime(2018, 9, 1, tzinfo=timezone.utc))
+
+    def test_resume_after(self):
+        self.assertIsNone(_resume_after(self.checkpoint))
+        self.checkpoint['modified'] = '2018-08-02T10:00:00+10:00'
+        self.assertEqual(_resume_after(self.checkpoint), '2018-08-02T09:59:59+10:00')
+
+
+class FingerprintTests(SimpleTestCase):
+
+    def test_stable(self):
+        first = {'id': '1P1364', 'property': {'bedrooms': '3', 'bathrooms': '2'}, 'images': []}
+        reordered = {'images': [], 'property': {'bathrooms': '2', 'bedrooms': '3'}, 'id': '1P1364'}
+        self.assertEqual(fingerprint(first), fingerprint(reordered))
+        self.assertEqual(len(fingerprint(first)), 64)
+
+    def test_changes(self):
+        listing = {'id': '1P1364', 'displayPrice': 'Contact Agent'}
+        changed = dict(listing, displayPrice='$1,385,000')
+        self.assertNotEqual(fingerprint(listing), fingerprint(changed))
+
+    def test_listing_listed_or_fetched(self):
+        staff = {'id': '1stf0004', 'firstName': 'Amanda', 'lastName': 'Thomson'}
+        fetched = {'id': '1P1364', 'images': [{'url': 'https://example.com/1.jpg'}], 'floorPlans': [],
+                   'relatedStaffMembers': [{'webDisplay': True, 'staffMember': staff}]}
+        listed = {'id': '1P1364', 'mainImage': {'url': 'https://example.com/1.jpg'},
+                  'relatedStaffMembers': [{'webDisplay': True, 'staffMember': {'id': '1stf0004'}}]}
+        self.assertEqual(listing_fingerprint(fetched), listing_fingerprint(listed))
+        self.assertNotEqual(listing_fingerprint(fetched), listing_fingerprint(dict(listed, lastModified='2018-09-01')))
+
+
+@mock.patch('realestate.agentbox.imports._index_listings')
+class ListingBatchTests(TestCase):
+    """
+    _process_listing_batch end to end, for a listing without media
+    """
+
+    def setUp(self):
+        with open(EXAMPLE_LISTING) as example:
+            self.data = json.load(example)['response']['listing']
+        for field in AgentBoxListings.detail_only_fields:
+            del self.data[field]
+        index = Page.objects.get(depth=1).add_child(instance=AgentIndexPage(title='Agents', slug='test-agents'))
+        self.amanda = index.add_child(instance=AgentPage(title='Amanda Thomson', slug='amanda', source_id='1stf0004'))
+        self.nick = index.add_child(instance=AgentPage(title='Nick Jones', slug='nick', source_id='1stf0012'))
+
+    def process(self, data):
+        summary = ImportSummary('listings')
+        _process_listing_batch([(data['id'], copy.deepcopy(data))], summary)
+        self.assertFalse(summary.failures)
+        return summary.counts
+
+    def agents(self, listing):
+        return list(ListingAgent.objects.filter(listing=listing).order_by('sort_order').values_list('agent', flat=True))
+
+    def test_create(self, index_listings):
+        self.assertEqual(self.process(self.data)[CREATED], 1)
+        listing = PropertyListing.objects.get(uniqueID=self.data['id'])
+        self.assertEqual((listing.agentID, listing.address_suburb), ('4', 'BENTLEIGH'))
+        self.assertEqual([category.name for category in listing.categories.all()], ['House'])
+        # In the order listed, without the appraisal agent that isn't displayed
+        self.assertEqual(self.agents(listing), [self.nick.pk, self.amanda.pk])
+        index_listings.assert_called_once_with([listing])
+
+    def test_unchanged_listed_or_fetched(self, index_listings):
+        self.process(self.data)
+        listed = dict(self.data, mainImage={'id': '1', 'lastModified': self.data['lastModified']})
+        listed['relatedStaffMembers'] = [dict(staff_data, staffMember={'id': staff_data['staffMember']['id']})
+                                         for staff_data in self.data['relatedStaffMembers']]
+        self.assertEqual(self.process(listed)[SKIPPED], 1)
+        fetched = dict(self.data, images=[], floorPlans=[], externalLinks=[])
+        self.assertEqual(self.process(fetched)[SKIPPED], 1)
+
+    def test_update_removes_duplicate_agents(self, index_listings):
+        self.process(self.data)
+        listing = PropertyListing.objects.get(uniqueID=self.data['id'])
+        ListingAgent.objects.create(listing=listing, agent=self.nick, sort_order=2)
+        ListingAgent.objects.create(listing=listing, agent=self.amanda, sort_order=3)
+
+        changed = dict(self.data, displayPrice='Offers over $1,000,000')
+        changed['relatedStaffMembers'] = self.data['relatedStaffMembers'][1:2]
+        self.assertEqual(self.process(changed)[UPDATED], 1)
+        listing.refresh_from_db()
+        self.assertEqual(listing.priceView, 'Offers over $1,000,000')
+        self.assertEqual(self.agents(listing), [self.nick.pk])
+
+
+class PageContentTests(SimpleTestCase):
+
+    def test_changed_fields(self):
+        page = OfficePage(pk=1, title='Sydney', office_name='Sydney', latitude=decimal.Decimal('-33.868800'))
+        content = page_content(page)
+        # As mapped by the import, the same values
+        page.title = page.office_name = 'Sydney'
+        page.latitude = '-33.8688'
+        self.assertEqual(changed_fields(page, content), [])
+
+        page.phone = '02 9999 9999'
+        self.assertEqual(changed_fields(page, content), ['phone'])
+
+
+class ListingFeaturesTests(SimpleTestCase):
+
+    def test_listing_features(self):
+        features = _listing_features({
+            'toilets': '2',
+            'pools': '0',
+            'garages': None,
+            'features': 'Dishwasher, Built-in Wardrobes,',
+        })
+        self.assertEqual(features, {'Toilets': 2, 'Dishwasher': 1, 'Built-in Wardrobes': 1})
+
+
+class AgentBoxMediaTests(SimpleTestCase):
+
+    def setUp(self):
+        self.modtime = datetime.datetime(2018, 6, 1, tzinfo=timezone.utc)
+        self.media = AgentBoxMedia(url='https://example.com/1.jpg', image_id=1, etag='"abc"',
+                                   external_modtime=self.modtime)
+
+    def test_is_current(self):
+        self.assertTrue(self.media.is_current(self.modtime))
+        self.assertFalse(self.media.is_current(self.modtime + datetime.timedelta(days=1)))
+        self.assertFalse(self.media.is_current(None))  # Floorplans have to be checked with the server
+
+    def test_conditional_headers(self):
+        self.assertEqual(self.media.conditional_headers(), {'If-None-Match': '"abc"'})
+        self.media.image_id = None
+        self.assertEqual(self.media.conditional_headers(), {})
+
+
+class MediaDedupeTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        fake = FakeAgentBox(listings=0, offices=1, staff=0)
+        self.photo = fake.media('photo')
+        self.other = fake.media('other')
+
+    def downloaded(self, url, content):
+        media_file = tempfile.TemporaryFile()
+        media_file.write(content)
+        media_file.seek(0)
+        return Download(url, media_file, '', '', hashlib.sha256(content).hexdigest(), len(content))
+
+    def image(self, content):
+        # As imported before images were content addressed
+        image = Image(title='photo.jpg')
+        image.file.save('photo.jpg', ContentFile(content))
+        return image
+
+    def fetch(self, content):
+        with mock.patch('realestate.agentbox.media.download',
+                        side_effect=lambda url, headers: self.downloaded(url, content[url])):
+            images, errors = fetch_images((url, None) for url in content)
+        self.assertEqual(errors, {})
+        return images
+
+    def test_same_content_stored_once(self):
+        images = self.fetch({
+            'https://example.com/sale/photo.jpg': self.photo,
+            'https://example.com/lease/photo.jpg': self.photo,
+            'https://example.com/other.jpg': self.other,
+        })
+        self.assertEqual(images['https://example.com/sale/photo.jpg'], images['https://example.com/lease/photo.jpg'])
+        self.assertNotEqual(images['https://example.com/sale/photo.jpg'], images['https://example.com/other.jpg'])
+        self.assertEqual(Image.objects.count(), 2)
+
+        # And later, say on a relisting
+        images_later = self.fetch({'https://example.com/relisted/photo.jpg': self.photo})
+        self.assertEqual(images_later['https://example.com/relisted/photo.jpg'],
+                         images['https://example.com/sale/photo.jpg'])
+        self.assertEqual(Image.objects.count(), 2)
+
+    def test_dedupe_command(self):
+        first, duplicate, other = self.image(self.photo), self.image(self.photo), self.image(self.other)
+        listing = PropertyListing.objects.create(uniqueID='L1', agentID='1', headline='Listing', description='')
+        listing_images = [ListingImage.objects.create(listing=listing, image=image, sort_order=order)
+                          for order, image in enumerate([first, duplicate, other])]
+        floorplan = ListingFloorplan.objects.create(listing=listing, floorplan=duplicate)
+        record = AgentBoxMedia.objects.create(url='https://example.com/photo.jpg', image=duplicate)
+
+        call_command('dedupe_agentbox_media', '--delete', stdout=io.StringIO())
+
+        # Repointed before the duplicate was deleted, which would otherwise have nulled them
+        self.assertEqual([ListingImage.objects.get(pk=listing_image.pk).image_id for listing_image in listing_images],
+                         [first.pk, first.pk, other.pk])
+        floorplan.refresh_from_db()
+        self.assertEqual(floorplan.floorplan_id, first.pk)
+        record.refresh_from_db()
+        self.assertEqual(record.image_id, first.pk)
+        self.assertEqual(record.sha256, hashlib.sha256(self.photo).hexdigest())
+        self.assertFalse(Image.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(Image.objects.count(), 2)
+
+
+class FakeAgentBoxTests(SimpleTestCase):
+
+    def test_list_pages(self):
+        fake = FakeAgentBox(listings=25, offices=2, staff=4, photos=2)
+        status, data = fake.respond('/listings', {'page': '3', 'limit': '10', 'include': 'mainImage,images'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['response']['last'], '3')
+        self.assertEqual(len(data['response']['listings']), 5)
+        self.assertIn('mainImage', data['response']['listings'][0])
+        self.assertNotIn('images', data['response']['listings'][0])  # Only available from get
+
+    def test_modified_after(self):
+        fake = FakeAgentBox(listings=25, offices=2, staff=4, photos=2)
+        since = fake.listings[19]['lastModified']
+        _, data = fake.respond('/listings', {'filter[modifiedAfter]': since, 'orderBy': 'lastModified'})
+        self.assertEqual([listing['id'] for listing in data['response']['listings']],
+                         [listing['id'] for listing in fake.listings[20:]])
+
+
+@mock.patch('realestate.agentbox.views.WEBHOOK_SECRET', 'secret')
+class WebhookTests(SimpleTestCase):
+
+    def post(self, data, token='secret'):
+        request = RequestFactory().post('/agentbox/webhook/', json.dumps(data), content_type='application/json',
+                                        HTTP_X_WEBHOOK_TOKEN=token)
+        return WebhookView.as_view()(request)
+
+    def test_requires_token(self):
+        self.assertEqual(self.post({'type': 'listing', 'id': '1P1364'}, token='wrong').status_code, 403)
+
+    def test_rejects_invalid_events(self):
+        self.assertEqual(self.post({'type': 'contact', 'id': '1'}).status_code, 400)
+        self.assertEqual(self.post({'events': [{'type': 'listing'}]}).status_code, 400)
+
+    @mock.patch('realestate.agentbox.views.AgentBoxEvent.objects.bulk_create')
+    def test_queues_events(self, bulk_create):
+        response = self.post({'events': [
+            {'type': 'listing', 'id': '1P1364', 'event': 'updated'},
+            {'type': 'staff', 'id': '1stf0004', 'event': 'deleted'},
+        ]})
+        self.assertEqual(response.status_code, 202)
+        events = bulk_create.call_args[0][0]
+        self.assertEqual([(e.entity, e.source_id, e.event) for e in events],
+                         [('listing', '1P1364', 'updated'), ('staff', '1stf0004', 'deleted')])
+
+
+class DeferredIndexingTests(SimpleTestCase):
+
+    @mock.patch('realestate.agentbox.indexing._index', return_value=2)
+    def test_deferred(self, index):
+        first, second = mock.Mock(pk=1), mock.Mock(pk=2)
+        first.get_indexed_instance.return_value = first
+        second.get_indexed_instance.return_value = second
+
+        with indexing.deferred():
+            indexing.add([first, second])
+            with indexing.deferred():
+                indexing.add([first])
+            self.assertFalse(index.called)  # Only the outermost block flushes
+        self.assertEqual(index.call_args_list, [mock.call(type(first), [1]), mock.call(type(second), [2])])
+
+        # Not deferred, so indexed straight away
+        index.reset_mock()
+        indexing.add([first])
+        index.assert_called_once_with(type(first), [1])
+
+
+class SyncSchedulerTests(SimpleTestCase):
+
+    def test_due(self):
+        now = [0]
+        scheduler = SyncScheduler(['staff', 'listings'], {'staff': 3600, 'listings': 300}, clock=lambda: now[0])
+        self.assertEqual(scheduler.due(), ['staff', 'listings'])
+
+        scheduler.running['listings'] = mock.Mock()
+        self.assertEqual(scheduler.due(), ['staff'])  # Never two of the same import at once
+
+        scheduler.running = {}
+        scheduler.next_run = {'staff': 3600, 'listings': 300}
+        now[0] = 600
+        self.assertEqual(scheduler.due(), ['listings'])
+
+
+class ImportStatsTests(SimpleTestCase):
+
+    def test_phases_are_exclusive(self):
+        now = [0]
+        stats = ImportStats(clock=lambda: now[0])
+        with stats.phase('process'):
+            now[0] += 2
+            with stats.phase('media'):
+                now[0] += 5
+            now[0] += 1
+        self.assertEqual(stats.timings, {'process': 3, 'media': 5})
+
+    def test_timed(self):
+        now = [0]
+        stats = ImportStats(clock=lambda: now[0])
+
+        def pages():
+            for page in range(3):
+                now[0] += 1  # Waiting on the API
+                yield page
+
+        for _ in stats.timed(pages(), 'list'):
+            with stats.phase('process'):
+                now[0] += 10
+        self.assertEqual(stats.timings, {'list': 3, 'process': 30})
+
+    def test_merge(self):
+        stats, shard = ImportStats(), ImportStats()
+        stats.api_call('offices', 0.5, 200)
+        with shard.phase('process'):
+            shard.api_call('listings', 1, 200)
+            shard.downloaded(1024)
+        shard = pickle.loads(pickle.dumps(shard))  # As returned from a shard's process
+        stats.merge(shard)
+        self.assertEqual(stats.api_calls, 2)
+        self.assertEqual(stats.bytes_downloaded, 1024)
+        self.assertIn('process', stats.timings)
+
+    def test_api_calls(self):
+        stats = ImportStats()
+        for seconds in range(1, 21):
+            stats.api_call('listings/1P%s' % seconds, seconds / 10.0, 200)
+        stats.api_call('listings', 1, 503)
+        stats.api_call('listings', 2)
+        api = stats.as_dict()['api']
+        self.assertEqual(stats.api_calls, 22)
+        self.assertEqual(api['listings/:id']['p50'], 1.0)
+        self.assertEqual(api['listings/:id']['p95'], 1.9)
+        self.assertEqual(api['listings/:id']['max'], 2.0)
+        self.assertEqual(api['listings']['errors'], 2)
+
+
+class LookupTests(SimpleTestCase):
+
+    def tearDown(self):
+        clear_lookup_cache()
+
+    def test_source_id(self):
+        self.assertEqual(_source_id({'id': 8, 'name': 'Website'}), '8')
+        self.assertEqual(_source_id({'name': 'Brighton', 'state': 'VIC', 'postcode': '3186'}), 'Brighton VIC 3186')
+
+    @mock.patch('realestate.agentbox.lookups.AgentBoxLookup.objects.filter')
+    def test_cached(self, filter):
+        filter.return_value = [AgentBoxLookup(lookup='enquiry_sources', source_id='8', name='Website')]
+        self.assertEqual(lookup_name('enquiry_sources', 8), 'Website')
+        self.assertIsNone(lookup_name('enquiry_sources', 9))
+        self.assertEqual(filter.call_count, 1)
+
+
+class StreamedListTests(SimpleTestCase):
+
+    def stream(self, data):
+        http_response = mock.Mock(raw=io.BytesIO(json.dumps(data).encode('utf-8')))
+        return StreamedList(http_response, 'listings')
+
+    def test_items(self):
+        listings = [{'id': '1P1', 'property': {'bedrooms': 3, 'features': ['Pool']}}, {'id': '1P2', 'price': 1.5}]
+        listed = self.stream({'response': {'items': '12', 'current': '1', 'listings': listings, 'last': '6'}})
+        items = listed.items
+        self.assertEqual(next(items), listings[0])
+        self.assertEqual(listed.response, {'items': '12', 'current': '1'})  # Only what's been read so far
+        listed.finish()
+        self.assertEqual(listed.count, 2)
+        self.assertEqual(listed.response, {'items': '12', 'current': '1', 'last': '6'})
+        self.assertTrue(listed._http_response.close.called)
+
+    def test_empty(self):
+        listed = self.stream({'response': {'listings': []}})
+        self.assertEqual(list(listed.items), [])
+        self.assertEqual(listed.count, 0)
@@ -0,0 +1,150 @@
+"""
+Client side rate limiting and retry policy for the AgentBox API.
+
+Every client instance in the process draws from the same token buckets: one for the whole API
+(AGENTBOX_RATE_LIMIT requests per second) and optionally one per endpoint
+(AGENTBOX_ENDPOINT_RATE_LIMITS, keyed on the first path segment, i.e 'listings').
+When AgentBox throttles us the Retry-After is applied to the bucket, so every thread backs off
+together rather than each one discovering the limit on its own.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+from .settings import (RATE_LIMIT, RATE_BURST, ENDPOINT_RATE_LIMITS, MAX_RETRIES, RETRY_BACKOFF,
+                       RETRY_MAX_BACKOFF, RETRY_STATUSES)
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. rate tokens are added per second up to capacity.
+    Callers reserve a token and are told how long to wait for it, so the bucket itself never
+    sleeps and can serve both threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, returning the seconds to wait before it may be used.
+        Tokens can go negative - later callers queue up behind earlier reservations.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        """
+        Hold back every reservation for the given seconds (i.e on a Retry-After)
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_share = 1.0  # Of the rate limits this process may use, see set_share
+
+
+def endpoint_key(endpoint):
+    """
+    Rate limits apply per resource, so 'listings/1P1364' shares the 'listings' bucket
+    """
+    return endpoint.strip('/').split('/')[0]
+
+
+def get_buckets(endpoint):
+    """
+    The process wide buckets that a call to this endpoint must draw from
+    """
+    key = endpoint_key(endpoint)
+    with _buckets_lock:
+        if None not in _buckets:
+            _buckets[None] = TokenBucket(RATE_LIMIT * _share, max(RATE_BURST * _share, 1))
+        if key in ENDPOINT_RATE_LIMITS and key not in _buckets:
+            _buckets[key] = TokenBucket(ENDPOINT_RATE_LIMITS[key] * _share)
+        return [_buckets[None]] + ([_buckets[key]] if key in _buckets else [])
+
+
+def set_share(share):
+    """
+    Limit this process to a share (0-1) of the rate limits, for when several processes import at once
+    (see shards.py). The buckets start again full at the new rates.
+    """
+    global _share
+    with _buckets_lock:
+        _share = float(share)
+        _buckets.clear()
+
+
+def reserve(endpoint):
+    """
+    Reserve a request against the API and endpoint limits, returning the seconds to wait
+    """
+    return max(bucket.reserve() for bucket in get_buckets(endpoint))
+
+
+def acquire(endpoint):
+    """
+    Block the current thread until a request to the endpoint is allowed
+    """
+    wait = reserve(endpoint)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def pause(endpoint, seconds):
+    for bucket in get_buckets(endpoint):
+        bucket.pause(seconds)
+
+
+def parse_retry_after(value):
+    """
+    Retry-After is either delay seconds or an HTTP date. Returns seconds, or None if missing/invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(mktime_tz(parsedate_tz(value)) - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def should_retry(method, attempt, status=None):
+    """
+    Status None means the request failed to connect or timed out.
+    Creates (POST) are only retried on 429, where AgentBox has refused the request outright,
+    so we never risk adding a contact twice.
+    """
+    if attempt >= MAX_RETRIES:
+        return False
+    if method == 'post':
+        return status == 429
+    return status is None or status in RETRY_STATUSES
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before the given retry attempt (0 based). Exponential backoff with full jitter,
+    unless the server told us how long to wait.
+    """
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(RETRY_MAX_BACKOFF, RETRY_BACKOFF * 2 ** attempt))
@@ -1,3 +1,49 @@
-from django.shortcuts import render
+import json
+from django.http import JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from .models import AgentBoxEvent
+from .settings import WEBHOOK_SECRET
+from . import enums
 
-# Create your views here.
+
+@method_decorator(csrf_exempt, name='dispatch')
+class WebhookView(View):
+    """
+    Receives AgentBox change notifications and queues them as AgentBoxEvents, for events.process_events
+    to import. Accepts a JSON event, a list of them, or {"events": [...]}, each of the form:
+        {"type": "listing|staff|office", "id": "1P1364", "event": "created|updated|deleted"}
+    Requests must carry AGENTBOX_WEBHOOK_SECRET in an X-Webhook-Token header.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        token = request.META.get('HTTP_X_WEBHOOK_TOKEN', '')
+        if not WEBHOOK_SECRET or not constant_time_compare(token, WEBHOOK_SECRET):
+            return JsonResponse({'error': 'Forbidden'}, status=403)
+
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        if isinstance(data, dict):
+            data = data.get('events', [data])
+
+        entities = dict(enums.EVENT_ENTITY_CHOICES)
+        events = dict(enums.EVENT_CHOICES)
+        queued = []
+        for item in data if isinstance(data, list) else []:
+            if not isinstance(item, dict):
+                return JsonResponse({'error': 'Invalid event: %s' % item}, status=400)
+            entity, source_id = item.get('type'), item.get('id')
+            event = item.get('event') or enums.EVENT_UPDATED
+            if entity not in entities or event not in events or not source_id:
+                return JsonResponse({'error': 'Invalid event: %s' % item}, status=400)
+            queued.append(AgentBoxEvent(entity=entity, source_id=str(source_id)[:50], event=event))
+
+        if not queued:
+            return JsonResponse({'error': 'No events'}, status=400)
+        AgentBoxEvent.objects.bulk_create(queued)
+        return JsonResponse({'queued': len(queued)}, status=202)
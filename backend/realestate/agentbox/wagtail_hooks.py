@@ -0,0 +1,49 @@
+from django.template.defaultfilters import filesizeformat
+from wagtail.contrib.modeladmin.helpers import PermissionHelper
+from wagtail.contrib.modeladmin.options import ModelAdmin, modeladmin_register
+from .models import AgentBoxImportRun
+
+
+class ReadOnlyPermissionHelper(PermissionHelper):
+    """
+    Import runs are written by the imports only
+    """
+
+    def user_can_create(self, user):
+        return False
+
+    def user_can_edit_obj(self, user, obj):
+        return False
+
+
+class AgentBoxImportRunModelAdmin(ModelAdmin):
+    model = AgentBoxImportRun
+    menu_label = 'AgentBox imports'
+    menu_icon = 'fa-tachometer'
+    list_display = ('name', 'started', 'status', 'seconds', 'created', 'updated', 'skipped', 'failed',
+                    'api_calls', 'queries', 'downloaded')
+    list_filter = ('name', 'status')
+    inspect_view_enabled = True
+    permission_helper_class = ReadOnlyPermissionHelper
+    add_to_settings_menu = True
+
+    def seconds(self, obj):
+        return '%.1f' % obj.duration if obj.duration is not None else ''
+
+    def created(self, obj):
+        return obj.counts.get('created', 0)
+
+    def updated(self, obj):
+        return obj.counts.get('updated', 0)
+
+    def skipped(self, obj):
+        return obj.counts.get('skipped', 0)
+
+    def failed(self, obj):
+        return obj.counts.get('failed', 0)
+
+    def downloaded(self, obj):
+        return filesizeformat(obj.bytes_downloaded)
+
+
+modeladmin_register(AgentBoxImportRunModelAdmin)
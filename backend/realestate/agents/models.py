@@ -26,6 +26,8 @@ class AgentBase(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     source_id = models.CharField(max_length=50, blank=True, default="")
+    source_hash = models.CharField(max_length=64, blank=True, default="", editable=False,
+                                   help_text="Fingerprint of the last imported source data")
     name_short = models.CharField(max_length=50, blank=True, default="",
                                   help_text="Short version of the agent name, a nickname or first name.")
     job_title = models.CharField(max_length=255, blank=True)
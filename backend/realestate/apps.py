@@ -1,5 +1,22 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_delete
 
 
 class RealestateConfig(AppConfig):
     name = 'realestate'
+
+    def ready(self):
+        from wagtail.core.signals import page_published
+        from wagtail.images.models import Image
+        from .agents.models import AgentPage
+        from .listings import cards
+        from .listings.models import PropertyListing, PropertyCategory, ListingAgent, ListingImage
+
+        # Search result cards (listings/cards.py) are refreshed from whatever they show
+        post_save.connect(cards.listing_saved, sender=PropertyListing)
+        for model in (PropertyCategory, ListingAgent, ListingImage):
+            post_save.connect(cards.listing_child_changed, sender=model)
+            post_delete.connect(cards.listing_child_changed, sender=model)
+        page_published.connect(cards.agent_published, sender=AgentPage)
+        post_save.connect(cards.image_changed, sender=Image)
+        pre_delete.connect(cards.image_changed, sender=Image)
@@ -1,22 +1,60 @@
+from collections import OrderedDict
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from .forms import ListingSearchForm
 from .models import PropertyListing
-from .serializers import ListingSerializer
+from .serializers import ListingSerializer, ListingCardSerializer
+from .settings import DEFAULT_PER_PAGE
 
 
 class ListingViewSet(viewsets.ViewSet):
     """
     A simple ViewSet for listing or retrieving listings.
     """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    cards_query_param = 'cards'
+
     def list(self, request):
+        """
+        Every listing found, or with a cursor query parameter (empty for the first) a page of them, with the
+        next and previous pages' URLs, and their total if the count query parameter is given (see pagination.py).
+        With the cards query parameter, the listings' ListingCards are returned instead: what a search result
+        shows of each, read in a single query (see cards.py).
+        """
         queryset = ListingSearchForm(request.data)
-        serializer = ListingSerializer(queryset.as_search(), many=True)
-        return Response(serializer.data)
+        cursor = request.query_params.get(self.cursor_query_param)
+        cards = bool(request.query_params.get(self.cards_query_param))
+        serializer_class = ListingCardSerializer if cards else ListingSerializer
+        if cursor is None:
+            listings = queryset.card_search() if cards else queryset.cached_search()
+            serializer = serializer_class(listings, many=True)
+            return Response(serializer.data)
+
+        page = queryset.cursor_paginator(DEFAULT_PER_PAGE, cards=cards).page(cursor)
+        url = request.build_absolute_uri()
+        data = OrderedDict()
+        if request.query_params.get(self.count_query_param):
+            data['count'] = page.paginator.count
+        data['next'] = replace_query_param(url, self.cursor_query_param, page.next_cursor) if page.has_next() else None
+        data['previous'] = (replace_query_param(url, self.cursor_query_param, page.previous_cursor)
+                            if page.has_previous() else None)
+        data['results'] = serializer_class(page, many=True).data
+        return Response(data)
 
     def retrieve(self, request, pk=None):
         queryset = PropertyListing.objects.all()
         user = get_object_or_404(queryset, pk=pk)
         serializer = ListingSerializer(user)
         return Response(serializer.data)
+
+
+class ListingFacetViewSet(viewsets.ViewSet):
+    """
+    The search facets (counts of the listings found by bedrooms, bathrooms, price band, category, property class
+    and suburb) of a search, taking the same query parameters as the listing search.
+    """
+    def list(self, request):
+        return Response(ListingSearchForm(request.query_params).facets())
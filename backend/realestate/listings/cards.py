@@ -0,0 +1,211 @@
+"""
+The ListingCard read model: what a search result shows of a listing, so a page of results is read with a single
+primary key query rather than rendering each listing from its category, first image, first agent, address and URL
+(a query or reverse each).
+
+A listing's card is refreshed once the transaction saving it, or its categories, images or agents, commits, and
+when its agent page is published or its image changes (see RealestateConfig.ready). Bulk writes skip the signals,
+so the imports add() the listings they write. Within deferred(), as the imports are, refreshes are collected and
+made in bulk when the block ends or flush() is called. A card that doesn't exist yet, i.e for a listing saved
+before cards were, is built the first time it's fetched.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from functools import partial
+from django.db import transaction
+from .models import PropertyListing, ListingCard
+from .search_cache import CachedSearchResults, result_ids
+from .settings import CARD_IMAGE_FILTER
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500  # Cards refreshed at a time
+
+_local = threading.local()
+
+
+def card_for(listing):
+    """
+    The (unsaved) ListingCard of the listing. Its categories, images and agents are best prefetched.
+    """
+    categories = list(listing.categories.all())
+    images = [listing_image.image for listing_image in listing.images.all() if listing_image.image_id]
+    agents = [listing_agent.agent for listing_agent in listing.agents.all()]
+    image = images[0] if images else None
+    agent = agents[0] if agents else None
+    return ListingCard(
+        listing=listing,
+        address=listing.address_display_string(),
+        url=listing.get_absolute_url(),
+        address_suburb=listing.address_suburb,
+        address_postcode=listing.address_postcode,
+        category=categories[0].name if categories else "",
+        image=image,
+        image_url=_image_url(image),
+        agent=agent,
+        agent_name=agent.title if agent else "",
+        agent_url=(agent.url or "") if agent else "",
+        priceView=listing.priceView,
+        bedrooms=listing.bedrooms,
+        bathrooms=listing.bathrooms,
+        parking=listing.parking,
+        location=listing.location,
+    )
+
+
+def _image_url(image):
+    if image is None:
+        return ""
+    try:
+        return image.get_rendition(CARD_IMAGE_FILTER).url
+    except Exception:
+        # i.e the file is missing. The card is still shown, without its image
+        logger.warning('Failed to make the card rendition of image %s', image.pk, exc_info=True)
+        return ""
+
+
+def refresh_cards(listing_ids):
+    """
+    Rebuild the cards of the listings, removing those of listings that no longer exist. Returns the cards.
+    """
+    listing_ids = list(listing_ids)
+    cards = []
+    for start in range(0, len(listing_ids), BATCH_SIZE):
+        cards += _refresh_batch(listing_ids[start:start + BATCH_SIZE])
+    return cards
+
+
+def _refresh_batch(listing_ids):
+    listings = PropertyListing.objects.filter(pk__in=listing_ids).prefetch_related(
+        'categories', 'images__image', 'agents__agent'
+    )
+    # Built before locking, as making a rendition can mean reading the image from storage
+    cards = [card_for(listing) for listing in listings]
+    with transaction.atomic():
+        # Locking the listings orders concurrent refreshes of them, and leaves out any deleted since
+        existing = set(PropertyListing.objects.select_for_update().filter(pk__in=listing_ids)
+                       .values_list('pk', flat=True))
+        cards = [card for card in cards if card.listing_id in existing]
+        ListingCard.objects.filter(pk__in=listing_ids).delete()
+        ListingCard.objects.bulk_create(cards)
+    return cards
+
+
+def get_cards(listing_ids):
+    """
+    The cards of the listings, in order, building any that don't exist yet
+    """
+    cards = ListingCard.objects.in_bulk(listing_ids)
+    missing = [pk for pk in listing_ids if pk not in cards]
+    if missing:
+        cards.update((card.pk, card) for card in refresh_cards(missing))
+    return [cards[pk] for pk in listing_ids if pk in cards]
+
+
+class ListingCardResults(CachedSearchResults):
+    """
+    Search results as ListingCards, see card_results
+    """
+
+    def __init__(self, ids, count=None):
+        super().__init__(ListingCard, ids, count)
+
+    def _fetch(self, ids):
+        return get_cards(ids)
+
+
+def card_results(results):
+    """
+    The cards of search results (a CachedSearchResults, queryset or search backend results), in order, which can
+    be paginated and iterated as the results can
+    """
+    if isinstance(results, CachedSearchResults):
+        return ListingCardResults(results.ids, results.count())
+    return ListingCardResults(result_ids(results))
+
+
+def is_deferred():
+    return getattr(_local, 'depth', 0) > 0
+
+
+@contextmanager
+def deferred():
+    """
+    Collect this thread's card refreshes until the block ends, or flush() is called. Blocks nest, the outermost
+    flushing.
+    """
+    if not is_deferred():
+        _local.pending = set()
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if not _local.depth:
+            flush()
+
+
+def add(listing_ids):
+    """
+    Refresh the cards of the listings: once the current transaction commits, or at the next flush if this thread
+    is deferred
+    """
+    if is_deferred():
+        _local.pending.update(listing_ids)
+    else:
+        _refresh_on_commit(listing_ids)
+
+
+def flush():
+    """
+    Refresh the cards this thread has deferred, once the current transaction commits
+    """
+    pending = getattr(_local, 'pending', None)
+    _local.pending = set()
+    if pending:
+        _refresh_on_commit(pending)
+
+
+def _refresh_on_commit(listing_ids):
+    # After the commit, so the cards are built from what was saved, and a listing being deleted isn't rebuilt
+    listing_ids = sorted(pk for pk in listing_ids if pk is not None)
+    if listing_ids:
+        transaction.on_commit(partial(_refresh, listing_ids))
+
+
+def _refresh(listing_ids):
+    try:
+        refresh_cards(listing_ids)
+    except Exception:
+        # As with the search index, a stale card shouldn't fail the save
+        logger.exception('Failed to refresh the cards of listings %s', listing_ids)
+
+
+def listing_saved(sender, instance, **kwargs):
+    """
+    post_save receiver of PropertyListing
+    """
+    add([instance.pk])
+
+
+def listing_child_changed(sender, instance, **kwargs):
+    """
+    post_save and post_delete receiver of a listing's categories, images and agents
+    """
+    add([instance.listing_id])
+
+
+def agent_published(sender, instance, **kwargs):
+    """
+    page_published receiver of AgentPage, for the name and URL shown on the agent's listings
+    """
+    add(ListingCard.objects.filter(agent_id=instance.pk).values_list('pk', flat=True))
+
+
+def image_changed(sender, instance, **kwargs):
+    """
+    post_save and pre_delete receiver of Image, for the rendition shown on the image's listings
+    """
+    add(ListingCard.objects.filter(image_id=instance.pk).values_list('pk', flat=True))
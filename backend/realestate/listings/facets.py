@@ -0,0 +1,180 @@
+"""
+Search facets: how many of a search's listings have at least each number of bedrooms and bathrooms, and are in
+each price band, category, property class and suburb, for showing beside the search filters.
+
+Every facet is counted in a single query: conditional counts, grouped by suburb and summed for the other facets.
+Searches with a query are counted by Elasticsearch instead, with a single request of aggregations. Facets are
+cached with the searches (see search_cache.py), so they're invalidated when a listing changes.
+
+Bedroom and bathroom counts are of listings with at least that many, as the form's bedrooms__gte and
+bathrooms__gte filter. Price bands include their min and max, as price__gte and price__lte do. Categories,
+property classes and suburbs no listing has are left out.
+"""
+
+from collections import Counter, OrderedDict
+from django.core.cache import caches
+from django.db.models import Count, Q, QuerySet
+from .models import PropertyListing, PropertyCategory
+from .search_cache import result_ids, search_key
+from .settings import SEARCH_CACHE, SEARCH_CACHE_TIMEOUT, FACET_ROOMS, FACET_PRICE_BANDS, FACET_SUBURBS
+from . import enums
+
+try:
+    from wagtail.search.backends.elasticsearch2 import Elasticsearch2SearchResults
+except ImportError:
+    # The elasticsearch package isn't installed
+    Elasticsearch2SearchResults = None
+
+ROOM_FIELDS = ['bedrooms', 'bathrooms']
+
+
+def _choice_values(choices):
+    values = []
+    for value, label in choices:
+        if isinstance(label, (list, tuple)):
+            values += [grouped for grouped in _choice_values(label) if grouped not in values]
+        else:
+            values.append(value)
+    return values
+
+
+CATEGORIES = _choice_values(enums.CATEGORY_CHOICES)
+PROPERTY_CLASSES = _choice_values(enums.PROPERTY_CLASS_CHOICES)
+
+
+def price_bands():
+    """
+    The (min, max) of each price band, both inclusive. The last band's max is None.
+    """
+    bounds = sorted(FACET_PRICE_BANDS)
+    return [(low, high - 1 if high is not None else None) for low, high in zip(bounds, bounds[1:] + [None])]
+
+
+def facet_counts(results):
+    """
+    The facets of as_search's results (a queryset, or search backend results)
+    """
+    if Elasticsearch2SearchResults and isinstance(results, Elasticsearch2SearchResults):
+        return elasticsearch_facets(results)
+    if isinstance(results, QuerySet):
+        # A listing once, however many of the search's joins it matches
+        return database_facets(PropertyListing.objects.filter(pk__in=results.order_by().values('pk')))
+    return database_facets(PropertyListing.objects.filter(pk__in=result_ids(results)))
+
+
+def cached_facets(params, search):
+    """
+    The facets of the search described by params, calling search() (as_search) if they aren't cached. As per
+    search_cache.cached_search.
+    """
+    cache = caches[SEARCH_CACHE]
+    key = search_key({'facets': params})
+    facets = cache.get(key)
+    if facets is None:
+        facets = facet_counts(search())
+        cache.set(key, facets, SEARCH_CACHE_TIMEOUT)
+    return facets
+
+
+def database_facets(listings):
+    """
+    The facets of the listings (a queryset of PropertyListings, each once), with a single query
+    """
+    aggregates = {'total': Count('pk')}
+    for field in ROOM_FIELDS:
+        for rooms in FACET_ROOMS:
+            aggregates['%s_%s' % (field, rooms)] = Count('pk', filter=Q(**{field + '__gte': rooms}))
+    for index, (low, high) in enumerate(price_bands()):
+        band = Q(price__gte=low) if high is None else Q(price__gte=low, price__lte=high)
+        aggregates['price_%s' % index] = Count('pk', filter=band)
+    for index, category in enumerate(CATEGORIES):
+        # A subquery rather than a join, so listings without categories are counted, and those with several once
+        listing_ids = PropertyCategory.objects.filter(name=category).values('listing_id')
+        aggregates['category_%s' % index] = Count('pk', filter=Q(pk__in=listing_ids))
+    for index, property_class in enumerate(PROPERTY_CLASSES):
+        aggregates['property_class_%s' % index] = Count('pk', filter=Q(property_class=property_class))
+
+    counts = Counter()
+    suburbs = Counter()
+    for row in listings.order_by().values('address_suburb').annotate(**aggregates):
+        suburb = row.pop('address_suburb')
+        if suburb:
+            suburbs[suburb] += row['total']
+        counts.update(row)
+
+    return _facets(
+        total=counts['total'],
+        rooms={field: {rooms: counts['%s_%s' % (field, rooms)] for rooms in FACET_ROOMS} for field in ROOM_FIELDS},
+        prices=[counts['price_%s' % index] for index in range(len(price_bands()))],
+        categories={category: counts['category_%s' % index] for index, category in enumerate(CATEGORIES)},
+        property_classes={property_class: counts['property_class_%s' % index]
+                          for index, property_class in enumerate(PROPERTY_CLASSES)},
+        suburbs=sorted(suburbs.items(), key=lambda item: (-item[1], item[0]))[:FACET_SUBURBS],
+    )
+
+
+def elasticsearch_facets(results):
+    """
+    The facets of Elasticsearch results, with a single request of aggregations. As Wagtail's facet() does for one
+    field, which needs each to be a FilterField of PropertyListing.
+    """
+    compiler = results.query_compiler
+
+    def column(field_name):
+        return compiler.mapping.get_field_column_name(compiler._get_filterable_field(field_name))
+
+    aggregations = {}
+    for field in ROOM_FIELDS:
+        aggregations[field] = {'range': {
+            'field': column(field),
+            'ranges': [{'key': str(rooms), 'from': rooms} for rooms in FACET_ROOMS],
+        }}
+    price_ranges = []
+    for index, (low, high) in enumerate(price_bands()):
+        price_range = {'key': str(index), 'from': low}
+        if high is not None:
+            price_range['to'] = high + 1  # Exclusive
+        price_ranges.append(price_range)
+    aggregations['price'] = {'range': {'field': column('price'), 'ranges': price_ranges}}
+    aggregations['categories'] = {'terms': {'field': column('category_names'), 'size': len(CATEGORIES)}}
+    aggregations['property_class'] = {'terms': {'field': column('property_class'), 'size': len(PROPERTY_CLASSES)}}
+    aggregations['suburbs'] = {'terms': {'field': column('address_suburb'), 'size': FACET_SUBURBS}}
+
+    body = results._get_es_body(for_count=True)
+    body['aggregations'] = aggregations
+    response = results.backend.es.search(
+        index=results.backend.get_index_for_model(compiler.queryset.model).name,
+        body=body,
+        size=0,
+    )
+
+    buckets = {name: aggregation['buckets'] for name, aggregation in response['aggregations'].items()}
+    ranges = {name: {bucket['key']: bucket['doc_count'] for bucket in buckets[name]}
+              for name in ROOM_FIELDS + ['price']}
+    return _facets(
+        total=response['hits']['total'],
+        rooms={field: {rooms: ranges[field].get(str(rooms), 0) for rooms in FACET_ROOMS} for field in ROOM_FIELDS},
+        prices=[ranges['price'].get(str(index), 0) for index in range(len(price_bands()))],
+        categories={bucket['key']: bucket['doc_count'] for bucket in buckets['categories']},
+        property_classes={bucket['key']: bucket['doc_count'] for bucket in buckets['property_class']},
+        suburbs=[(bucket['key'], bucket['doc_count']) for bucket in buckets['suburbs']],
+    )
+
+
+def _facets(total, rooms, prices, categories, property_classes, suburbs):
+    """
+    The facets as JSON serialisable data, in the order of the choices
+    """
+    facets = OrderedDict([('count', total)])
+    for field in ROOM_FIELDS:
+        facets[field] = [OrderedDict([('value', value), ('count', rooms[field][value])]) for value in FACET_ROOMS]
+    facets['price'] = [
+        OrderedDict([('min', low), ('max', high), ('count', count)])
+        for (low, high), count in zip(price_bands(), prices)
+    ]
+    facets['categories'] = [OrderedDict([('value', category), ('count', categories[category])])
+                            for category in CATEGORIES if categories.get(category)]
+    facets['property_class'] = [OrderedDict([('value', property_class), ('count', property_classes[property_class])])
+                                for property_class in PROPERTY_CLASSES if property_classes.get(property_class)]
+    facets['suburbs'] = [OrderedDict([('value', suburb), ('count', count)]) for suburb, count in suburbs if count]
+    return facets
@@ -3,7 +3,13 @@ from django import forms
 from django.db.models import Q, Case, Value, When, IntegerField
 from wagtail.search.backends import get_search_backend
 from django.contrib.gis.geos import Polygon
+from django.db import models
+from .cards import card_results, get_cards
+from .facets import cached_facets, facet_counts
 from .models import PropertyListing, Inspection
+from .pagination import CursorPaginator
+from .search_cache import cached_search
+from .settings import SEARCH_CACHE_TIMEOUT, SURROUNDING_HOPS
 from . import enums
 
 try:
@@ -12,9 +18,9 @@ except ImportError:
     AgentPage = None
 
 try:
-    from suburbs_database.models import SuburbData
+    from suburbs_database.graph import get_suburb_graph
 except ImportError:
-    SuburbData = None
+    get_suburb_graph = None
 
 
 class ListingSearchForm(forms.Form):
@@ -58,49 +64,32 @@ class ListingSearchForm(forms.Form):
 
         data = self.cleaned_data
 
-        if data.get('address_suburb'):
-            suburbs = data.get('address_suburb').split(',')
-            try:
+        if data.get('address_suburb') and get_suburb_graph:
+            # As they're stored on PropertyListing, for the filter and the ordering alike
+            suburbs = [suburb.strip().upper() for suburb in data.get('address_suburb').split(',') if suburb.strip()]
 
-                suburbs_q = Q()
-                for suburb in suburbs:
-                    suburbs_q = suburbs_q | Q(name__iexact=suburb)
+            if data.get('surrounding'):
+                # Expanded with the in-memory graph of the suburbs, rather than querying SuburbData
+                surrounding_suburbs = get_suburb_graph().surrounding(
+                    suburbs, state=data.get('address_state'), hops=SURROUNDING_HOPS)
+            else:
+                surrounding_suburbs = []
 
-                s = SuburbData.objects.filter(suburbs_q)
-
-                if data.get('address_state'):
-                    s = s.filter(state_code=data['address_state'])
-
-                if data.get('surrounding'):
-                    surrounding_suburb_ids = [
-                        item for sublist in s.values_list('bordering_locations', flat=True) for item in sublist
-                    ]
-                    surrounding_suburbs = SuburbData.objects.filter(
-                        pk__in=surrounding_suburb_ids
-                    )
-                else:
-                    surrounding_suburbs = SuburbData.objects.none()
-
-                qs = qs.filter(
-                    Q(address_suburb__in=suburbs) |
-                    Q(address_suburb__in=[i.upper() for i in surrounding_suburbs.values_list('name', flat=True)])
-                )
-                # The listings are created with suburb in title case.
-
-                qs = qs.annotate(
-                    suburb_first=Case(
-                        When(address_suburb__in=suburbs, then=Value(0)),
-                        default=Value(1),
-                        output_field=IntegerField()
-                    )
+            qs = qs.filter(
+                Q(address_suburb__in=suburbs) |
+                Q(address_suburb__in=sorted(i.upper() for i in surrounding_suburbs))
+            )
+            qs = qs.annotate(
+                suburb_first=Case(
+                    When(address_suburb__in=suburbs, then=Value(0)),
+                    default=Value(1),
+                    output_field=IntegerField()
                 )
-                if data.get('order_by'):
-                    order_by = ['suburb_first'] + data.get('order_by', '').split(',') or order_by
-
-                del(data['address_suburb'])
+            )
+            if data.get('order_by'):
+                order_by = ['suburb_first'] + data.get('order_by', '').split(',') or order_by
 
-            except AttributeError:
-                pass
+            del(data['address_suburb'])
 
         if data.get('agent'):
             qs = qs.filter(agents__agent=data.pop('agent'))
@@ -129,6 +118,62 @@ class ListingSearchForm(forms.Form):
             order_by = data['order_by'].split(',')
         return qs.order_by(*order_by)
 
+    def cached_search(self, override_params=None):
+        """
+        The results of as_search, cached until a listing changes (see search_cache.py). Returns a
+        CachedSearchResults, which can be paginated and iterated as the queryset can, or as_search's queryset
+        if the form is invalid or the cache is turned off.
+        """
+        # as_search pops from override_params, so it's passed a copy. Left out, the form's default is used.
+        args = () if override_params is None else (dict(override_params),)
+        if not SEARCH_CACHE_TIMEOUT or not self.is_valid():
+            return self.as_search(*args)
+        return cached_search(PropertyListing, self.search_params(override_params), lambda: self.as_search(*args))
+
+    def card_search(self, override_params=None):
+        """
+        The ListingCards of the cached_search results, for showing them: a page of cards is one query (see cards.py)
+        """
+        return card_results(self.cached_search(override_params))
+
+    def cursor_paginator(self, per_page, override_params=None, cards=False):
+        """
+        A CursorPaginator of the as_search results, which pages by keyset rather than offset and only counts the
+        results if asked (see pagination.py). With cards, a page is of their ListingCards rather than the listings.
+        """
+        args = () if override_params is None else (dict(override_params),)
+        return CursorPaginator(self.as_search(*args), per_page, fetch=get_cards if cards else None)
+
+    def facets(self, override_params=None):
+        """
+        The facets of the as_search results, cached with the searches (see facets.py)
+        """
+        args = () if override_params is None else (dict(override_params),)
+        if not SEARCH_CACHE_TIMEOUT or not self.is_valid():
+            return facet_counts(self.as_search(*args))
+        return cached_facets(self.search_params(override_params), lambda: self.as_search(*args))
+
+    def search_params(self, override_params=None):
+        """
+        The search as JSON serialisable data, the same for the same search: as_search ignores empty values, so
+        they're left out, and the order of multiple choices doesn't matter
+        """
+        data = {}
+        for name, value in self.cleaned_data.items():
+            if isinstance(value, models.Model):
+                value = value.pk
+            elif isinstance(value, (list, tuple)):
+                value = sorted(str(item) for item in value)
+            if value:
+                data[name] = value
+        return {
+            'form': type(self).__name__,
+            'data': data,
+            'override_params': override_params,
+            # Searches default to dates relative to today (i.e upcoming auctions)
+            'today': datetime.date.today(),
+        }
+
 
 class ListingInspectionSearchForm(forms.Form):
     property_class = forms.ChoiceField(choices=enums.PROPERTY_CLASS_CHOICES, required=False)
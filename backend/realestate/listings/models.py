@@ -6,6 +6,7 @@ import re
 import arrow
 import datetime
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.gis.db import models as gismodels
@@ -23,6 +24,8 @@ from wagtail.admin.edit_handlers import (RichTextField, FieldRowPanel, FieldPane
 from wagtail.search import index
 from django.core.paginator import Paginator
 from seo_page.models import SEOFields
+from .search_cache import invalidate_searches
+from .pagination import page_context
 from .settings import DEFAULT_PER_PAGE
 from wagtail.snippets.models import register_snippet
 from .edit_handlers import ListingChooserPanel
@@ -90,6 +93,8 @@ class PropertyListing(GisClusterableModel, index.Indexed):
     # Base fields
     agentID = models.CharField("Agent ID", max_length=10, help_text="The Office's Source ID")
     uniqueID = models.CharField("Unique ID", max_length=255, help_text="Unique ID of the listing")
+    source_hash = models.CharField(max_length=64, blank=True, default="", editable=False,
+                                   help_text="Fingerprint of the last imported source data")
     status = models.CharField(max_length=25, db_index=True, choices=enums.STATUS_CHOICES, default=enums.DEFAULT_STATUS)
 
     property_class = models.CharField(choices=enums.PROPERTY_CLASS_CHOICES, default=enums.DEFAULT_PROPERTY_CLASS,
@@ -416,7 +421,9 @@ class PropertyListing(GisClusterableModel, index.Indexed):
         index.FilterField('bathrooms'),
         index.FilterField('parking'),
         index.FilterField('status'),
-
+        # For the search facets, see facets.py
+        index.FilterField('address_suburb'),
+        index.FilterField('category_names'),
     ]
 
     class Meta:
@@ -429,6 +436,10 @@ class PropertyListing(GisClusterableModel, index.Indexed):
         except Exception:
             return ""
 
+    @property
+    def category_names(self):
+        return [category.name for category in self.categories.all()]
+
     def address_display_string(self, override_hide=False):
         address = ""
         if self.address_display is False and not override_hide:
@@ -516,6 +527,11 @@ class PropertyListing(GisClusterableModel, index.Indexed):
         super().save(*args, **kwargs)
 
 
+# Cached searches include any listing, so a change to one invalidates them all
+post_save.connect(invalidate_searches, sender=PropertyListing)
+post_delete.connect(invalidate_searches, sender=PropertyListing)
+
+
 class PropertyCategory(Orderable):
     listing = ParentalKey('PropertyListing', related_name='categories', on_delete=models.CASCADE)
     name = models.CharField(max_length=100, choices=enums.CATEGORY_CHOICES, db_index=True)
@@ -680,6 +696,48 @@ class ListingFloorplan(ListingMediaBase):
     media_field = 'floorplan'
 
 
+class ListingCard(models.Model):
+    """
+    What a search result shows of a listing, denormalised from it and its category, image and agent so a page of
+    results is read with one primary key query. Kept up to date by cards.py.
+    """
+    listing = models.OneToOneField('PropertyListing', primary_key=True, related_name='card', on_delete=models.CASCADE)
+    address = models.TextField(blank=True, default="")  # As per address_display_string()
+    url = models.CharField(max_length=500, blank=True, default="")
+    address_suburb = models.CharField(max_length=100, blank=True, default="")
+    address_postcode = models.CharField(max_length=100, blank=True, default="")
+    category = models.CharField(max_length=100, blank=True, default="")
+    image = models.ForeignKey(
+        'wagtailimages.Image',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    image_url = models.CharField(max_length=500, blank=True, default="")  # Of the LISTINGS_CARD_IMAGE_FILTER rendition
+    agent = models.ForeignKey(
+        'agents.AgentPage',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    agent_name = models.CharField(max_length=255, blank=True, default="")
+    agent_url = models.CharField(max_length=500, blank=True, default="")
+    priceView = models.CharField(max_length=255, blank=True, default="")
+    bedrooms = models.IntegerField(default=0)
+    bathrooms = models.IntegerField(default=0)
+    parking = models.IntegerField(default=0)
+    location = gismodels.PointField(srid=4326, null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.address
+
+    def get_absolute_url(self):
+        return self.url
+
+
 # Wagtail Page models
 class SearchPageFeaturedListing(Orderable):
     page = ParentalKey('realestate.ListingSearchPage', related_name='featured_listings')
@@ -697,6 +755,8 @@ class ListingSearchPage(SEOFields, Page):
     per_page = DEFAULT_PER_PAGE
     per_page_kwarg = 'per_page'
     page_kwarg = 'page'
+    cursor_kwarg = 'cursor'
+    count_kwarg = 'count'
 
     subpage_types = None
 
@@ -728,13 +788,21 @@ class ListingSearchPage(SEOFields, Page):
         return super().serve(request)
 
     def get_listings(self, request):
-        return self.get_form(request).as_search(override_params=self.search_params)
+        return self.get_form(request).cached_search(override_params=self.search_params)
 
     def get_context(self, request, *args, **kwargs):
         context = super(ListingSearchPage, self).get_context(request, *args, **kwargs)
         context['form'] = self.get_form(request)
-        listing_paginator = Paginator(self.get_listings(request), self.get_per_page())
-        context['listings'] = listing_paginator.page(self.get_page_number())
+        # With a cursor (even an empty one, for the first page) the listings are paged by keyset, see pagination.py
+        cursor = request.GET.get(self.cursor_kwarg)
+        if cursor is None:
+            listing_paginator = Paginator(self.get_listings(request), self.get_per_page())
+            context['listings'] = listing_paginator.page(self.get_page_number())
+        else:
+            listing_paginator = context['form'].cursor_paginator(self.get_per_page(),
+                                                                 override_params=self.search_params)
+            context['listings'] = listing_paginator.page(cursor)
+        context.update(page_context(request, context['listings'], self.cursor_kwarg, self.count_kwarg))
         try:
             from realestate.agents.models import AgentPage
             context['agent'] = AgentPage.objects.live().get(pk=context['form'].data.get('agent'))
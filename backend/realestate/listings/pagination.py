@@ -0,0 +1,246 @@
+"""
+Keyset (cursor) pagination of listing searches, so a deep page costs what the first does.
+
+Django's Paginator counts the whole search and skips to a page with OFFSET, which reads every row before it.
+CursorPaginator instead pages by where the last page ended: a page after a row is the rows ordered after that
+row's values of the search's order_by, which always ends in the primary key so each row's position is unique.
+That is a WHERE on the indexed order columns and a LIMIT of a page (and one to tell if there's another).
+
+Pages are found by opaque, signed next and previous cursors rather than numbers. The total is only counted if
+asked for (CursorPaginator.count), and is cached with the searches (see search_cache.py). The HTML views link the
+pages, and show the total only if the count parameter is given, by page_context. Results that can't be
+keyed, i.e search backend results or a queryset ordered by an expression, are paged by offset with the same
+cursors.
+"""
+
+import datetime
+import decimal
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from .search_cache import search_key
+from .settings import SEARCH_CACHE, SEARCH_CACHE_TIMEOUT
+
+SALT = 'realestate.listings.pagination'
+
+
+def ordering(queryset):
+    """
+    The queryset's order as (name, descending), ending in the primary key, or None if it's ordered by something a
+    cursor can't follow (an expression, or randomly)
+    """
+    order = []
+    for term in queryset.query.order_by or queryset.model._meta.ordering:
+        if not isinstance(term, str) or term == '?':
+            return None
+        name = term.lstrip('-')
+        if name == queryset.model._meta.pk.name:
+            name = 'pk'
+        order.append((name, term.startswith('-')))
+        if name == 'pk':
+            break  # Already unique, anything after is never compared
+    if not order or order[-1][0] != 'pk':
+        order.append(('pk', False))
+    return order
+
+
+def _nullable(model, name):
+    if name == 'pk':
+        return False
+    try:
+        return model._meta.get_field(name).null
+    except FieldDoesNotExist:
+        return True  # An annotation or a lookup across a relation
+
+
+def keyset_filter(model, order, values):
+    """
+    The Q of the rows ordered after the row with values (of the names in order), or None if there can't be any.
+    As Postgres orders them, nulls are after every value ascending and before every value descending.
+    """
+    condition = None
+    equal = Q()
+    for (name, descending), value in zip(order, values):
+        if value is None:
+            after = Q(**{name + '__isnull': False}) if descending else None
+        else:
+            after = Q(**{name + ('__lt' if descending else '__gt'): value})
+            if not descending and _nullable(model, name):
+                after |= Q(**{name + '__isnull': True})
+        if after is not None:
+            condition = equal & after if condition is None else condition | (equal & after)
+        equal &= Q(**{name + '__isnull': True}) if value is None else Q(**{name: value})
+    return condition
+
+
+def _json(value):
+    # Full precision, as the values are compared for equality
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+class CursorPage:
+    """
+    A page of a CursorPaginator, standing in for a Paginator's Page
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of %s>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Pages through results by cursor. results is an ordered queryset, or search backend results (or anything else
+    that can be sliced and counted). fetch, if given, is called with the ids of a page's results for the objects
+    shown of them, in order (i.e cards.get_cards).
+    """
+
+    def __init__(self, results, per_page, fetch=None):
+        self.results = results
+        self.per_page = int(per_page)
+        self.fetch = fetch
+        self.order = ordering(results) if isinstance(results, QuerySet) else None
+
+    def page(self, cursor=None):
+        """
+        The page at cursor, the next_cursor or previous_cursor of another page. Without one, or with one that isn't
+        valid (i.e tampered with, or from a search ordered differently), the first page.
+        """
+        position = self.decode(cursor)
+        if self.order is None:
+            offset = position.get('o') if position else None
+            return self._offset_page(offset if isinstance(offset, int) and offset > 0 else 0)
+        values = position.get('k') if position else None
+        if not isinstance(values, list) or len(values) != len(self.order):
+            return self._keyset_page(None)
+        return self._keyset_page(values, backwards=bool(position.get('b')))
+
+    @cached_property
+    def count(self):
+        """
+        The number of results, cached with the searches
+        """
+        if not isinstance(self.results, QuerySet):
+            return self.results.count()
+        try:
+            sql, params = self.results.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        cache = caches[SEARCH_CACHE]
+        key = search_key({'count': sql, 'params': params})
+        count = cache.get(key)
+        if count is None:
+            count = self.results.count()
+            if SEARCH_CACHE_TIMEOUT:
+                cache.set(key, count, SEARCH_CACHE_TIMEOUT)
+        return count
+
+    def encode(self, position):
+        return signing.dumps(position, salt=SALT, compress=True)
+
+    def decode(self, cursor):
+        if not cursor:
+            return None
+        try:
+            position = signing.loads(cursor, salt=SALT)
+        except signing.BadSignature:
+            return None
+        return position if isinstance(position, dict) else None
+
+    def _keyset_page(self, values, backwards=False):
+        """
+        The page after the row with values, or before it if backwards. Rows are read in reverse order going
+        backwards, so either way it's the first rows of an index scan.
+        """
+        order = [(name, descending != backwards) for name, descending in self.order]
+        queryset = self.results
+        if values is not None:
+            condition = keyset_filter(queryset.model, order, values)
+            queryset = queryset.filter(condition) if condition is not None else queryset.none()
+        queryset = queryset.order_by(*[('-' if descending else '') + name for name, descending in order])
+        rows = list(queryset.values_list(*[name for name, _ in order])[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        # Having come from a page, there's one back the way we came
+        has_next = values is not None if backwards else more
+        has_previous = more if backwards else values is not None
+        object_list = self._fetch([row[-1] for row in rows])
+        return CursorPage(
+            object_list, self,
+            next_cursor=self.encode({'k': [_json(value) for value in rows[-1]]}) if has_next and rows else None,
+            previous_cursor=(self.encode({'k': [_json(value) for value in rows[0]], 'b': True})
+                             if has_previous and rows else None),
+        )
+
+    def _offset_page(self, offset):
+        rows = list(self.results[offset:offset + self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        object_list = self._fetch([obj.pk for obj in rows]) if self.fetch else rows
+        return CursorPage(
+            object_list, self,
+            next_cursor=self.encode({'o': offset + self.per_page}) if more else None,
+            previous_cursor=self.encode({'o': max(offset - self.per_page, 0)}) if offset else None,
+        )
+
+    def _fetch(self, ids):
+        if self.fetch:
+            return self.fetch(ids)
+        objs = self.results.model._default_manager.in_bulk(ids)
+        return [objs[pk] for pk in ids if pk in objs]
+
+
+def page_context(request, page, cursor_kwarg='cursor', count_kwarg='count'):
+    """
+    Template context for a page of search results. For a CursorPage: its next_cursor and previous_cursor, the
+    next_url and previous_url of the pages with the request's other parameters, and show_count only if the
+    count_kwarg parameter is given, as the total isn't otherwise needed. A Paginator's page has its count anyway.
+    """
+    if not isinstance(page, CursorPage):
+        return {'cursor_pagination': False, 'show_count': True}
+
+    def url(cursor):
+        params = request.GET.copy()
+        params[cursor_kwarg] = cursor
+        return '?' + params.urlencode()
+
+    return {
+        'cursor_pagination': True,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+        'next_url': url(page.next_cursor) if page.has_next() else None,
+        'previous_url': url(page.previous_cursor) if page.has_previous() else None,
+        'show_count': bool(request.GET.get(count_kwarg)),
+    }
@@ -0,0 +1,115 @@
+"""
+A cache of listing search results, so the popular searches don't run their filters, joins and ordering (or
+Elasticsearch query) on every request.
+
+ListingSearchForm.cached_search() keys a search on its cleaned data, normalised so the same search has the same
+key however its parameters were given, and caches the ordered ids of the listings found and their count in the
+LISTINGS_SEARCH_CACHE cache (Redis in production). CachedSearchResults then stands in for the results, fetching
+only the listings shown: a primary key lookup per page.
+
+Cached searches are invalidated together by a generation counter that is part of every key. It's bumped whenever
+a listing is saved or deleted, and by the imports after their bulk writes (see invalidate_searches), so searches
+are never stale. Entries of old generations aren't read again, and expire after LISTINGS_SEARCH_CACHE_TIMEOUT.
+As the counter is in the cache, processes only share it with a shared cache: with the default local memory
+cache, changes made by another process (i.e an import) show after the timeout.
+"""
+
+import hashlib
+import json
+import time
+from django.core.cache import caches
+from .settings import SEARCH_CACHE, SEARCH_CACHE_TIMEOUT
+
+GENERATION_KEY = 'listings:search:generation'
+
+
+def get_generation():
+    cache = caches[SEARCH_CACHE]
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Never set, or evicted. Started from the time so a generation already used isn't used again
+        cache.add(GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_searches(**kwargs):
+    """
+    Invalidate every cached search by bumping the generation. Takes (and ignores) the signal's arguments,
+    as the post_save and post_delete receiver of PropertyListing.
+    """
+    cache = caches[SEARCH_CACHE]
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Not set, so there's nothing cached to invalidate
+        get_generation()
+
+
+def search_key(params):
+    """
+    The cache key of a search, for the current generation. params is the search as JSON serialisable data,
+    equal for the same search.
+    """
+    payload = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    return 'listings:search:%s:%s' % (get_generation(), hashlib.sha1(payload.encode('utf-8')).hexdigest())
+
+
+def cached_search(model, params, search):
+    """
+    The CachedSearchResults of the search described by params, calling search() (which returns the model
+    instances found, in order, as a queryset or search backend results) if it isn't cached
+    """
+    cache = caches[SEARCH_CACHE]
+    key = search_key(params)
+    cached = cache.get(key)
+    if cached is None:
+        ids = result_ids(search())
+        cached = {'ids': ids, 'count': len(ids)}
+        cache.set(key, cached, SEARCH_CACHE_TIMEOUT)
+    return CachedSearchResults(model, cached['ids'], cached['count'])
+
+
+def result_ids(results):
+    """
+    The ids of the instances found by a search, in order, from its queryset or search backend results
+    """
+    if hasattr(results, 'values_list'):
+        return list(results.values_list('pk', flat=True))
+    return [obj.pk for obj in results]
+
+
+class CachedSearchResults:
+    """
+    The results of a cached search, standing in for its queryset: their count, and the instances in order when
+    sliced (i.e by a Paginator) or iterated, fetched by primary key. Instances deleted since the search was
+    cached are left out.
+    """
+    chunk_size = 100  # Instances fetched at a time when iterating
+
+    def __init__(self, model, ids, count=None):
+        self.model = model
+        self.ids = ids
+        self._count = len(ids) if count is None else count
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._fetch(self.ids[index])
+        objs = self._fetch([self.ids[index]])
+        if not objs:
+            raise IndexError('%s %s no longer exists' % (self.model.__name__, self.ids[index]))
+        return objs[0]
+
+    def __iter__(self):
+        for start in range(0, len(self.ids), self.chunk_size):
+            yield from self._fetch(self.ids[start:start + self.chunk_size])
+
+    def _fetch(self, ids):
+        objs = self.model._default_manager.in_bulk(ids)
+        return [objs[pk] for pk in ids if pk in objs]
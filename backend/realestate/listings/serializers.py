@@ -1,8 +1,14 @@
 from rest_framework import serializers
-from .models import PropertyListing
+from .models import PropertyListing, ListingCard
 
 
 class ListingSerializer(serializers.ModelSerializer):
     class Meta:
         model = PropertyListing
         fields = '__all__'
+
+
+class ListingCardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ListingCard
+        fields = '__all__'
@@ -2,6 +2,25 @@ from django.conf import settings
 
 DEFAULT_PER_PAGE = getattr(settings, "LISTINGS_DEFAULT_PER_PAGE", 12)
 
+# Borders crossed when a search includes the surrounding suburbs: 1 for the bordering suburbs, 2 for those
+# bordering them too...
+SURROUNDING_HOPS = getattr(settings, "LISTINGS_SURROUNDING_HOPS", 1)
+
+# Cache (alias) that listing search results are kept in, and for how many seconds (see search_cache.py).
+# A timeout of 0 turns the search cache off
+SEARCH_CACHE = getattr(settings, "LISTINGS_SEARCH_CACHE", "default")
+SEARCH_CACHE_TIMEOUT = getattr(settings, "LISTINGS_SEARCH_CACHE_TIMEOUT", 10 * 60)
+
+# Rendition of the first image shown on a listing's search result card (see cards.py)
+CARD_IMAGE_FILTER = getattr(settings, "LISTINGS_CARD_IMAGE_FILTER", "fill-600x400")
+
+# Search facets (see facets.py): the bedroom and bathroom counts listings are counted as having at least, the
+# lower bounds of the price bands (the last is open ended), and how many of the suburbs with the most listings
+FACET_ROOMS = getattr(settings, "LISTINGS_FACET_ROOMS", [1, 2, 3, 4, 5])
+FACET_PRICE_BANDS = getattr(settings, "LISTINGS_FACET_PRICE_BANDS",
+                            [0, 250000, 500000, 750000, 1000000, 1500000, 2000000])
+FACET_SUBURBS = getattr(settings, "LISTINGS_FACET_SUBURBS", 20)
+
 try:
     DEFAULT_LISTING_SEARCH_SLUGS = settings.DEFAULT_LISTING_SEARCH_SLUGS
 except AttributeError:
@@ -1,3 +1,169 @@
-from django.test import TestCase
+from unittest import mock
+from django.db.models import Q
+from django.test import RequestFactory, SimpleTestCase
+from wagtail.images.models import Image
 
-# Create your tests here.
+from realestate.agents.models import AgentPage
+from .cards import card_for
+from .forms import ListingSearchForm
+from .models import PropertyListing, PropertyCategory, ListingAgent, ListingImage
+from .pagination import CursorPaginator, keyset_filter, ordering, page_context
+from .search_cache import CachedSearchResults
+from . import cards, enums, facets
+
+
+class SearchParamsTests(SimpleTestCase):
+
+    def test_same_search(self):
+        first = ListingSearchForm({'categories': [enums.CATEGORY_UNIT, enums.CATEGORY_HOUSE], 'bedrooms__gte': '2',
+                                   'price__lte': ''})
+        second = ListingSearchForm({'bedrooms__gte': 2, 'categories': [enums.CATEGORY_HOUSE, enums.CATEGORY_UNIT]})
+        self.assertTrue(first.is_valid() and second.is_valid())
+        self.assertEqual(first.search_params(), second.search_params())
+
+        third = ListingSearchForm({'bedrooms__gte': 3})
+        self.assertTrue(third.is_valid())
+        self.assertNotEqual(first.search_params(), third.search_params())
+
+    @mock.patch('realestate.listings.forms.get_suburb_graph')
+    def test_suburbs_normalised(self, get_suburb_graph):
+        get_suburb_graph.return_value.surrounding.return_value = {'Elwood'}
+        form = ListingSearchForm({'address_suburb': ' brighton,Hampton , ', 'surrounding': True})
+        queryset = form.as_search()
+
+        suburbs = ['BRIGHTON', 'HAMPTON']
+        self.assertEqual(get_suburb_graph.return_value.surrounding.call_args[0][0], suburbs)
+        # The suburbs ordered first
+        lookup = queryset.query.annotations['suburb_first'].cases[0].condition.children[0]
+        self.assertEqual((lookup.lhs.target.name, lookup.rhs), ('address_suburb', suburbs))
+
+
+class CachedSearchResultsTests(SimpleTestCase):
+
+    def test_fetches_in_order(self):
+        model = mock.Mock()
+        # 3 has since been deleted
+        model._default_manager.in_bulk.side_effect = lambda ids: {pk: 'listing %s' % pk for pk in ids if pk != 3}
+        results = CachedSearchResults(model, [5, 3, 1, 4])
+
+        self.assertEqual(results.count(), 4)
+        self.assertEqual(results[0:2], ['listing 5'])
+        model._default_manager.in_bulk.assert_called_once_with([5, 3])  # Only the page's listings
+        self.assertEqual(list(results), ['listing 5', 'listing 1', 'listing 4'])
+
+
+class ListingCardTests(SimpleTestCase):
+
+    def test_card_for(self):
+        listing = PropertyListing(pk=1, address_streetNumber='1', address_street='Main St', address_suburb='BALLARAT',
+                                  address_state='VIC', address_postcode='3350', priceView='$500,000', bedrooms=3,
+                                  bathrooms=2, parking=1)
+        image = Image(pk=3, title='Front')
+        image.get_rendition = mock.Mock(return_value=mock.Mock(url='/media/images/front.jpg'))
+        agent = AgentPage(pk=5, title='Jo Smith')
+        listing.categories = [PropertyCategory(name=enums.CATEGORY_HOUSE), PropertyCategory(name=enums.CATEGORY_UNIT)]
+        listing.images = [ListingImage(image=None), ListingImage(image=image)]
+        listing.agents = [ListingAgent(agent=agent)]
+
+        with mock.patch.object(AgentPage, 'url', new_callable=mock.PropertyMock, return_value='/agents/jo-smith/'):
+            card = card_for(listing)
+
+        self.assertEqual(card.pk, 1)
+        self.assertEqual(card.address, listing.address_display_string())
+        self.assertEqual(card.url, listing.get_absolute_url())
+        self.assertEqual(card.category, enums.CATEGORY_HOUSE)
+        self.assertEqual((card.image_id, card.image_url), (3, '/media/images/front.jpg'))
+        self.assertEqual((card.agent_id, card.agent_name, card.agent_url), (5, 'Jo Smith', '/agents/jo-smith/'))
+        self.assertEqual((card.priceView, card.bedrooms, card.bathrooms, card.parking), ('$500,000', 3, 2, 1))
+
+    def test_card_results(self):
+        results = cards.card_results(CachedSearchResults(PropertyListing, [5, 3, 1], 3))
+        self.assertEqual((results.ids, results.count()), ([5, 3, 1], 3))
+        with mock.patch('realestate.listings.cards.get_cards', return_value=['card 3']) as get_cards:
+            self.assertEqual(results[1:2], ['card 3'])
+        get_cards.assert_called_once_with([3])
+
+    @mock.patch('realestate.listings.cards.transaction.on_commit')
+    def test_deferred(self, on_commit):
+        with cards.deferred():
+            cards.add([2, 1])
+            with cards.deferred():
+                cards.add([1, 3])
+            on_commit.assert_not_called()
+        on_commit.assert_called_once()
+        self.assertEqual(on_commit.call_args[0][0].args, ([1, 2, 3],))
+
+
+class CursorPaginatorTests(SimpleTestCase):
+
+    def test_ordering(self):
+        self.assertEqual(ordering(PropertyListing.objects.order_by('-price', 'created')),
+                         [('price', True), ('created', False), ('pk', False)])
+        self.assertEqual(ordering(PropertyListing.objects.order_by('-id', 'created')), [('pk', True)])
+        self.assertIsNone(ordering(PropertyListing.objects.order_by('?')))
+
+    def test_keyset_filter(self):
+        # Ascending, nulls are last: after a null price are only the rest of the null prices
+        self.assertEqual(keyset_filter(PropertyListing, [('price', False), ('pk', False)], [None, 5]),
+                         Q(price__isnull=True) & Q(pk__gt=5))
+        self.assertIsNone(keyset_filter(PropertyListing, [('price', False)], [None]))
+
+    def test_offset_pages(self):
+        paginator = CursorPaginator(list(range(5)), 2)
+        first = paginator.page('')
+        self.assertEqual((list(first), first.has_previous()), ([0, 1], False))
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(list(second), [2, 3])
+        self.assertEqual(list(paginator.page(second.previous_cursor)), [0, 1])
+        last = paginator.page(second.next_cursor)
+        self.assertEqual((list(last), last.has_next()), ([4], False))
+        # Tampered with, so the first page
+        self.assertEqual(list(paginator.page('x' + second.next_cursor)), [0, 1])
+
+    def test_page_context(self):
+        paginator = CursorPaginator(list(range(5)), 2)
+        first = paginator.page('')
+        request = RequestFactory().get('/search/', {'suburbs': 'BENTLEIGH', 'cursor': ''})
+        context = page_context(request, first)
+        self.assertEqual((context['next_cursor'], context['previous_url']), (first.next_cursor, None))
+        # The other parameters are kept
+        self.assertEqual(RequestFactory().get(context['next_url']).GET.dict(),
+                         {'suburbs': 'BENTLEIGH', 'cursor': first.next_cursor})
+        # Only counted if asked
+        self.assertFalse(context['show_count'])
+        request = RequestFactory().get('/search/', {'cursor': '', 'count': '1'})
+        self.assertTrue(page_context(request, first)['show_count'])
+
+
+class FacetTests(SimpleTestCase):
+
+    @mock.patch('realestate.listings.facets.FACET_PRICE_BANDS', [500000, 0, 1000000])
+    def test_price_bands(self):
+        self.assertEqual(facets.price_bands(), [(0, 499999), (500000, 999999), (1000000, None)])
+
+    @mock.patch('realestate.listings.facets.FACET_ROOMS', [1, 2])
+    @mock.patch('realestate.listings.facets.FACET_PRICE_BANDS', [0, 500000])
+    def test_elasticsearch_facets(self):
+        results = mock.Mock()
+        results.query_compiler.mapping.get_field_column_name.side_effect = lambda field: field + '_filter'
+        results.query_compiler._get_filterable_field.side_effect = lambda field_name: field_name
+        results._get_es_body.return_value = {'query': {'match_all': {}}}
+        results.backend.es.search.return_value = {'hits': {'total': 3}, 'aggregations': {
+            'bedrooms': {'buckets': [{'key': '1', 'doc_count': 3}, {'key': '2', 'doc_count': 2}]},
+            'bathrooms': {'buckets': [{'key': '1', 'doc_count': 3}, {'key': '2', 'doc_count': 0}]},
+            'price': {'buckets': [{'key': '0', 'doc_count': 1}, {'key': '1', 'doc_count': 2}]},
+            'categories': {'buckets': [{'key': enums.CATEGORY_HOUSE, 'doc_count': 3}]},
+            'property_class': {'buckets': [{'key': enums.PROPERTY_CLASS_RESIDENTIAL, 'doc_count': 3}]},
+            'suburbs': {'buckets': [{'key': 'BALLARAT', 'doc_count': 2}, {'key': 'SEBASTOPOL', 'doc_count': 1}]},
+        }}
+
+        result = facets.elasticsearch_facets(results)
+
+        results.backend.es.search.assert_called_once()  # Every facet in one request
+        self.assertEqual(result['count'], 3)
+        self.assertEqual([(band['min'], band['max'], band['count']) for band in result['price']],
+                         [(0, 499999, 1), (500000, None, 2)])
+        self.assertEqual([(rooms['value'], rooms['count']) for rooms in result['bedrooms']], [(1, 3), (2, 2)])
+        self.assertEqual([suburb['value'] for suburb in result['suburbs']], ['BALLARAT', 'SEBASTOPOL'])
+        price_ranges = results.backend.es.search.call_args[1]['body']['aggregations']['price']['range']['ranges']
+        self.assertEqual(price_ranges, [{'key': '0', 'from': 0, 'to': 500000}, {'key': '1', 'from': 500000}])
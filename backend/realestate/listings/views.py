@@ -8,7 +8,8 @@ from wagtail.search.backends import get_search_backend
 from .forms import ListingInspectionSearchForm, ListingAuctionSearchForm, ListingSearchForm
 from realestate.enquiries.forms import ListingEnquiryForm
 from .settings import DEFAULT_PER_PAGE
-from .models import PropertyListing
+from .models import PropertyListing, ListingAgent
+from .pagination import CursorPaginator, page_context
 
 try:
     from realestate.agents.models import AgentPage
@@ -26,6 +27,8 @@ class ListingSearchView(FormView):
     per_page = DEFAULT_PER_PAGE
     per_page_kwarg = 'per_page'
     page_kwarg = 'page'
+    cursor_kwarg = 'cursor'
+    count_kwarg = 'count'
     template_name = "listings/search.html"
 
     def get_per_page(self):
@@ -34,6 +37,12 @@ class ListingSearchView(FormView):
     def get_page_number(self):
         return self.kwargs.get(self.page_kwarg, 1)
 
+    def get_cursor(self):
+        """
+        The cursor of the page to show, '' for the first, or None to paginate by page number
+        """
+        return self.request.GET.get(self.cursor_kwarg)
+
     def get_form_kwargs(self):
         kwargs = super(ListingSearchView, self).get_form_kwargs()
         kwargs['initial'] = kwargs['initial'].update(self.kwargs)
@@ -41,12 +50,21 @@ class ListingSearchView(FormView):
         return kwargs
 
     def get_listings(self):
-        return self.get_form().as_search()
+        # The listings themselves, rather than their cards, as the templates show any of their fields
+        return self.get_form().cached_search()
+
+    def get_cursor_paginator(self):
+        return self.get_form().cursor_paginator(self.get_per_page())
 
     def get_context_data(self, **kwargs):
         context = super(ListingSearchView, self).get_context_data(**kwargs)
-        listing_paginator = Paginator(self.get_listings(), self.get_per_page())
-        context['listings'] = listing_paginator.get_page(self.get_page_number())
+        cursor = self.get_cursor()
+        if cursor is None:
+            listing_paginator = Paginator(self.get_listings(), self.get_per_page())
+            context['listings'] = listing_paginator.get_page(self.get_page_number())
+        else:
+            context['listings'] = self.get_cursor_paginator().page(cursor)
+        context.update(page_context(self.request, context['listings'], self.cursor_kwarg, self.count_kwarg))
         context['form'] = self.get_form()
         if context['form'].data.get('agent') and AgentPage:
             try:
@@ -69,29 +87,25 @@ class ListingAutocompleteView(ListingSearchView):
             # We don't want people spamming for full result sets
             return context
 
-        listings = self.get_form().as_search()
-        try:
-            context['autocomplete'] = {
-                'suburbs': listings.values_list('address_suburb', flat=True).distinct(),
-                'postcodes': listings.values_list('address_postcode', flat=True).distinct(),
-            }
-        except AttributeError:
-            # Thrown if listings is an Elasticsearch response
-            unique_suburbs_in_order = []
-            for i in listings:
-                if i.address_suburb not in unique_suburbs_in_order:
-                    unique_suburbs_in_order.append(i.address_suburb)
-
-            context['autocomplete'] = {
-                'suburbs': unique_suburbs_in_order,
-                'postcodes': sorted(list(set([i.address_postcode for i in listings])))
-            }
-
-        context['autocomplete']['properties'] = [(i.get_absolute_url(), i.address_display_string()) for i in listings]
-        agents = []
-        for listing in listings:
-            agents += [(i.agent.get_url(), i.agent.title) for i in listing.agents.all()]
-        context['autocomplete']['agents'] = agents
+        # The cards have what's shown of each listing, rather than a query or two per listing for it
+        listings = list(self.get_form().card_search())
+        unique_suburbs_in_order = []
+        for i in listings:
+            if i.address_suburb not in unique_suburbs_in_order:
+                unique_suburbs_in_order.append(i.address_suburb)
+
+        context['autocomplete'] = {
+            'suburbs': unique_suburbs_in_order,
+            'postcodes': sorted(list(set([i.address_postcode for i in listings]))),
+            'properties': [(i.url, i.address) for i in listings],
+        }
+        listing_agents = defaultdict(list)
+        for listing_agent in ListingAgent.objects.filter(
+                listing_id__in=[i.pk for i in listings]).select_related('agent'):
+            listing_agents[listing_agent.listing_id].append(listing_agent.agent)
+        context['autocomplete']['agents'] = [
+            (agent.get_url(), agent.title) for listing in listings for agent in listing_agents[listing.pk]
+        ]
 
         return context
 
@@ -103,10 +117,13 @@ class ListingInspectionSearchView(ListingSearchView):
     def get_listings(self):
         return self.get_form().as_search()
 
+    def get_cursor_paginator(self):
+        return CursorPaginator(self.get_listings(), self.get_per_page())
+
     def get_context_data(self, **kwargs):
         context = super(ListingInspectionSearchView, self).get_context_data(**kwargs)
-        listing_paginator = Paginator(self.get_listings(), self.get_per_page())
-        context['inspections'] = listing_paginator.get_page(self.get_page_number())
+        # The page of inspections, as paginated by ListingSearchView
+        context['inspections'] = context['listings']
         return context
 
 
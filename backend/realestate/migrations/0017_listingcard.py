@@ -0,0 +1,39 @@
+# Generated by Django 2.1 on 2018-09-20 02:14
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0021_image_file_hash'),
+        ('agents', '0009_agentpage_source_hash'),
+        ('realestate', '0016_propertylisting_source_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingCard',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='realestate.PropertyListing')),
+                ('address', models.TextField(blank=True, default='')),
+                ('url', models.CharField(blank=True, default='', max_length=500)),
+                ('address_suburb', models.CharField(blank=True, default='', max_length=100)),
+                ('address_postcode', models.CharField(blank=True, default='', max_length=100)),
+                ('category', models.CharField(blank=True, default='', max_length=100)),
+                ('image_url', models.CharField(blank=True, default='', max_length=500)),
+                ('agent_name', models.CharField(blank=True, default='', max_length=255)),
+                ('agent_url', models.CharField(blank=True, default='', max_length=500)),
+                ('priceView', models.CharField(blank=True, default='', max_length=255)),
+                ('bedrooms', models.IntegerField(default=0)),
+                ('bathrooms', models.IntegerField(default=0)),
+                ('parking', models.IntegerField(default=0)),
+                ('location', django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='agents.AgentPage')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wagtailimages.Image')),
+            ],
+        ),
+    ]
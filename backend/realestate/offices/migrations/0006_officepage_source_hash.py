@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2018-09-12 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offices', '0005_officeservicingpostcodes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='officepage',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Fingerprint of the last imported source data', max_length=64),
+        ),
+    ]
@@ -21,6 +21,8 @@ class OfficeBase(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     source_id = models.CharField(max_length=50, blank=True, default="")
+    source_hash = models.CharField(max_length=64, blank=True, default="", editable=False,
+                                   help_text="Fingerprint of the last imported source data")
     office_name = models.CharField(max_length=255, unique=True)
     address = models.CharField(max_length=100, blank=True, default="")
     suburb = models.CharField(max_length=50, blank=True, default="")
@@ -1,9 +1,10 @@
-from .listings.api import ListingViewSet
+from .listings.api import ListingViewSet, ListingFacetViewSet
 from .alerts.api.views import PropertyAlertViewset
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
 router.register(r'properties', ListingViewSet, base_name='property')
+router.register(r'facets', ListingFacetViewSet, base_name='facet')
 router.register(r'alerts', PropertyAlertViewset, base_name='alert')
 
 
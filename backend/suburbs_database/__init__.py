@@ -0,0 +1 @@
+default_app_config = 'suburbs_database.apps.SuburbsDatabaseConfig'
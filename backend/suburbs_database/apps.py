@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class SuburbsDatabaseConfig(AppConfig):
     name = 'suburbs_database'
+
+    def ready(self):
+        from .graph import invalidate_suburb_graph
+        from .models import SuburbData
+
+        # The in-memory suburb graph (graph.py) is rebuilt once the suburbs change
+        post_save.connect(invalidate_suburb_graph, sender=SuburbData)
+        post_delete.connect(invalidate_suburb_graph, sender=SuburbData)
@@ -0,0 +1,110 @@
+"""
+An in-memory graph of the suburbs and the suburbs bordering them, for expanding a search to the surrounding suburbs
+without a query.
+
+get_suburb_graph() builds the graph from SuburbData once per process, with a single query. Saving or deleting a
+SuburbData invalidates it: straight away in that process, and in the others when they next check the shared
+version in the cache, at most SUBURB_GRAPH_CHECK_INTERVAL seconds later (with a shared cache, i.e Redis).
+"""
+
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from .models import SuburbData
+
+# Seconds between each process checking whether the suburbs have changed since it built its graph
+CHECK_INTERVAL = getattr(settings, 'SUBURB_GRAPH_CHECK_INTERVAL', 60)
+
+VERSION_KEY = 'suburbs:graph:version'
+
+_graph = None
+_lock = threading.Lock()
+
+
+def normalise(name):
+    """
+    Suburb names are matched as name__iexact would, less surrounding whitespace
+    """
+    return name.strip().upper()
+
+
+class SuburbGraph:
+
+    def __init__(self, suburbs, version=None):
+        """
+        params:
+            suburbs (iterable): (id, name, state code, bordering suburb ids)
+            version: Of the suburbs, see get_suburb_graph
+        """
+        self.version = version
+        self.checked = time.monotonic()
+        self.names = {}  # Id -> name
+        self.states = {}  # Id -> state code
+        self.neighbours = {}  # Id -> bordering ids
+        self.ids = defaultdict(list)  # Normalised name -> ids, as names repeat between states
+        for suburb_id, name, state_code, bordering in suburbs:
+            self.names[suburb_id] = name
+            self.states[suburb_id] = state_code
+            self.neighbours[suburb_id] = tuple(bordering or ())
+            self.ids[normalise(name)].append(suburb_id)
+
+    @classmethod
+    def from_database(cls, version=None):
+        return cls(SuburbData.objects.order_by().values_list('id', 'name', 'state_code', 'bordering_locations'),
+                   version=version)
+
+    def find(self, names, state=None):
+        """
+        The ids of the suburbs named (in state, if given)
+        """
+        return {suburb_id for name in names for suburb_id in self.ids.get(normalise(name), ())
+                if not state or self.states[suburb_id] == state}
+
+    def surrounding(self, names, state=None, hops=1):
+        """
+        The names of the suburbs within hops borders of the suburbs named (in state, if given). With one hop, the
+        suburbs bordering them. The named suburbs are only included if they border another.
+        """
+        reached = set()
+        frontier = self.find(names, state)
+        for _ in range(hops):
+            frontier = {neighbour for suburb_id in frontier for neighbour in self.neighbours.get(suburb_id, ())
+                        if neighbour not in reached}
+            if not frontier:
+                break
+            reached |= frontier
+        return {self.names[suburb_id] for suburb_id in reached if suburb_id in self.names}
+
+
+def get_suburb_graph():
+    """
+    This process's SuburbGraph, built the first time it's needed and again once the suburbs have changed
+    """
+    global _graph
+    graph = _graph
+    if graph is not None and time.monotonic() - graph.checked < CHECK_INTERVAL:
+        return graph
+
+    version = cache.get(VERSION_KEY)
+    with _lock:
+        if _graph is None or _graph.version != version:
+            _graph = SuburbGraph.from_database(version)
+        else:
+            _graph.checked = time.monotonic()
+        return _graph
+
+
+def invalidate_suburb_graph(**kwargs):
+    """
+    Have every process rebuild its graph. Takes (and ignores) the signal's arguments, as the post_save and
+    post_delete receiver of SuburbData.
+    """
+    global _graph
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Started from the time so a version already used isn't used again
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+    _graph = None
@@ -1,3 +1,24 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .graph import SuburbGraph
+
+
+class SuburbGraphTests(SimpleTestCase):
+
+    def setUp(self):
+        # Bondi - Bondi Junction - Waverley - Bronte, and a Bondi in another state
+        self.graph = SuburbGraph([
+            (1, 'Bondi', 'NSW', [2]),
+            (2, 'Bondi Junction', 'NSW', [1, 3]),
+            (3, 'Waverley', 'NSW', [2, 4]),
+            (4, 'Bronte', 'NSW', [3]),
+            (5, 'Bondi', 'VIC', [6]),
+            (6, 'Elsewhere', 'VIC', [5]),
+        ])
+
+    def test_surrounding(self):
+        self.assertEqual(self.graph.surrounding([' bondi'], state='NSW'), {'Bondi Junction'})
+        self.assertEqual(self.graph.surrounding(['Bondi']), {'Bondi Junction', 'Elsewhere'})
+        self.assertEqual(self.graph.surrounding(['Bondi'], state='NSW', hops=2),
+                         {'Bondi', 'Bondi Junction', 'Waverley'})
+        self.assertEqual(self.graph.surrounding(['Nowhere']), set())